@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, status
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from core.auth import authenticate, create_access_token, TOKEN_TTL
+
+router = APIRouter()
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+@router.post("/auth/login", response_model=TokenResponse)
+async def login(login_data: LoginRequest):
+    """管理员登录：验证一次密码哈希，签发有过期时间的令牌"""
+    # bcrypt 较慢，放到线程池中执行，避免阻塞事件循环
+    if not await run_in_threadpool(authenticate, login_data.username, login_data.password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="用户名或密码错误",
+        )
+    return TokenResponse(
+        access_token=create_access_token(login_data.username),
+        expires_in=TOKEN_TTL
+    )
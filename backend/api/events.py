@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from typing import List
+import asyncio
+from core.aio import run_io
+from core.auth import verify_admin, verify_admin_query_token, create_events_token, EVENTS_TOKEN_TTL
+from core.events import event_bus, format_sse, load_all_updates, load_updates, TaskUpdate, ALL_TASKS
+from models.schemas import TaskStatus
+
+router = APIRouter()
+
+# 没有更新时发送注释行的间隔（秒），防止代理因连接空闲而断开
+KEEPALIVE_INTERVAL = 15
+
+# 断线后浏览器重连前等待的时间（毫秒）
+RECONNECT_DELAY_MS = 3000
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # 关闭 nginx 的响应缓冲，否则事件会被攒在代理里
+    "X-Accel-Buffering": "no",
+}
+
+async def event_stream(topic: str, queue: asyncio.Queue, initial: List[str], public: bool):
+    """先发送当前状态，之后每次任务变化发送一条消息；任务被删除或服务器关闭时结束，公开的推送在任务关闭时也结束"""
+    try:
+        yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+        for message in initial:
+            yield message
+        while True:
+            try:
+                update: TaskUpdate = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if update is None:
+                break
+            yield update.public_message if public else update.admin_message
+            if public and (update.deleted or update.task.status != TaskStatus.ACTIVE):
+                break
+    finally:
+        event_bus.unsubscribe(topic, queue)
+
+@router.post("/token")
+async def issue_events_token(username: str = Depends(verify_admin)):
+    """签发实时推送令牌（管理员）：有效期很短，只能用于 GET /api/events/tasks 的查询参数 token"""
+    return {"token": await run_io(create_events_token, username), "expires_in": EVENTS_TOKEN_TTL}
+
+@router.get("/tasks")
+async def task_list_events(username: str = Depends(verify_admin_query_token)):
+    """任务列表的实时更新（Server-Sent Events，管理员）
+
+    - 连接后先发送 snapshot 事件（全部任务，字段与任务列表接口相同，另含 uploaded_users_count）
+    - 之后任务创建、上传文件、状态变化时发送 task 事件，删除时发送 deleted 事件
+    - EventSource 无法设置请求头，可以用查询参数 token 传递 POST /api/events/token 签发的短期令牌（不接受登录令牌）
+    """
+    # 先订阅再读取快照，两者之间发生的变化不会丢失（最多重复推送一次）
+    queue = event_bus.subscribe(ALL_TASKS)
+    try:
+        updates = await run_io(load_all_updates)
+    except BaseException:
+        event_bus.unsubscribe(ALL_TASKS, queue)
+        raise
+    snapshot = format_sse("snapshot", [update.admin_data() for update in updates])
+    return StreamingResponse(
+        event_stream(ALL_TASKS, queue, [snapshot], public=False),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@router.get("/tasks/{task_id}")
+async def task_events(task_id: str):
+    """单个任务的实时统计（Server-Sent Events，上传页面使用，不需要认证）
+
+    - 连接后先发送一条 task 事件（字段与 /api/tasks/{task_id}/info 相同），之后每次变化再发送
+    - 任务被删除时发送 deleted 事件并结束；任务被关闭时发送最后一条 task 事件后结束
+    - 与 /info 一样只对活跃的任务开放，已关闭的任务返回 400
+    """
+    queue = event_bus.subscribe(task_id)
+    try:
+        update = (await run_io(load_updates, [task_id]))[0]
+    except BaseException:
+        event_bus.unsubscribe(task_id, queue)
+        raise
+    if update.deleted:
+        event_bus.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if update.task.status != TaskStatus.ACTIVE:
+        event_bus.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=400, detail="任务已关闭，无法上传文件")
+    return StreamingResponse(
+        event_stream(task_id, queue, [update.public_message], public=True),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
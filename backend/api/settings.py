@@ -1,15 +1,28 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from pydantic import BaseModel
-from typing import Optional, List
-import json
-import os
-from core.auth import verify_admin
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
+import secrets
+from starlette.concurrency import run_in_threadpool
+from core.auth import verify_admin, verify_password, pwd_context, create_access_token, TOKEN_TTL
+from core.aio import run_io
+from core.config import config_service, UploadSettings
+from core.whitelist import whitelist_store, iter_upload_lines
 
 router = APIRouter()
 public_router = APIRouter()
 
-# 获取配置文件路径
-config_path = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+# 上传准入控制的设置项（见 core/admission.py）
+ADMISSION_SETTINGS = (
+    "max_concurrent_uploads",
+    "max_upload_bytes_in_flight",
+    "upload_queue_size",
+    "upload_queue_timeout",
+    "ip_upload_rate",
+    "ip_upload_burst",
+    "uploader_upload_rate",
+    "uploader_upload_burst",
+    "disk_low_water_mark",
+)
 
 class PasswordChange(BaseModel):
     current_password: str
@@ -20,6 +33,18 @@ class SettingsUpdate(BaseModel):
     max_files_per_upload: Optional[int] = None
     max_upload_errors: Optional[int] = None
     max_uploads_per_user: Optional[int] = None  # 每人上传次数限制
+    upload_concurrency: Optional[int] = Field(None, ge=1)  # 同一批次中同时写入的文件数
+    write_chunk_size: Optional[int] = Field(None, ge=4, le=65536)  # KB，攒够多少数据写一次磁盘
+    fsync_policy: Optional[Literal["none", "file", "batch"]] = None  # 文件写完后是否及如何 fsync
+    max_concurrent_uploads: Optional[int] = Field(None, ge=0)  # 同时接收的上传请求数上限（每个 worker 进程）
+    max_upload_bytes_in_flight: Optional[int] = Field(None, ge=0)  # MB，同时接收的上传请求总字节数上限（每个 worker 进程）
+    upload_queue_size: Optional[int] = Field(None, ge=0)  # 超过上限时最多排队的请求数，0 表示不排队
+    upload_queue_timeout: Optional[int] = Field(None, ge=0)  # 秒，排队等待的最长时间
+    ip_upload_rate: Optional[int] = Field(None, ge=0)  # 每个 IP 每分钟最多开始的上传数
+    ip_upload_burst: Optional[int] = Field(None, ge=0)  # 每个 IP 允许的突发上传数
+    uploader_upload_rate: Optional[int] = Field(None, ge=0)  # 每个上传者每分钟最多开始的上传数
+    uploader_upload_burst: Optional[int] = Field(None, ge=0)  # 每个上传者允许的突发上传数
+    disk_low_water_mark: Optional[int] = Field(None, ge=0)  # MB，uploads/ 所在磁盘至少保留的可用空间
     upload_whitelist: Optional[List[str]] = None  # 上传者白名单
 
 class WhitelistToggle(BaseModel):
@@ -30,7 +55,24 @@ class SettingsResponse(BaseModel):
     max_files_per_upload: Optional[int] = None
     max_upload_errors: Optional[int] = None
     max_uploads_per_user: Optional[int] = None  # 每人上传次数限制
-    upload_whitelist: Optional[List[str]] = None  # 上传者白名单
+    upload_concurrency: Optional[int] = None  # 同一批次中同时写入的文件数
+    write_chunk_size: Optional[int] = None  # KB
+    fsync_policy: Optional[str] = None
+    max_concurrent_uploads: Optional[int] = None
+    max_upload_bytes_in_flight: Optional[int] = None
+    upload_queue_size: Optional[int] = None
+    upload_queue_timeout: Optional[int] = None
+    ip_upload_rate: Optional[int] = None
+    ip_upload_burst: Optional[int] = None
+    uploader_upload_rate: Optional[int] = None
+    uploader_upload_burst: Optional[int] = None
+    disk_low_water_mark: Optional[int] = None  # MB
+    upload_whitelist_enabled: Optional[bool] = None  # 是否启用白名单
+    upload_whitelist_count: Optional[int] = None  # 白名单人数（名单本身通过单独的接口获取）
+
+class WhitelistResponse(BaseModel):
+    total: int
+    names: List[str]
 
 class PublicSettingsResponse(BaseModel):
     max_file_size: Optional[int] = None  # MB
@@ -39,156 +81,194 @@ class PublicSettingsResponse(BaseModel):
     max_uploads_per_user: Optional[int] = None  # 每人上传次数限制
     upload_whitelist_enabled: Optional[bool] = None  # 是否启用白名单
 
-def load_config():
-    """加载配置文件"""
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+def build_settings_response(settings: UploadSettings) -> SettingsResponse:
+    """根据配置快照生成设置响应（会读取白名单文件，在 I/O 线程池中调用）"""
+    return SettingsResponse(
+        max_file_size=settings.max_file_size,
+        max_files_per_upload=settings.max_files_per_upload,
+        max_upload_errors=settings.max_upload_errors,
+        max_uploads_per_user=settings.max_uploads_per_user,
+        upload_concurrency=settings.upload_concurrency,
+        write_chunk_size=settings.write_chunk_size,
+        fsync_policy=settings.fsync_policy,
+        max_concurrent_uploads=settings.max_concurrent_uploads,
+        max_upload_bytes_in_flight=settings.max_upload_bytes_in_flight,
+        upload_queue_size=settings.upload_queue_size,
+        upload_queue_timeout=settings.upload_queue_timeout,
+        ip_upload_rate=settings.ip_upload_rate,
+        ip_upload_burst=settings.ip_upload_burst,
+        uploader_upload_rate=settings.uploader_upload_rate,
+        uploader_upload_burst=settings.uploader_upload_burst,
+        disk_low_water_mark=settings.disk_low_water_mark,
+        upload_whitelist_enabled=whitelist_store.enabled,
+        upload_whitelist_count=len(whitelist_store)
+    )
 
-def save_config(config):
-    """保存配置文件"""
-    with open(config_path, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
+def current_settings_response() -> SettingsResponse:
+    """当前配置的设置响应"""
+    return build_settings_response(config_service.get().settings)
 
 @router.get("/settings", response_model=SettingsResponse)
 async def get_settings(username: str = Depends(verify_admin)):
     """获取系统设置"""
-    config = load_config()
-    settings = config.get("settings", {})
-    return SettingsResponse(
-        max_file_size=settings.get("max_file_size"),
-        max_files_per_upload=settings.get("max_files_per_upload"),
-        max_upload_errors=settings.get("max_upload_errors"),
-        max_uploads_per_user=settings.get("max_uploads_per_user"),
-        upload_whitelist=settings.get("upload_whitelist")
-    )
+    return await run_io(current_settings_response)
 
 @public_router.get("/settings/public", response_model=PublicSettingsResponse)
 async def get_public_settings():
     """获取公开的系统设置（供上传页面显示限制信息）"""
-    config = load_config()
-    settings = config.get("settings", {})
-    # 只返回是否启用白名单，而不返回具体名单
-    upload_whitelist = settings.get("upload_whitelist")
-    upload_whitelist_enabled = bool(upload_whitelist and len(upload_whitelist) > 0)
+    def build():
+        settings = config_service.get().settings
+        # 只返回是否启用白名单，而不返回具体名单
+        return PublicSettingsResponse(
+            max_file_size=settings.max_file_size,
+            max_files_per_upload=settings.max_files_per_upload,
+            max_upload_errors=settings.max_upload_errors,
+            max_uploads_per_user=settings.max_uploads_per_user,
+            upload_whitelist_enabled=whitelist_store.enabled
+        )
     
-    return PublicSettingsResponse(
-        max_file_size=settings.get("max_file_size"),
-        max_files_per_upload=settings.get("max_files_per_upload"),
-        max_upload_errors=settings.get("max_upload_errors"),
-        max_uploads_per_user=settings.get("max_uploads_per_user"),
-        upload_whitelist_enabled=upload_whitelist_enabled
-    )
+    return await run_io(build)
 
 @router.put("/settings", response_model=SettingsResponse)
 async def update_settings(settings: SettingsUpdate, username: str = Depends(verify_admin)):
     """更新系统设置"""
-    config = load_config()
-    
-    # 如果没有设置部分，创建一个空的
-    if "settings" not in config:
-        config["settings"] = {}
-    
-    # 更新设置
-    if settings.max_file_size is not None:
-        config["settings"]["max_file_size"] = settings.max_file_size
-    
-    if settings.max_files_per_upload is not None:
-        config["settings"]["max_files_per_upload"] = settings.max_files_per_upload
+    def apply(config: dict):
+        # 如果没有设置部分，创建一个空的
+        if "settings" not in config:
+            config["settings"] = {}
         
-    if settings.max_upload_errors is not None:
-        config["settings"]["max_upload_errors"] = settings.max_upload_errors
+        # 更新设置
+        if settings.max_file_size is not None:
+            config["settings"]["max_file_size"] = settings.max_file_size
         
-    if settings.max_uploads_per_user is not None:
-        config["settings"]["max_uploads_per_user"] = settings.max_uploads_per_user
+        if settings.max_files_per_upload is not None:
+            config["settings"]["max_files_per_upload"] = settings.max_files_per_upload
+            
+        if settings.max_upload_errors is not None:
+            config["settings"]["max_upload_errors"] = settings.max_upload_errors
+            
+        if settings.max_uploads_per_user is not None:
+            config["settings"]["max_uploads_per_user"] = settings.max_uploads_per_user
         
-    if settings.upload_whitelist is not None:
-        config["settings"]["upload_whitelist"] = settings.upload_whitelist
+        if settings.upload_concurrency is not None:
+            config["settings"]["upload_concurrency"] = settings.upload_concurrency
+        
+        if settings.write_chunk_size is not None:
+            config["settings"]["write_chunk_size"] = settings.write_chunk_size
+        
+        if settings.fsync_policy is not None:
+            config["settings"]["fsync_policy"] = settings.fsync_policy
+        
+        # 上传准入控制，修改后对新的上传请求立即生效
+        for name in ADMISSION_SETTINGS:
+            value = getattr(settings, name)
+            if value is not None:
+                config["settings"][name] = value
     
-    # 保存配置
-    save_config(config)
+    # 原子地保存配置
+    snapshot = await run_io(config_service.update, apply)
     
-    return SettingsResponse(
-        max_file_size=config["settings"].get("max_file_size"),
-        max_files_per_upload=config["settings"].get("max_files_per_upload"),
-        max_upload_errors=config["settings"].get("max_upload_errors"),
-        max_uploads_per_user=config["settings"].get("max_uploads_per_user"),
-        upload_whitelist=config["settings"].get("upload_whitelist")
-    )
+    # 白名单单独保存
+    if settings.upload_whitelist is not None:
+        await run_io(whitelist_store.replace, settings.upload_whitelist)
+    
+    return await run_io(build_settings_response, snapshot.settings)
 
 # 新增接口：控制白名单启用/禁用状态
 @router.put("/settings/upload-whitelist-toggle")
 async def toggle_upload_whitelist(toggle: WhitelistToggle, username: str = Depends(verify_admin)):
     """启用或禁用上传白名单"""
-    config = load_config()
-    
-    # 如果没有设置部分，创建一个空的
-    if "settings" not in config:
-        config["settings"] = {}
-    
-    # 获取当前白名单
-    current_whitelist = config["settings"].get("upload_whitelist", [])
-    
-    if toggle.enabled:
-        # 启用白名单 - 如果当前没有白名单，则创建一个空的白名单
-        if not current_whitelist:
-            config["settings"]["upload_whitelist"] = []
-    else:
-        # 禁用白名单 - 清空调名单
-        config["settings"]["upload_whitelist"] = []
-    
-    # 保存配置
-    save_config(config)
+    # 名单为空即表示未启用；禁用白名单 - 清空名单，启用时保留现有名单
+    if not toggle.enabled:
+        await run_io(whitelist_store.clear)
     
     return {
         "enabled": toggle.enabled,
         "message": f"白名单已{'启用' if toggle.enabled else '禁用'}"
     }
 
+@router.get("/settings/upload-whitelist", response_model=WhitelistResponse)
+async def get_upload_whitelist(offset: int = 0, limit: Optional[int] = None, username: str = Depends(verify_admin)):
+    """获取白名单（支持分页）"""
+    def build():
+        return WhitelistResponse(
+            total=len(whitelist_store),
+            names=whitelist_store.list_names(offset, limit)
+        )
+    
+    return await run_io(build)
+
 # 新增接口：上传并解析白名单文件
 @router.post("/settings/upload-whitelist-file")
-async def upload_whitelist_file(file: UploadFile = File(...), username: str = Depends(verify_admin)):
-    """上传并解析白名单文件"""
+async def upload_whitelist_file(
+    file: UploadFile = File(...),
+    mode: str = Form("replace", description="replace: 替换整个名单；add: 追加；remove: 从名单中移除"),
+    username: str = Depends(verify_admin)
+):
+    """上传并解析白名单文件（逐行解析，不把整个文件读入内存）"""
+    if mode not in ("replace", "add", "remove"):
+        raise HTTPException(status_code=400, detail="mode 只能是 replace、add 或 remove")
+    
     try:
-        # 读取文件内容
-        content = await file.read()
-        content_str = content.decode('utf-8')
-        
-        # 按行分割并清理空白字符
-        whitelist = [line.strip() for line in content_str.split('\n') if line.strip()]
-        
-        # 去重
-        whitelist = list(set(whitelist))
+        if mode == "replace":
+            # 按批次写入临时文件，全部写完后再原子地替换名单
+            staging = await run_io(whitelist_store.staging)
+            try:
+                batch = []
+                async for line in iter_upload_lines(file):
+                    batch.append(line)
+                    if len(batch) >= 10000:
+                        await run_io(staging.write, batch)
+                        batch = []
+                await run_io(staging.write, batch)
+                count = await run_io(staging.commit)
+            except BaseException:
+                await run_io(staging.abort)
+                raise
+            return {"message": "白名单文件上传成功", "count": count, "added": count, "removed": 0}
         
-        # 保存到配置
-        config = load_config()
-        if "settings" not in config:
-            config["settings"] = {}
-        config["settings"]["upload_whitelist"] = whitelist
-        save_config(config)
+        # 追加/移除按批次增量应用
+        added = removed = 0
+        batch = []
+        async for line in iter_upload_lines(file):
+            batch.append(line)
+            if len(batch) >= 10000:
+                a, r = await run_io(whitelist_store.apply_changes, **{mode: batch})
+                added, removed, batch = added + a, removed + r, []
+        if batch:
+            a, r = await run_io(whitelist_store.apply_changes, **{mode: batch})
+            added, removed = added + a, removed + r
         
-        return {"message": "白名单文件上传成功", "whitelist": whitelist}
+        return {"message": "白名单文件上传成功", "count": len(whitelist_store), "added": added, "removed": removed}
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="文件必须是 UTF-8 编码的文本文件")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件处理失败: {str(e)}")
 
 @router.put("/settings/password")
 async def change_password(password_data: PasswordChange, username: str = Depends(verify_admin)):
     """修改管理员密码"""
-    config = load_config()
-    
     # 验证当前密码
-    admin_config = config.get("admin", {})
-    current_password = admin_config.get("password")
+    password_hash = (await run_io(config_service.get)).admin.password_hash
     
-    if current_password != password_data.current_password:
+    if not await run_in_threadpool(verify_password, password_data.current_password, password_hash):
         raise HTTPException(status_code=400, detail="当前密码错误")
     
-    # 更新密码
-    config["admin"]["password"] = password_data.new_password
+    # 更新密码哈希，并更换签名密钥使旧令牌全部失效
+    new_password_hash = await run_in_threadpool(pwd_context.hash, password_data.new_password)
+    
+    def apply(config: dict):
+        admin = config.setdefault("admin", {})
+        admin.pop("password", None)
+        admin["password_hash"] = new_password_hash
+        admin["secret_key"] = secrets.token_urlsafe(32)
     
     # 保存配置
-    save_config(config)
+    await run_io(config_service.update, apply)
     
-    return {"message": "密码修改成功"}
\ No newline at end of file
+    # 返回新令牌，当前会话无需重新登录
+    return {
+        "message": "密码修改成功",
+        "access_token": create_access_token(username),
+        "expires_in": TOKEN_TTL
+    }
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks
 from typing import List
 import os
-from models.schemas import TaskCreate, TaskResponse, TaskStatus, UploadTaskInfo
-from core.storage import task_storage
+from models.schemas import TaskCreate, TaskResponse, TaskStatus, UploadTaskInfo, TaskBatchCreate, TaskBatchStatus, TaskBatchDelete
+from core.aio import async_storage, run_io
+from core.dedup import dedup_task
+from core.archive import archiver, set_task_status, set_tasks_status
+from core.deletion import folder_deleter, deletion_progress
+from core.events import event_bus
+from core.fileio import remove_stale_temp_files
 
 router = APIRouter()
 public_router = APIRouter()
@@ -10,7 +15,7 @@ public_router = APIRouter()
 @public_router.get("/{task_id}/info", response_model=UploadTaskInfo)
 async def get_upload_task_info(task_id: str):
     """获取上传任务信息（用于上传页面）"""
-    task = task_storage.get_task(task_id)
+    task = await async_storage.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
@@ -18,7 +23,7 @@ async def get_upload_task_info(task_id: str):
         raise HTTPException(status_code=400, detail="任务已关闭，无法上传文件")
     
     # 获取实际的文件数量和上传人数
-    actual_file_count, actual_users_count = task_storage.get_actual_counts(task.folder_path)
+    actual_file_count, actual_users_count = await async_storage.get_actual_counts(task.id)
     
     return UploadTaskInfo(
         task_id=task.id,
@@ -33,7 +38,8 @@ async def get_upload_task_info(task_id: str):
 async def create_task(task: TaskCreate):
     """创建新的上传任务"""
     try:
-        new_task = task_storage.create_task(task.name, task.description)
+        new_task = await async_storage.create_task(task.name, task.description)
+        event_bus.publish(new_task.id)
         return new_task
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建任务失败: {str(e)}")
@@ -42,31 +48,113 @@ async def create_task(task: TaskCreate):
 async def get_all_tasks():
     """获取所有任务列表"""
     try:
-        tasks = task_storage.get_all_tasks()
+        tasks = await async_storage.get_all_tasks()
         return tasks
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取任务列表失败: {str(e)}")
 
+@router.post("/batch", response_model=List[TaskResponse])
+async def create_tasks(batch: TaskBatchCreate):
+    """批量创建任务（一次提交）"""
+    try:
+        tasks = await async_storage.create_tasks([(task.name, task.description) for task in batch.tasks])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建任务失败: {str(e)}")
+    for task in tasks:
+        event_bus.publish(task.id)
+    return tasks
+
+@router.put("/batch/status")
+async def update_tasks_status(batch: TaskBatchStatus):
+    """批量更新任务状态（一次提交），返回更新的任务和不存在的任务 ID"""
+    tasks = await run_io(set_tasks_status, batch.task_ids, batch.status)
+    for task in tasks:
+        event_bus.publish(task.id)
+    if batch.status == TaskStatus.COMPLETED:
+        archiver.trigger()
+    found = {task.id for task in tasks}
+    return {
+        "updated": tasks,
+        "not_found": [task_id for task_id in dict.fromkeys(batch.task_ids) if task_id not in found]
+    }
+
+@router.post("/batch/delete")
+async def delete_tasks(batch: TaskBatchDelete):
+    """批量删除任务（一次提交）
+
+    - 任务立即从列表中消失，任务目录由后台分批删除，进度见 GET /api/tasks/deletions
+    """
+    deleted = await async_storage.delete_tasks(list(dict.fromkeys(batch.task_ids)))
+    for task_id in deleted:
+        event_bus.publish(task_id)
+    if deleted:
+        folder_deleter.trigger()
+    found = set(deleted)
+    return {
+        "deleted": deleted,
+        "not_found": [task_id for task_id in dict.fromkeys(batch.task_ids) if task_id not in found]
+    }
+
+@router.get("/deletions")
+async def get_deletion_progress():
+    """后台删除任务目录的进度（未完成的和最近 24 小时内完成的）"""
+    return await run_io(deletion_progress)
+
 @router.get("/{task_id}", response_model=TaskResponse)
 async def get_task(task_id: str):
     """获取指定任务详情"""
-    task = task_storage.get_task(task_id)
+    task = await async_storage.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     return task
 
 @router.put("/{task_id}/status", response_model=TaskResponse)
 async def update_task_status(task_id: str, status: TaskStatus):
-    """更新任务状态"""
-    task = task_storage.update_task_status(task_id, status)
+    """更新任务状态
+    
+    - 标记为已完成后由后台归档打包；已归档的任务重新开启时先解压回任务目录
+    """
+    task = await run_io(set_task_status, task_id, status)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
+    event_bus.publish(task_id)
+    if status == TaskStatus.COMPLETED:
+        archiver.trigger()
     return task
 
 @router.delete("/{task_id}")
 async def delete_task(task_id: str):
     """删除任务"""
-    success = task_storage.delete_task(task_id)
+    success = await async_storage.delete_task(task_id)
     if not success:
         raise HTTPException(status_code=404, detail="任务不存在")
-    return {"message": "任务删除成功"}
\ No newline at end of file
+    event_bus.publish(task_id)
+    folder_deleter.trigger()
+    return {"message": "任务删除成功"}
+
+@router.post("/{task_id}/reconcile")
+async def reconcile_task_files(task_id: str):
+    """根据磁盘上的实际文件重建任务的文件清单，同时清理进程崩溃遗留的临时文件"""
+    task = await async_storage.get_task(task_id)
+    if task:
+        await run_io(remove_stale_temp_files, task.folder_path)
+    file_count = await async_storage.reconcile_task(task_id)
+    if file_count is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    event_bus.publish(task_id)
+    return {"message": "文件清单已重建", "file_count": file_count}
+
+@router.get("/{task_id}/dedup-stats")
+async def get_dedup_stats(task_id: str):
+    """任务的去重统计：文件总大小、不重复内容大小和节省的空间"""
+    if not await async_storage.get_task(task_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return await async_storage.get_dedup_stats(task_id)
+
+@router.post("/{task_id}/dedup", status_code=202)
+async def dedup_task_files(task_id: str, background_tasks: BackgroundTasks):
+    """在后台对任务中已有的文件做一次去重（重复内容换成硬链接）"""
+    if not await async_storage.get_task(task_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    background_tasks.add_task(dedup_task, task_id)
+    return {"message": "去重任务已开始"}
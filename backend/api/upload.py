@@ -1,70 +1,79 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Request, Header, Response, Query
+from fastapi.responses import StreamingResponse, FileResponse
+from typing import List, Optional, Tuple
+from urllib.parse import quote
 import os
+import json
+import errno
+import time
+import base64
+import hmac
+import secrets
+import uuid
+import weakref
+import asyncio
 import aiofiles
 from datetime import datetime
 from models.schemas import FileUploadResponse
-from core.storage import task_storage
-import json
-from pydantic import BaseModel
+from core.storage import task_storage, FILE_SORT_KEYS
+from core.aio import async_storage, run_io
+from core.auth import verify_admin, sign_token, read_token
+from core.zipstream import ZipMember, should_compress, stream_zip, zip_content_length, READ_CHUNK_SIZE
+from core.fileserve import FileRangeResponse, make_etag
+from core.archive import ArchiveBusy, acquire_reader, archive_paths, discard_archive, find_member, iter_member, load_index
+from core.fileio import (
+    BufferedFileWriter, WRITE_BUFFER_SIZE, FSYNC_NONE, copy_fd, create_temp_file, discard_temp_file, finish_temp_file,
+    fsync_directory, link_new_name, spooled_fileno, write_all
+)
+from core.dedup import content_store, new_hasher, hash_fd
+from core.quota import quota_ledger, QuotaExceeded
+from core.space import space_ledger, InsufficientSpace
+from core.multipart_stream import iter_multipart, MultipartStreamError
+from pydantic import BaseModel, Field
+from core.config import config_service, UploadSettings
+from core.whitelist import whitelist_store
+from core.locks import try_lock_fd
+from core.events import event_bus
+from core import metrics
 
 router = APIRouter()
 
-# 获取配置文件路径
-config_path = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+# 同一批次中同时写入的文件数（可通过 upload_concurrency 设置）
+DEFAULT_UPLOAD_CONCURRENCY = 4
 
-def load_config():
-    """加载配置文件"""
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+def get_settings() -> UploadSettings:
+    """获取系统设置（来自缓存的配置快照）"""
+    return config_service.get().settings
 
-def get_settings():
-    """获取系统设置"""
-    config = load_config()
-    return config.get("settings", {})
+def write_chunk_bytes(settings: UploadSettings) -> int:
+    """攒够多少字节写一次磁盘（write_chunk_size 以 KB 为单位）"""
+    return settings.write_chunk_size * 1024 if settings.write_chunk_size else WRITE_BUFFER_SIZE
 
 def get_user_upload_count(task_id: str, uploader_name: str) -> int:
-    """获取用户在特定任务中的上传文件数量"""
-    task = task_storage.get_task(task_id)
-    if not task:
-        return 0
-    
-    task_folder = task.folder_path
-    uploader_folder = os.path.join(task_folder, uploader_name)
-    
-    if not os.path.exists(uploader_folder):
-        return 0
-    
-    # 计算该用户文件夹中的文件数量
-    count = 0
-    try:
-        for filename in os.listdir(uploader_folder):
-            file_path = os.path.join(uploader_folder, filename)
-            if os.path.isfile(file_path):
-                count += 1
-    except OSError:
-        pass
-    
-    return count
+    """获取用户在特定任务中的上传文件数量（从文件清单读取）"""
+    return task_storage.count_uploader_files(task_id, uploader_name)
+
+def quota_exceeded_error(e: QuotaExceeded, file_count: int) -> HTTPException:
+    """预留失败时返回给客户端的错误"""
+    metrics.reject_upload("quota")
+    if file_count <= 1:
+        return HTTPException(status_code=400, detail=f"您已达到上传次数限制 ({e.limit}次)")
+    return HTTPException(
+        status_code=400,
+        detail=f"上传文件数量将超过您的上传次数限制 ({e.limit}次)，当前已上传 {e.used} 次"
+    )
+
+def disk_full_error() -> HTTPException:
+    """uploads/ 所在磁盘空间不足（低于低水位或写入时 ENOSPC）"""
+    metrics.reject_upload("disk_space")
+    return HTTPException(status_code=507, detail="服务器磁盘空间不足，请稍后重试或联系管理员")
+
+def is_disk_full(e: BaseException) -> bool:
+    return isinstance(e, OSError) and e.errno in (errno.ENOSPC, errno.EDQUOT)
 
 def check_upload_whitelist(uploader_name: str) -> bool:
-    """检查上传者是否在白名单中"""
-    settings = get_settings()
-    whitelist = settings.get("upload_whitelist")
-    
-    # 如果没有设置白名单，则允许所有用户上传
-    if not whitelist:
-        return True
-    
-    # 如果白名单为空，则允许所有用户上传
-    if len(whitelist) == 0:
-        return True
-    
-    # 检查上传者是否在白名单中（不区分大小写）
-    return uploader_name.strip().lower() in [name.strip().lower() for name in whitelist]
+    """检查上传者是否在白名单中（名单为空时允许所有用户上传，不区分大小写）"""
+    return whitelist_store.contains(uploader_name)
 
 class UploadPrecheckResponse(BaseModel):
     """上传预检查响应模型"""
@@ -74,6 +83,7 @@ class UploadPrecheckResponse(BaseModel):
     max_file_size: Optional[int] = None
     max_uploads_per_user: Optional[int] = None
     current_upload_count: Optional[int] = None
+    disk_headroom: Optional[int] = None  # 字节，服务器磁盘还能接收的上传大小（已扣除低水位和正在进行的上传）
 
 @router.post("/{task_id}/precheck", response_model=UploadPrecheckResponse)
 async def precheck_upload(
@@ -84,7 +94,7 @@ async def precheck_upload(
 ):
     """预检查上传是否符合限制条件"""
     # 检查任务是否存在且活跃
-    task = task_storage.get_task(task_id)
+    task = await async_storage.get_task(task_id)
     if not task:
         return UploadPrecheckResponse(
             can_upload=False,
@@ -98,7 +108,7 @@ async def precheck_upload(
         )
     
     # 检查上传者是否在白名单中
-    if not check_upload_whitelist(uploader_name):
+    if not await run_io(check_upload_whitelist, uploader_name):
         return UploadPrecheckResponse(
             can_upload=False,
             reason="您不在允许上传的名单中"
@@ -106,9 +116,9 @@ async def precheck_upload(
     
     # 获取设置
     settings = get_settings()
-    max_files_per_upload = settings.get("max_files_per_upload")
-    max_file_size = settings.get("max_file_size")
-    max_uploads_per_user = settings.get("max_uploads_per_user")
+    max_files_per_upload = settings.max_files_per_upload
+    max_file_size = settings.max_file_size
+    max_uploads_per_user = settings.max_uploads_per_user
     
     # 检查文件数量限制
     if max_files_per_upload and max_files_per_upload > 0:
@@ -119,9 +129,9 @@ async def precheck_upload(
                 max_files_per_upload=max_files_per_upload
             )
     
-    # 检查每人上传次数限制
+    # 检查每人上传次数限制（包括正在进行中的上传预留的次数）
     if max_uploads_per_user and max_uploads_per_user > 0:
-        current_upload_count = get_user_upload_count(task_id, uploader_name)
+        current_upload_count = await run_io(quota_ledger.usage, task_id, uploader_name)
         if current_upload_count + file_count > max_uploads_per_user:
             return UploadPrecheckResponse(
                 can_upload=False,
@@ -130,84 +140,309 @@ async def precheck_upload(
                 current_upload_count=current_upload_count
             )
     
+    # 检查磁盘剩余空间
+    disk_headroom = max(await run_io(space_ledger.headroom), 0)
+    if total_size > disk_headroom:
+        return UploadPrecheckResponse(
+            can_upload=False,
+            reason="服务器磁盘空间不足，暂时无法上传，请稍后重试或联系管理员",
+            disk_headroom=disk_headroom
+        )
+    
     # 返回检查通过的结果
     return UploadPrecheckResponse(
         can_upload=True,
         max_files_per_upload=max_files_per_upload,
         max_file_size=max_file_size,
         max_uploads_per_user=max_uploads_per_user,
-        current_upload_count=get_user_upload_count(task_id, uploader_name) if max_uploads_per_user else None
+        current_upload_count=await run_io(get_user_upload_count, task_id, uploader_name) if max_uploads_per_user else None,
+        disk_headroom=disk_headroom
     )
 
-async def save_uploaded_file(file: UploadFile, task_id: str, uploader_name: str) -> FileUploadResponse:
-    """保存上传的文件到指定任务目录下的姓名文件夹"""
+# 秒传持有证明：客户端需要对文件中服务器随机选定的片段计算摘要，片段最长的字节数
+INSTANT_PROOF_BYTES = 64 * 1024
+
+# 持有证明挑战的有效期（秒）
+INSTANT_CHALLENGE_TTL = 300
+
+class InstantFileInfo(BaseModel):
+    """秒传时客户端提供的文件信息"""
+    filename: str
+    size: int = Field(..., ge=0)
+    sha256: str = Field(..., pattern="^[0-9a-fA-F]{64}$")
+    challenge: Optional[str] = None  # 第一次请求返回的挑战令牌
+    proof: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$")  # SHA-256(挑战令牌 + 指定片段)
+
+class InstantUploadRequest(BaseModel):
+    """秒传请求：先提交文件摘要，服务器已有的内容不需要再传输"""
+    uploader_name: str
+    files: List[InstantFileInfo]
+
+class InstantChallenge(BaseModel):
+    """持有证明挑战：对文件 [offset, offset + length) 的内容计算 SHA-256(token + 片段)"""
+    index: int  # 请求中的下标
+    token: str
+    offset: int
+    length: int
+
+class InstantUploadResponse(BaseModel):
+    """秒传响应"""
+    saved: List[FileUploadResponse]  # 已直接保存的文件
+    missing: List[int]  # 尚未保存、仍需上传的文件（请求中的下标）
+    challenges: List[InstantChallenge] = []  # 需要先完成持有证明的文件
+
+@router.post("/{task_id}/precheck/instant", response_model=InstantUploadResponse)
+async def instant_upload(task_id: str, request: InstantUploadRequest):
+    """按内容摘要预检查：服务器已保存过相同内容的文件直接为上传者创建（硬链接），不传输文件内容
+    
+    - 只知道摘要不能取得文件：第一次请求为每个文件返回一个挑战（文件中随机的一段），
+      客户端带上挑战令牌和 SHA-256(令牌 + 片段) 再请求一次，证明正确且服务器有该内容时才建立链接
+    - 挑战对所有文件都返回，证明错误和服务器没有该内容的结果相同，不会透露服务器上是否有某个文件
+    - 所有限制按整批文件检查，和普通上传一致；返回仍需通过普通接口上传的文件
+    """
+    uploader_name = request.uploader_name.strip()
+    if not uploader_name:
+        raise HTTPException(status_code=400, detail="请输入上传者姓名")
+    task = await run_io(validate_upload_target, task_id, uploader_name)
+    
+    settings = get_settings()
+    file_count = len(request.files)
+    max_files_per_upload = settings.max_files_per_upload
+    if max_files_per_upload and max_files_per_upload > 0 and file_count > max_files_per_upload:
+        metrics.reject_upload("file_count")
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次上传文件数量超过限制 ({max_files_per_upload}个文件)"
+        )
+    max_file_size = settings.max_file_size
+    if max_file_size and max_file_size > 0:
+        for info in request.files:
+            if info.size > max_file_size * 1024 * 1024:
+                metrics.reject_upload("size")
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"文件 {info.filename} 超过大小限制 ({max_file_size}MB)"
+                )
+    if not all(info.challenge and info.proof for info in request.files):
+        return InstantUploadResponse(
+            saved=[],
+            missing=list(range(file_count)),
+            challenges=await run_io(issue_instant_challenges, task_id, uploader_name, request.files)
+        )
+    try:
+        reservation = await quota_ledger.reserve(task_id, uploader_name, file_count, settings.max_uploads_per_user)
+    except QuotaExceeded as e:
+        raise quota_exceeded_error(e, file_count)
+    try:
+        reader = await run_io(hold_upload_target, task_id)
+        try:
+            return await link_instant_files(task, uploader_name, request.files, reservation.id)
+        finally:
+            os.close(reader)
+    finally:
+        await reservation.release()
+
+def issue_instant_challenges(task_id: str, uploader_name: str, files: List[InstantFileInfo]) -> List[InstantChallenge]:
+    """为每个文件随机选定一段内容，签发持有证明挑战（不检查服务器上是否有该内容）"""
+    challenges = []
+    for index, info in enumerate(files):
+        length = min(info.size, INSTANT_PROOF_BYTES)
+        offset = secrets.randbelow(info.size - length + 1)
+        token = sign_token({
+            "scope": "instant",
+            "task": task_id,
+            "uploader": uploader_name,
+            "sha256": info.sha256.lower(),
+            "size": info.size,
+            "offset": offset,
+            "length": length,
+            "nonce": secrets.token_urlsafe(16),
+        }, INSTANT_CHALLENGE_TTL)
+        challenges.append(InstantChallenge(index=index, token=token, offset=offset, length=length))
+    return challenges
+
+def verify_instant_proof(task_id: str, uploader_name: str, info: InstantFileInfo) -> bool:
+    """检查挑战令牌属于这个任务、上传者和文件，且证明与仓库中的内容一致"""
+    data = read_token(info.challenge or "")
+    digest = info.sha256.lower()
+    if (
+        data is None or data.get("scope") != "instant" or data.get("task") != task_id
+        or data.get("uploader") != uploader_name or data.get("sha256") != digest or data.get("size") != info.size
+    ):
+        return False
+    expected = content_store.range_digest(
+        digest, info.size, info.challenge.encode(), data["offset"], data["length"]
+    )
+    return expected is not None and hmac.compare_digest(expected, info.proof.lower())
+
+async def link_instant_files(task, uploader_name: str, files: List[InstantFileInfo], reservation_id: Optional[str]) -> InstantUploadResponse:
+    """为持有证明正确且服务器已有内容的文件建立硬链接，其余文件返回为 missing"""
+    task_id = task.id
+    saved: List[FileUploadResponse] = []
+    missing: List[int] = []
+    uploader_folder = os.path.join(task.folder_path, uploader_name)
     
+    def link_one(filename: str, info: InstantFileInfo):
+        """检查、占位、链接和记录合并为一次线程池调用；服务器没有该内容时返回 None"""
+        digest = info.sha256.lower()
+        if not verify_instant_proof(task_id, uploader_name, info):
+            return None
+        os.makedirs(uploader_folder, exist_ok=True)
+        try:
+            file_path = link_new_name(content_store.object_path(digest), uploader_folder, filename)
+        except OSError:
+            # 对象刚好被回收或无法链接，改为普通上传
+            return None
+        if (get_settings().fsync_policy or FSYNC_NONE) != FSYNC_NONE:
+            fsync_directory(uploader_folder)
+        size = record_saved_file(task_id, uploader_name, file_path, digest, True, reservation_id)
+        metrics.instant_uploads.inc()
+        return file_path, size
+    
+    for index, info in enumerate(files):
+        filename = os.path.basename(info.filename)
+        result = await run_io(link_one, filename, info) if filename else None
+        if result is None:
+            missing.append(index)
+            continue
+        
+        file_path, size = result
+        saved.append(FileUploadResponse(
+            filename=filename,
+            file_path=file_path,
+            size=size,
+            upload_time=datetime.now(),
+            uploader_name=uploader_name
+        ))
+    
+    return InstantUploadResponse(saved=saved, missing=missing)
+
+def validate_upload_target(task_id: str, uploader_name: str):
+    """检查任务是否存在且活跃、上传者是否在白名单中，返回任务"""
     # 验证任务是否存在且状态为活跃
     task = task_storage.get_task(task_id)
     if not task:
+        metrics.reject_upload("task_not_found")
         raise HTTPException(status_code=404, detail="任务不存在")
     
     if task.status.value != "active":
+        metrics.reject_upload("task_inactive")
         raise HTTPException(status_code=400, detail="任务已关闭，无法上传文件")
     
     # 检查上传者是否在白名单中
     if not check_upload_whitelist(uploader_name):
+        metrics.reject_upload("whitelist")
         raise HTTPException(status_code=403, detail="您不在允许上传的名单中")
     
-    # 获取设置
-    settings = get_settings()
-    max_file_size = settings.get("max_file_size")
-    max_uploads_per_user = settings.get("max_uploads_per_user")
-    
-    # 检查每人上传次数限制
-    if max_uploads_per_user and max_uploads_per_user > 0:
-        current_upload_count = get_user_upload_count(task_id, uploader_name)
-        if current_upload_count >= max_uploads_per_user:
-            raise HTTPException(
-                status_code=400,
-                detail=f"您已达到上传次数限制 ({max_uploads_per_user}次)"
-            )
+    return task
+
+def hold_upload_target(task_id: str) -> int:
+    """文件写入任务目录前调用（已通过 validate_upload_target），返回的文件描述符在文件写入清单之后才关闭
+
+    上传和下载一样登记为任务文件的读取者：后台归档遇到正在进行的上传会跳过这个任务，等上传结束后再打包；
+    登记之后重新检查任务状态，通过检查之后任务才被关闭或归档的，不再把文件写入任务目录。
+    """
+    try:
+        reader = acquire_reader(task_id)
+    except ArchiveBusy:
+        reader = None
+    if reader is not None:
+        task = task_storage.get_task(task_id)
+        if task and task.status.value == "active" and not task.archived_at:
+            return reader
+        os.close(reader)
+    metrics.reject_upload("task_inactive")
+    raise HTTPException(status_code=400, detail="任务已关闭，无法上传文件")
+
+def record_saved_file(
+    task_id: str,
+    uploader_name: str,
+    file_path: str,
+    digest: str,
+    deduplicated: bool = False,
+    reservation_id: Optional[str] = None
+) -> int:
+    """把写好的文件纳入内容仓库（重复内容换成硬链接）并写入文件清单，返回文件大小
+
+    传入 reservation_id 时在同一事务里消耗该预留的一个名额。
+    """
+    if not deduplicated:
+        deduplicated = content_store.adopt(file_path, digest)
+    stat = os.stat(file_path)
+    # 硬链接共享已有对象的修改时间，清单中记录本次上传的时间
+    mtime = time.time() if deduplicated else stat.st_mtime
+    task_storage.record_file(
+        task_id, uploader_name, os.path.basename(file_path), stat.st_size, mtime, digest, reservation_id
+    )
+    event_bus.publish(task_id)
+    return stat.st_size
+
+async def write_uploaded_file(
+    file: UploadFile, task, uploader_name: str, settings: UploadSettings, reservation_id: Optional[str] = None
+) -> FileUploadResponse:
+    """把单个文件写入上传者文件夹并记录到文件清单（调用方已完成任务、白名单检查并预留了上传次数）"""
+    max_file_size = settings.max_file_size
     
     # 检查文件大小限制
     if max_file_size and max_file_size > 0:
         # file.size 是字节，max_file_size 是 MB
         max_size_bytes = max_file_size * 1024 * 1024
         if file.size > max_size_bytes:
+            metrics.reject_upload("size")
             raise HTTPException(
                 status_code=400, 
                 detail=f"文件 {file.filename} 超过大小限制 ({max_file_size}MB)"
             )
     
-    # 创建上传者姓名文件夹路径
+    # 先写入上传者文件夹中的临时文件（按文件大小预分配空间），写完后才改名为最终文件名，
+    # 中途失败或请求中断不会留下不完整的文件；写入的同时计算内容摘要用于去重
     uploader_folder = os.path.join(task.folder_path, uploader_name)
-    os.makedirs(uploader_folder, exist_ok=True)
-    
-    # 生成文件保存路径
-    file_path = os.path.join(uploader_folder, file.filename)
-    
-    # 如果文件已存在，添加时间戳后缀
-    if os.path.exists(file_path):
-        name, ext = os.path.splitext(file.filename)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_path = os.path.join(uploader_folder, f"{name}_{timestamp}{ext}")
-    
-    # 直接保存文件，使用流式写入避免内存占用过大
+    deduplicated = False
+    started = time.perf_counter()
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            # 使用64KB的缓冲区进行流式写入
+        fd, tmp_path = await run_io(create_temp_file, uploader_folder, file.size)
+    except OSError as e:
+        if is_disk_full(e):
+            raise disk_full_error()
+        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+    try:
+        src_fd = spooled_fileno(file.file)
+        if src_fd is not None:
+            digest = await run_io(hash_fd, src_fd)
+            # 相同内容已经保存过：直接建立硬链接，不再复制数据
+            deduplicated = await run_io(content_store.link_to, digest, file.size, tmp_path)
+            # 框架已把文件落盘到临时文件：在内核中复制（copy_file_range），不经过用户态
+            written = None if deduplicated else await run_io(copy_fd, src_fd, fd)
+        else:
+            hasher = new_hasher()
+            written = 0
+            chunk_size = write_chunk_bytes(settings)
             while True:
-                chunk = await file.read(65536)  # 64KB
+                chunk = await file.read(chunk_size)
                 if not chunk:
                     break
-                await f.write(chunk)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
-    
-    # 更新任务的文件数量
-    task_storage.increment_file_count(task_id)
+                hasher.update(chunk)
+                await run_io(write_all, fd, chunk)
+                written += len(chunk)
+            digest = hasher.hexdigest()
+        file_path = await finish_temp_file(fd, tmp_path, uploader_folder, file.filename, settings.fsync_policy, written)
+    except BaseException as e:
+        # 写入失败或被取消时删除临时文件（被取消时也要等删除完成）
+        await asyncio.shield(run_io(discard_temp_file, tmp_path))
+        if is_disk_full(e):
+            raise disk_full_error()
+        if isinstance(e, Exception):
+            raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+        raise
+    finally:
+        os.close(fd)
     
-    # 获取文件大小
-    file_size = os.path.getsize(file_path)
+    # 获取文件大小并写入文件清单（同时更新任务的文件数量）
+    file_size = await run_io(
+        record_saved_file, task.id, uploader_name, file_path, digest, deduplicated, reservation_id
+    )
+    metrics.upload_bytes.inc(file_size)
+    metrics.record_upload(file_size, time.perf_counter() - started)
     
     return FileUploadResponse(
         filename=file.filename,
@@ -216,6 +451,72 @@ async def save_uploaded_file(file: UploadFile, task_id: str, uploader_name: str)
         upload_time=datetime.now(),
         uploader_name=uploader_name
     )
+
+async def save_uploaded_file(file: UploadFile, task_id: str, uploader_name: str) -> FileUploadResponse:
+    """保存上传的文件到指定任务目录下的姓名文件夹"""
+    task = await run_io(validate_upload_target, task_id, uploader_name)
+    
+    # 获取设置
+    settings = get_settings()
+    
+    # 预留一次上传次数，检查和预留是原子的
+    try:
+        async with quota_ledger.reservation(task_id, uploader_name, 1, settings.max_uploads_per_user) as reservation:
+            reader = await run_io(hold_upload_target, task_id)
+            try:
+                return await write_uploaded_file(file, task, uploader_name, settings, reservation.id)
+            finally:
+                os.close(reader)
+    except QuotaExceeded as e:
+        raise quota_exceeded_error(e, 1)
+
+async def save_uploaded_batch(
+    files: List[UploadFile], task, uploader_name: str, settings: UploadSettings, reservation_id: Optional[str] = None
+) -> List[FileUploadResponse]:
+    """以有限的并发数保存一批文件，按 max_upload_errors 处理失败的文件"""
+    max_upload_errors = settings.max_upload_errors or 0
+    semaphore = asyncio.Semaphore(max(settings.upload_concurrency or DEFAULT_UPLOAD_CONCURRENCY, 1))
+    
+    async def save_one(index: int, file: UploadFile):
+        async with semaphore:
+            try:
+                return index, await write_uploaded_file(file, task, uploader_name, settings, reservation_id), None
+            except Exception as e:
+                return index, None, {"filename": file.filename, "error": str(e)}
+    
+    pending = [asyncio.ensure_future(save_one(index, file)) for index, file in enumerate(files)]
+    results = [None] * len(files)
+    upload_errors = []
+    try:
+        for future in asyncio.as_completed(pending):
+            index, file_response, error = await future
+            if error is None:
+                results[index] = file_response
+                continue
+            
+            # 记录错误
+            upload_errors.append(error)
+            
+            # 检查是否超过最大错误数（设置为0表示不限制）
+            if max_upload_errors > 0 and len(upload_errors) > max_upload_errors:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"上传错误数超过限制 ({max_upload_errors}个错误): {len(upload_errors)}个文件上传失败"
+                )
+    finally:
+        # 出错时取消尚未完成的文件，未完成的文件会被删除
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    # 如果有错误但未超过限制，返回部分成功的结果
+    # 但如果所有文件都失败了，则应该返回错误
+    if upload_errors and len(upload_errors) == len(files):
+        # 所有文件都上传失败
+        error_details = "; ".join([f"{err['filename']}: {err['error']}" for err in upload_errors])
+        raise HTTPException(status_code=400, detail=error_details)
+    
+    return [result for result in results if result is not None]
     
 @router.post("/check-whitelist/{task_id}")
 async def check_whitelist(
@@ -223,14 +524,14 @@ async def check_whitelist(
     uploader_name: str = Form(..., description="上传者姓名")
 ):
     """检查上传者是否在白名单中"""
-    task = task_storage.get_task(task_id)
+    task = await async_storage.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
     if task.status.value != "active":
         raise HTTPException(status_code=400, detail="任务已关闭，无法上传文件")
     
-    if not check_upload_whitelist(uploader_name):
+    if not await run_io(check_upload_whitelist, uploader_name):
         raise HTTPException(status_code=403, detail="您不在允许上传的名单中")
     
     return {"message": "用户在白名单中"}
@@ -241,7 +542,7 @@ async def get_user_upload_count_endpoint(
     uploader_name: str
 ):
     """获取用户在特定任务中的上传文件数量"""
-    count = get_user_upload_count(task_id, uploader_name)
+    count = await run_io(get_user_upload_count, task_id, uploader_name)
     return {"count": count}
 
 @router.post("/{task_id}", response_model=List[FileUploadResponse])
@@ -250,7 +551,11 @@ async def upload_files(
     uploader_name: str = Form(..., description="上传者姓名"),
     files: List[UploadFile] = File(..., description="要上传的文件列表")
 ):
-    """直接上传文件到指定任务"""
+    """直接上传文件到指定任务
+
+    上传者姓名在表单字段 uploader_name 中；同时在查询参数 ?uploader_name= 中提供时，
+    白名单和上传次数在接收请求体之前就会检查（见 core.admission）。
+    """
     
     if not uploader_name.strip():
         raise HTTPException(status_code=400, detail="请输入上传者姓名")
@@ -258,27 +563,20 @@ async def upload_files(
     if not files:
         raise HTTPException(status_code=400, detail="请选择要上传的文件")
     
-    # 检查上传者是否在白名单中（提前检查）
-    if not check_upload_whitelist(uploader_name):
-        raise HTTPException(status_code=403, detail="您不在允许上传的名单中")
+    uploader_name = uploader_name.strip()
+    
+    # 任务、白名单和次数限制对整批文件只检查一次
+    task = await run_io(validate_upload_target, task_id, uploader_name)
     
     # 获取设置
     settings = get_settings()
-    max_files_per_upload = settings.get("max_files_per_upload")
-    max_uploads_per_user = settings.get("max_uploads_per_user")
-    
-    # 检查每人上传次数限制（提前检查）
-    if max_uploads_per_user and max_uploads_per_user > 0:
-        current_upload_count = get_user_upload_count(task_id, uploader_name)
-        if current_upload_count + len(files) > max_uploads_per_user:
-            raise HTTPException(
-                status_code=400,
-                detail=f"上传文件数量将超过您的上传次数限制 ({max_uploads_per_user}次)，当前已上传 {current_upload_count} 次"
-            )
+    max_files_per_upload = settings.max_files_per_upload
+    max_uploads_per_user = settings.max_uploads_per_user
     
     # 检查文件数量限制
     if max_files_per_upload and max_files_per_upload > 0:
         if len(files) > max_files_per_upload:
+            metrics.reject_upload("file_count")
             raise HTTPException(
                 status_code=400, 
                 detail=f"单次上传文件数量超过限制 ({max_files_per_upload}个文件)"
@@ -289,85 +587,733 @@ async def upload_files(
         if not file.filename:
             raise HTTPException(status_code=400, detail="文件名不能为空")
     
-    uploaded_files = []
-    upload_errors = []
+    # 为整批文件预留上传次数（同一上传者的并发请求不会一起超过限制），然后并发保存所有文件
+    try:
+        reservation = await quota_ledger.reserve(task_id, uploader_name, len(files), max_uploads_per_user)
+    except QuotaExceeded as e:
+        raise quota_exceeded_error(e, len(files))
+    try:
+        reader = await run_io(hold_upload_target, task_id)
+        try:
+            with metrics.uploads_in_progress.track():
+                return await save_uploaded_batch(files, task, uploader_name, settings, reservation.id)
+        finally:
+            os.close(reader)
+    finally:
+        await reservation.release()
+
+@router.post("/{task_id}/stream", response_model=List[FileUploadResponse])
+async def upload_files_streaming(
+    task_id: str,
+    request: Request,
+    uploader_name: Optional[str] = Query(None, description="上传者姓名（也可以作为第一个表单字段提供）")
+):
+    """边接收边解析 multipart 请求体，文件数据直接写入上传者文件夹，不经过框架的临时文件
     
-    # 获取最大错误数设置
-    max_upload_errors = settings.get("max_upload_errors", 0)
+    表单格式与 POST /{task_id} 相同；uploader_name 需要在查询参数中，或者作为文件之前的表单字段。
+    单个文件失败（超过大小、次数限制，磁盘已满等）时丢弃该文件并继续接收后面的文件，按 max_upload_errors 处理，与 POST /{task_id} 一致。
+    """
+    state = {"task": None, "settings": None, "reader": None}
+    saved: List[FileUploadResponse] = []
+    upload_errors: List[dict] = []
+    writer: Optional[BufferedFileWriter] = None
+    reservation = None
+    filename = None
+    file_count = 0
     
-    # 保存所有文件
-    for file in files:
-        try:
-            file_response = await save_uploaded_file(file, task_id, uploader_name.strip())
-            uploaded_files.append(file_response)
-        except Exception as e:
-            # 记录错误
-            upload_errors.append({
-                "filename": file.filename,
-                "error": str(e)
-            })
-            
-            # 检查是否超过最大错误数
-            if max_upload_errors > 0 and len(upload_errors) > max_upload_errors:
+    async def discard(e: Exception):
+        """放弃当前文件（删除未写完的内容，归还预留的次数）并记录错误，错误数超过 max_upload_errors 时中止整个请求"""
+        nonlocal writer, reservation
+        if writer is not None:
+            await writer.abort()
+            writer = None
+        if reservation is not None:
+            await reservation.release()
+            reservation = None
+        if isinstance(e, QuotaExceeded):
+            e = quota_exceeded_error(e, 1)
+        elif is_disk_full(e):
+            e = disk_full_error()
+        upload_errors.append({"filename": filename, "error": str(e)})
+        max_upload_errors = state["settings"].max_upload_errors or 0
+        if max_upload_errors > 0 and len(upload_errors) > max_upload_errors:
+            raise HTTPException(
+                status_code=400,
+                detail=f"上传错误数超过限制 ({max_upload_errors}个错误): {len(upload_errors)}个文件上传失败"
+            )
+    
+    def prepare(name: Optional[str]):
+        """在第一个文件开始前完成所有检查（整体放到 I/O 线程池中执行一次）"""
+        if not name or not name.strip():
+            raise HTTPException(status_code=400, detail="请输入上传者姓名")
+        state["task"] = validate_upload_target(task_id, name.strip())
+        state["settings"] = get_settings()
+        max_uploads_per_user = state["settings"].max_uploads_per_user
+        if max_uploads_per_user and max_uploads_per_user > 0:
+            if quota_ledger.usage(task_id, name.strip()) >= max_uploads_per_user:
+                metrics.reject_upload("quota")
                 raise HTTPException(
-                    status_code=400, 
-                    detail=f"上传错误数超过限制 ({max_upload_errors}个错误): {len(upload_errors)}个文件上传失败"
+                    status_code=400,
+                    detail=f"您已达到上传次数限制 ({max_uploads_per_user}次)"
                 )
+    
+    if uploader_name is not None:
+        uploader_name = uploader_name.strip()
+        await run_io(prepare, uploader_name)
+    
+    metrics.uploads_in_progress.inc()
+    try:
+        async for event in iter_multipart(request.headers.get("content-type"), request.stream()):
+            kind = event[0]
+            if kind == "field":
+                if event[1] == "uploader_name" and state["task"] is None:
+                    uploader_name = event[2].strip()
+                    await run_io(prepare, uploader_name)
+            
+            elif kind == "file_start":
+                if state["task"] is None:
+                    await run_io(prepare, uploader_name)
+                if state["reader"] is None:
+                    state["reader"] = await run_io(hold_upload_target, task_id)
+                settings = state["settings"]
+                filename = os.path.basename(event[2])
+                if not filename:
+                    raise HTTPException(status_code=400, detail="文件名不能为空")
+                
+                file_count += 1
+                max_files_per_upload = settings.max_files_per_upload
+                if max_files_per_upload and max_files_per_upload > 0 and file_count > max_files_per_upload:
+                    metrics.reject_upload("file_count")
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"单次上传文件数量超过限制 ({max_files_per_upload}个文件)"
+                    )
+                # 文件总数事先未知，每个文件开始时预留一次上传次数
+                try:
+                    reservation = await quota_ledger.reserve(task_id, uploader_name, 1, settings.max_uploads_per_user)
+                    uploader_folder = os.path.join(state["task"].folder_path, uploader_name)
+                    writer = await BufferedFileWriter(
+                        uploader_folder, write_chunk_bytes(settings), hasher=new_hasher()
+                    ).open()
+                except (QuotaExceeded, OSError) as e:
+                    await discard(e)
+                started = time.perf_counter()
+            
+            elif kind == "file_data":
+                if writer is None:
+                    # 当前文件已经失败，丢弃它剩余的数据
+                    continue
+                try:
+                    await writer.write(event[1])
+                    metrics.upload_bytes.inc(len(event[1]))
+                    max_file_size = state["settings"].max_file_size
+                    if max_file_size and max_file_size > 0 and writer.size > max_file_size * 1024 * 1024:
+                        # 超过大小限制时立即删除已写入的部分，不再写入剩余数据
+                        metrics.reject_upload("size")
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"文件 {filename} 超过大小限制 ({max_file_size}MB)"
+                        )
+                except (HTTPException, OSError) as e:
+                    await discard(e)
             
-            # 如果没有设置错误限制，继续处理其他文件
-            # 如果设置了错误限制为0（无限制），也继续处理
+            elif kind == "file_end":
+                if writer is None:
+                    continue
+                try:
+                    await writer.commit(filename, state["settings"].fsync_policy)
+                    size = await run_io(
+                        record_saved_file, task_id, uploader_name, writer.path, writer.hasher.hexdigest(),
+                        False, reservation.id
+                    )
+                except OSError as e:
+                    await discard(e)
+                    continue
+                await reservation.release()
+                reservation = None
+                metrics.record_upload(size, time.perf_counter() - started)
+                saved.append(FileUploadResponse(
+                    filename=filename,
+                    file_path=writer.path,
+                    size=size,
+                    upload_time=datetime.now(),
+                    uploader_name=uploader_name
+                ))
+                writer = None
+    except MultipartStreamError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
+        if is_disk_full(e):
+            raise disk_full_error()
+        raise
+    finally:
+        # 请求中断或出错时删除未写完的文件，并归还其预留的次数
+        if writer is not None:
+            await writer.abort()
+        if reservation is not None:
+            await reservation.release()
+        if state["reader"] is not None:
+            os.close(state["reader"])
+        metrics.uploads_in_progress.dec()
     
-    # 如果有错误但未超过限制，返回部分成功的结果
-    # 但如果所有文件都失败了，则应该返回错误
-    if upload_errors and len(upload_errors) == len(files):
-        # 所有文件都上传失败
-        error_details = "; ".join([f"{err['filename']}: {err['error']}" for err in upload_errors])
-        raise HTTPException(status_code=400, detail=error_details)
-    elif upload_errors:
-        # 可以选择是否在此处抛出异常或返回部分结果
-        # 这里我们选择继续，但可以在响应中包含错误信息
-        pass
+    if state["task"] is None:
+        await run_io(prepare, uploader_name)
+    if not saved:
+        if upload_errors:
+            # 所有文件都上传失败
+            raise HTTPException(
+                status_code=400, detail="; ".join(f"{err['filename']}: {err['error']}" for err in upload_errors)
+            )
+        raise HTTPException(status_code=400, detail="请选择要上传的文件")
     
-    return uploaded_files
+    # 有错误但未超过限制时返回部分成功的结果
+    return saved
+
+# 断点续传会话多久未更新后视为放弃（秒）
+RESUMABLE_SESSION_TTL = 24 * 3600
+
+# 同一会话的分块写入必须串行（进程内用 asyncio 锁排队，跨进程用文件锁）
+# 弱引用：没有请求在等待的锁随之回收，不会为不存在或已结束的会话留下条目
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+class ResumableSessionResponse(BaseModel):
+    """断点续传会话响应模型"""
+    session_id: str
+    filename: str
+    size: int
+    offset: int
+
+async def _get_session_or_404(session_id: str) -> dict:
+    session = await async_storage.get_upload_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return session
+
+def _end_session(session_id: str, remove_file: Optional[str] = None):
+    """删除会话并释放其预留的上传次数，可选地删除未完成的文件"""
+    task_storage.delete_upload_session(session_id)
+    task_storage.release_quota(session_id)
+    if remove_file:
+        try:
+            os.remove(remove_file)
+        except OSError:
+            pass
+
+def _purge_expired_sessions():
+    """清理长时间未更新的会话及其未完成的文件"""
+    for session in task_storage.purge_upload_sessions(time.time() - RESUMABLE_SESSION_TTL):
+        _end_session(session["id"], session["file_path"])
+
+@router.post("/{task_id}/resumable", response_model=ResumableSessionResponse, status_code=201)
+async def create_resumable_upload(
+    task_id: str,
+    uploader_name: str = Form(..., description="上传者姓名"),
+    filename: str = Form(..., description="文件名"),
+    size: int = Form(..., description="文件大小（字节）")
+):
+    """创建断点续传会话，所有上传限制只在这里检查一次"""
+    uploader_name = uploader_name.strip()
+    filename = os.path.basename(filename)
+    if not uploader_name:
+        raise HTTPException(status_code=400, detail="请输入上传者姓名")
+    if not filename:
+        raise HTTPException(status_code=400, detail="文件名不能为空")
+    if size < 0:
+        raise HTTPException(status_code=400, detail="文件大小无效")
+    
+    task = await run_io(validate_upload_target, task_id, uploader_name)
+    
+    settings = get_settings()
+    max_file_size = settings.max_file_size
+    max_uploads_per_user = settings.max_uploads_per_user
+    
+    if max_file_size and max_file_size > 0 and size > max_file_size * 1024 * 1024:
+        metrics.reject_upload("size")
+        raise HTTPException(
+            status_code=400,
+            detail=f"文件 {filename} 超过大小限制 ({max_file_size}MB)"
+        )
+    
+    await run_io(_purge_expired_sessions)
+    
+    # 未完成的会话也占用上传次数：以会话 ID 预留一个名额，完成或取消时释放
+    try:
+        reservation = await quota_ledger.reserve(
+            task_id, uploader_name, 1, max_uploads_per_user, ttl=RESUMABLE_SESSION_TTL, reservation_id=uuid.uuid4().hex
+        )
+    except QuotaExceeded as e:
+        raise quota_exceeded_error(e, 1)
+    
+    def create_session():
+        # 分块数据写入上传者文件夹中的临时文件（按声明的大小预分配空间），完成时才改名为最终文件名
+        uploader_folder = os.path.join(task.folder_path, uploader_name)
+        fd, tmp_path = create_temp_file(uploader_folder, size)
+        os.close(fd)
+        try:
+            return task_storage.create_upload_session(
+                task_id, uploader_name, filename, tmp_path, size, session_id=reservation.id
+            )
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    
+    # 预留磁盘空间直到临时文件按声明的大小预分配完成
+    try:
+        space = await space_ledger.reserve(size)
+    except InsufficientSpace:
+        await reservation.release()
+        raise disk_full_error()
+    try:
+        session = await run_io(create_session)
+    except BaseException as e:
+        await reservation.release()
+        if is_disk_full(e):
+            raise disk_full_error()
+        raise
+    finally:
+        await space.release()
+    return ResumableSessionResponse(
+        session_id=session["id"],
+        filename=filename,
+        size=size,
+        offset=0
+    )
+
+@router.head("/resumable/{session_id}")
+async def get_resumable_offset(session_id: str):
+    """查询会话当前已接收的字节数"""
+    session = await _get_session_or_404(session_id)
+    return Response(
+        status_code=200,
+        headers={
+            "Upload-Offset": str(session["offset"]),
+            "Upload-Length": str(session["size"]),
+            "Cache-Control": "no-store"
+        }
+    )
+
+@router.get("/resumable/{session_id}", response_model=ResumableSessionResponse)
+async def get_resumable_session(session_id: str):
+    """获取会话信息（包含当前偏移量）"""
+    session = await _get_session_or_404(session_id)
+    return ResumableSessionResponse(
+        session_id=session["id"],
+        filename=session["filename"],
+        size=session["size"],
+        offset=session["offset"]
+    )
+
+@router.patch("/resumable/{session_id}", status_code=204)
+async def upload_resumable_chunk(
+    session_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset")
+):
+    """在指定偏移量处写入一个分块，请求体即为分块数据"""
+    # 先确认会话存在再取锁
+    await _get_session_or_404(session_id)
+    async with _session_lock(session_id):
+        session = await _get_session_or_404(session_id)
+        offset = session["offset"]
+        metrics.uploads_in_progress.inc()
+        try:
+            async with aiofiles.open(session["file_path"], 'r+b') as f:
+                # 进程内的锁管不到其他 worker 进程，再用文件锁保证同一会话只有一个写入方
+                if not try_lock_fd(f.fileno()):
+                    raise HTTPException(
+                        status_code=409,
+                        detail="该会话正在由另一个请求写入",
+                        headers={"Upload-Offset": str(offset)}
+                    )
+                # 拿到文件锁之后重新读取偏移量，其他进程可能刚刚写入过
+                session = await _get_session_or_404(session_id)
+                offset = session["offset"]
+                if upload_offset != offset:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"偏移量不匹配，服务器当前偏移量为 {offset}",
+                        headers={"Upload-Offset": str(offset)}
+                    )
+                await f.seek(offset)
+                async for chunk in request.stream():
+                    if offset + len(chunk) > session["size"]:
+                        metrics.reject_upload("size")
+                        raise HTTPException(status_code=413, detail="写入数据超过了声明的文件大小")
+                    await f.write(chunk)
+                    offset += len(chunk)
+                    metrics.upload_bytes.inc(len(chunk))
+        except FileNotFoundError:
+            await run_io(_end_session, session_id)
+            raise HTTPException(status_code=410, detail="上传文件已被删除，请重新上传")
+        finally:
+            metrics.uploads_in_progress.dec()
+            # 即使连接中途断开，已写入的部分也会被记录，下次从这里继续
+            if offset != session["offset"]:
+                await asyncio.shield(async_storage.update_upload_offset(
+                    session_id, session["offset"], offset, RESUMABLE_SESSION_TTL
+                ))
+    
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+@router.post("/resumable/{session_id}/complete", response_model=FileUploadResponse)
+async def complete_resumable_upload(session_id: str):
+    """所有分块上传完成后结束会话，文件计入任务"""
+    session = await _get_session_or_404(session_id)
+    if session["offset"] != session["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"文件尚未上传完成 ({session['offset']}/{session['size']})",
+            headers={"Upload-Offset": str(session["offset"])}
+        )
+    
+    tmp_path = session["file_path"]
+    uploader_folder = os.path.dirname(tmp_path)
+    
+    def open_and_hash():
+        fd = os.open(tmp_path, os.O_RDWR)
+        try:
+            return fd, hash_fd(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+    
+    def record(file_path: str, digest: str):
+        size = record_saved_file(session["task_id"], session["uploader"], file_path, digest, False, session_id)
+        _end_session(session_id)
+        # 断点续传跨越多个请求，没有有意义的单文件速度，只记录大小
+        metrics.upload_file_size.observe(size)
+        return size
+    
+    reader = await run_io(hold_upload_target, session["task_id"])
+    try:
+        fd, digest = await run_io(open_and_hash)
+        try:
+            # 临时文件改名为最终文件名后才计入任务
+            file_path = await finish_temp_file(
+                fd, tmp_path, uploader_folder, session["filename"], get_settings().fsync_policy, session["size"]
+            )
+        finally:
+            os.close(fd)
+        size = await run_io(record, file_path, digest)
+    except FileNotFoundError:
+        await run_io(_end_session, session_id)
+        raise HTTPException(status_code=410, detail="上传文件已被删除，请重新上传")
+    finally:
+        os.close(reader)
+    
+    return FileUploadResponse(
+        filename=session["filename"],
+        file_path=file_path,
+        size=size,
+        upload_time=datetime.now(),
+        uploader_name=session["uploader"]
+    )
+
+@router.delete("/resumable/{session_id}")
+async def abort_resumable_upload(session_id: str):
+    """放弃上传，删除未完成的文件"""
+    session = await _get_session_or_404(session_id)
+    await run_io(_end_session, session_id, session["file_path"])
+    return {"message": "上传已取消"}
+
+# 文件列表每页的默认和最大条数
+FILES_PAGE_SIZE = 200
+FILES_PAGE_SIZE_MAX = 1000
+
+def encode_files_cursor(sort: str, entry: dict) -> str:
+    """把一页最后一行的排序键编码为不透明的游标"""
+    values = [entry[column] for column in FILE_SORT_KEYS[sort]]
+    return base64.urlsafe_b64encode(json.dumps([sort, values]).encode()).decode().rstrip("=")
+
+def decode_files_cursor(cursor: str, sort: str) -> list:
+    try:
+        cursor_sort, values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="分页游标与排序方式不一致")
+    return values
 
 @router.get("/{task_id}/files")
-async def list_uploaded_files(task_id: str):
-    """列出任务下所有已上传的文件"""
+async def list_uploaded_files(
+    task_id: str,
+    sort: str = Query("uploader", pattern="^(name|size|time|uploader)$", description="排序字段"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    uploader: Optional[str] = Query(None, description="只列出该上传者的文件"),
+    prefix: Optional[str] = Query(None, description="文件名前缀"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(FILES_PAGE_SIZE, ge=1, le=FILES_PAGE_SIZE_MAX),
+    summary_only: bool = False
+):
+    """分页列出任务下已上传的文件（从文件清单读取，不遍历磁盘）
+    
+    - 按 sort/order 排序，使用 cursor 翻页（键集分页，翻到多深都一样快）
+    - summary_only=true 只返回数量和总大小
+    """
+    task = await async_storage.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    after = decode_files_cursor(cursor, sort) if cursor else None
+    
+    def load():
+        # 统计和分页查询合并为一次线程池调用
+        actual_file_count, actual_users_count = task_storage.get_actual_counts(task_id)
+        summary = task_storage.summarize_files(task_id, uploader, prefix)
+        result = {
+            "total_count": summary["file_count"],
+            "total_size": summary["total_size"],
+            "users_count": summary["users_count"],
+            "actual_file_count": actual_file_count,
+            "actual_users_count": actual_users_count,
+            "archived": task.archived_at is not None
+        }
+        if summary_only:
+            return result, None
+        
+        # 多取一条用来判断是否还有下一页
+        entries = task_storage.query_files(
+            task_id, sort=sort, descending=order == "desc",
+            uploader=uploader, prefix=prefix, after=after, limit=limit + 1
+        )
+        return result, entries
+    
+    try:
+        result, entries = await run_io(load)
+        if entries is None:
+            return result
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
+    
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    task_folder = task.folder_path
+    result["files"] = [
+        {
+            "filename": entry["filename"],
+            "uploader_name": entry["uploader"],
+            "file_path": os.path.join(task_folder, entry["uploader"], entry["filename"]),
+            "size": entry["size"],
+            "upload_time": datetime.fromtimestamp(entry["mtime"])
+        }
+        for entry in entries
+    ]
+    result["next_cursor"] = encode_files_cursor(sort, entries[-1]) if has_more else None
+    return result
+
+def clean_task_folder(task_id: str, task_folder: str, arcnames: List[str]):
+    """删除已经下载的文件（arcnames 为“上传者/文件名”）并重建清单，然后回收只被这些文件引用的内容对象
+
+    下载过程中新上传的文件不在 arcnames 中，保留不动；任务仍是归档状态时同时删除归档。
+    """
     task = task_storage.get_task(task_id)
+    if task and task.archived_at:
+        discard_archive(task_id)
+    # 删除前从清单中取出这些文件的摘要，之后只检查对应的内容对象
+    digests = {f"{entry['uploader']}/{entry['filename']}": entry["sha256"] for entry in task_storage.list_files(task_id)}
+    released = set()
+    uploader_folders = set()
+    for arcname in arcnames:
+        uploader, _, filename = arcname.partition("/")
+        uploader_folders.add(os.path.join(task_folder, uploader))
+        try:
+            os.remove(os.path.join(task_folder, uploader, filename))
+        except FileNotFoundError:
+            pass
+        released.add(digests.get(arcname))
+    for folder in uploader_folders:
+        try:
+            # 只删除已经清空的上传者文件夹
+            os.rmdir(folder)
+        except OSError:
+            pass
+    task_storage.reconcile_task(task_id)
+    event_bus.publish(task_id)
+    content_store.release(released)
+
+async def open_task_files(task_id: str) -> Tuple[object, Optional[int]]:
+    """读取任务文件前调用，返回最新的任务和读取登记
+    
+    任务未归档时返回的文件描述符在读取结束前保持打开，期间后台归档不会删除散落的文件；
+    任务已归档时登记为 None（直接读取归档）。
+    """
+    # 先确认任务存在再登记，不为不存在的任务创建锁文件
+    task = await async_storage.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.archived_at:
+        return task, None
+    try:
+        reader = await run_io(acquire_reader, task_id)
+    except ArchiveBusy:
+        raise HTTPException(status_code=503, detail="任务正在归档，请稍后再试", headers={"Retry-After": "10"})
+    # 登记之后重新读取任务：期间可能刚刚归档完成或被删除
+    task = await async_storage.get_task(task_id)
+    if not task or task.archived_at:
+        os.close(reader)
+        reader = None
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
+    return task, reader
+
+async def iter_file(path: str, reader: Optional[int] = None):
+    """按块读取文件，结束（或客户端断开）时释放读取登记"""
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            while True:
+                chunk = await f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if reader is not None:
+            os.close(reader)
+
+def attachment_header(filename: str) -> str:
+    """Content-Disposition 头（非 ASCII 文件名使用 RFC 5987 编码）"""
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+def open_for_reading(path: str):
+    """打开文件并取得打开后的状态（之后文件被替换或删除也不影响已打开的内容）"""
+    file = open(path, "rb", buffering=0)
+    return file, os.fstat(file.fileno())
+
+@router.api_route("/{task_id}/files/{uploader}/{filename}", methods=["GET", "HEAD"])
+async def download_task_file(
+    task_id: str,
+    uploader: str,
+    filename: str,
+    username: str = Depends(verify_admin)
+):
+    """下载任务中的单个文件
     
+    - 只能下载清单中的文件，路径参数不会指向任务目录以外
+    - 支持 Range / If-Range（断点续传、分段并行下载）以及 ETag / Last-Modified 条件请求（304）
+    - ETag 为强校验值：有内容摘要时使用 SHA-256，否则由大小和修改时间组成
+    - 已归档的任务按索引直接定位到归档中的文件，不解压整个归档
+    - 在线程池中分块 pread 后发送，内存占用与文件大小无关；ASGI 服务器提供零拷贝扩展时交给服务器发送（uvicorn 不提供）
+    """
+    task, reader = await open_task_files(task_id)
     try:
-        files_info = []
-        task_folder = task.folder_path
+        entry = await async_storage.get_file(task_id, uploader, filename)
+        if not entry:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        
+        headers = {"Content-Disposition": attachment_header(filename)}
+        if reader is None:
+            member = await run_io(find_member, task_id, uploader, filename)
+            if member is None:
+                raise HTTPException(status_code=404, detail="文件不存在")
+            etag = make_etag(member.size, member.mtime, entry["sha256"])
+            if not member.stored:
+                # 压缩的成员只能从头解压，不支持按范围读取
+                headers.update({"Content-Length": str(member.size), "ETag": etag})
+                return StreamingResponse(iter_member(member), media_type="application/octet-stream", headers=headers)
+            try:
+                file, _ = await run_io(open_for_reading, member.archive_path)
+            except FileNotFoundError:
+                raise HTTPException(status_code=409, detail="任务归档刚刚发生变化，请重试")
+            return FileRangeResponse(
+                file, member.archive_path, member.size, member.mtime, etag,
+                offset=member.data_offset, filename=filename, headers=headers
+            )
         
-        if os.path.exists(task_folder):
-            # 遍历所有上传者文件夹
-            for uploader_name in os.listdir(task_folder):
-                uploader_folder = os.path.join(task_folder, uploader_name)
-                if os.path.isdir(uploader_folder):
-                    # 遍历上传者文件夹中的所有文件
-                    for filename in os.listdir(uploader_folder):
-                        file_path = os.path.join(uploader_folder, filename)
-                        if os.path.isfile(file_path):
-                            stat = os.stat(file_path)
-                            files_info.append({
-                                "filename": filename,
-                                "uploader_name": uploader_name,
-                                "file_path": file_path,
-                                "size": stat.st_size,
-                                "upload_time": datetime.fromtimestamp(stat.st_mtime)
-                            })
+        file_path = os.path.join(task.folder_path, uploader, filename)
+        try:
+            file, stat = await run_io(open_for_reading, file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="文件不存在")
+    except BaseException:
+        if reader is not None:
+            os.close(reader)
+        raise
+    
+    # 清单中的摘要只在文件没有变化时可用
+    unchanged = entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+    etag = make_etag(stat.st_size, stat.st_mtime, entry["sha256"] if unchanged else None)
+    return FileRangeResponse(
+        file, file_path, stat.st_size, stat.st_mtime, etag,
+        filename=filename, headers=headers, on_close=lambda: os.close(reader)
+    )
+
+@router.get("/{task_id}/download-all")
+async def download_all_files(
+    task_id: str,
+    clean: bool = False,
+    compress: bool = False,
+    username: str = Depends(verify_admin)
+):
+    """将任务下所有文件以 ZIP 流的形式下载（不生成临时文件）
+    
+    - compress=false（默认）：全部使用 STORED，可预先计算 Content-Length，浏览器能显示下载进度
+    - compress=true：非压缩格式的文件使用 DEFLATE，无法预知总大小
+    - clean=true：只有在整个压缩包发送完成后才删除服务器上已发送的文件（下载过程中新上传的文件保留）
+    - 已归档的任务直接发送归档文件，compress 参数不起作用
+    """
+    task, reader = await open_task_files(task_id)
+    headers = {"Content-Disposition": f'attachment; filename="task_{task_id}_files.zip"'}
+    
+    if reader is None:
+        archive_path, _ = archive_paths(task_id)
+        if not clean:
+            return FileResponse(archive_path, media_type="application/zip", headers=headers)
+        index = await run_io(load_index, task_id)
+        arcnames = list(index["members"]) if index else []
         
-        # 获取实际的文件数量和上传人数
-        actual_file_count, actual_users_count = task_storage.get_actual_counts(task_folder)
+        async def send_archive():
+            async for chunk in iter_file(archive_path):
+                yield chunk
+            # 只有全部数据都已发送才会执行到这里，客户端中途断开不会删除文件
+            await run_io(clean_task_folder, task_id, task.folder_path, arcnames)
         
-        return {
-            "files": files_info, 
-            "total_count": len(files_info),
-            "actual_file_count": actual_file_count,
-            "actual_users_count": actual_users_count
-        }
+        try:
+            headers["Content-Length"] = str((await run_io(os.stat, archive_path)).st_size)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="该任务下没有文件")
+        return StreamingResponse(send_archive(), media_type="application/zip", headers=headers)
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
+    task_folder = task.folder_path
+    try:
+        entries = await async_storage.scan_task_folder(task_folder)
+    except BaseException:
+        os.close(reader)
+        raise
+    if not entries:
+        os.close(reader)
+        raise HTTPException(status_code=404, detail="该任务下没有文件")
+    
+    members = [
+        ZipMember(
+            arcname=f"{uploader}/{filename}",
+            path=os.path.join(task_folder, uploader, filename),
+            size=size,
+            mtime=mtime,
+            compress=compress and should_compress(filename)
+        )
+        for uploader, filename, size, mtime in entries
+    ]
+    
+    async def generate():
+        try:
+            async for chunk in stream_zip(members):
+                yield chunk
+        finally:
+            os.close(reader)
+        # 只有全部数据都已发送才会执行到这里，客户端中途断开不会删除文件；只删除已发送的文件
+        if clean:
+            await run_io(clean_task_folder, task_id, task_folder, [member.arcname for member in members])
+    
+    content_length = zip_content_length(members)
+    if content_length is not None:
+        headers["Content-Length"] = str(content_length)
+    
+    return StreamingResponse(generate(), media_type="application/zip", headers=headers)
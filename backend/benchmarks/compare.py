@@ -0,0 +1,72 @@
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional
+
+# 默认的回归阈值：比基线差 20% 以上视为回归
+DEFAULT_THRESHOLD = 0.2
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """逐项比较两次结果中的指标
+
+    每个指标带有 better（higher/lower），变差的比例超过 threshold 时标记为回归。
+    只在两次结果中都存在的指标参与比较。
+    """
+    rows = []
+    old_metrics = baseline.get("metrics", {})
+    for name, metric in current.get("metrics", {}).items():
+        old = old_metrics.get(name)
+        if old is None or not old["value"]:
+            continue
+        change = (metric["value"] - old["value"]) / old["value"]
+        worse = -change if metric["better"] == "higher" else change
+        rows.append({
+            "name": name,
+            "unit": metric["unit"],
+            "baseline": old["value"],
+            "current": metric["value"],
+            "change": round(change, 4),
+            "regressed": worse > threshold,
+        })
+    return rows
+
+
+def failed_checks(result: Dict) -> List[str]:
+    """未通过的正确性检查"""
+    return [name for name, check in result.get("checks", {}).items() if not check.get("passed")]
+
+
+def report(rows: List[Dict], result: Dict, threshold: float) -> bool:
+    """打印比较结果，有回归或正确性检查失败时返回 False"""
+    ok = True
+    for row in rows:
+        mark = "REGRESSED" if row["regressed"] else "ok"
+        print(
+            f"{row['name']:<40} {row['baseline']:>14.3f} -> {row['current']:>14.3f} {row['unit']:<8} "
+            f"{row['change']:+8.1%}  {mark}"
+        )
+        ok = ok and not row["regressed"]
+    for name in failed_checks(result):
+        print(f"check {name} FAILED")
+        ok = False
+    print(f"{'PASS' if ok else 'FAIL'} (threshold {threshold:.0%})")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="比较两次基准测试结果，超过阈值的回归返回非零退出码")
+    parser.add_argument("baseline", help="基线结果 JSON")
+    parser.add_argument("current", help="本次结果 JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="允许变差的比例（默认 0.2）")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    return 0 if report(compare(baseline, current, args.threshold), current, args.threshold) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import subprocess
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Sequence
+
+import httpx
+
+# backend/ 目录（main.py 所在位置）
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 基准测试使用的管理员账户（只存在于临时工作目录的配置中）
+ADMIN_USERNAME = "bench"
+ADMIN_PASSWORD = "bench-password"
+
+# 基准测试期间的上传设置：不让限制影响吞吐量的测量
+BENCH_SETTINGS = {
+    "max_file_size": 1024,
+    "max_files_per_upload": 1000,
+    "max_upload_errors": 0,
+    "max_uploads_per_user": 0,
+}
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """最近秩法的分位数（q 取 0~1）"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+def latency_summary(samples: Sequence[float]) -> Dict[str, float]:
+    """把一组耗时（秒）汇总为毫秒统计"""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def prepare_workdir(workdir: str) -> Dict[str, str]:
+    """在临时目录中准备独立的配置、白名单、数据库和上传目录，返回应用使用的环境变量
+
+    应用的数据文件都相对于当前目录或由环境变量指定，基准测试不会碰到正式数据。
+    """
+    os.makedirs(workdir, exist_ok=True)
+    config_path = os.path.join(workdir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        # 明文密码会在应用启动时被转换为哈希
+        json.dump({
+            "admin": {"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD},
+            "settings": BENCH_SETTINGS,
+        }, f, ensure_ascii=False, indent=2)
+    return {
+        "FASTUP_CONFIG": config_path,
+        "FASTUP_WHITELIST": os.path.join(workdir, "whitelist.txt"),
+    }
+
+
+def git_revision() -> str:
+    """当前代码的提交号（不在 git 仓库中时为 unknown）"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@asynccontextmanager
+async def inprocess_client(workdir: str) -> AsyncIterator[httpx.AsyncClient]:
+    """在当前进程中加载应用，通过 ASGI 直接调用（不经过网络）"""
+    os.environ.update(prepare_workdir(workdir))
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            yield client
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def server_client(workdir: str, workers: int = 1, port: int = 0) -> AsyncIterator[httpx.AsyncClient]:
+    """在子进程中用 main.py 启动本地 uvicorn（可多个 worker），通过 HTTP 访问"""
+    env = dict(os.environ, **prepare_workdir(workdir))
+    env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    port = port or _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BACKEND_DIR, "main.py"),
+            "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+        ],
+        cwd=workdir,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn 启动失败（退出码 {process.returncode}）")
+                try:
+                    if (await client.get("/api/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("等待 uvicorn 启动超时")
+                await asyncio.sleep(0.2)
+            yield client
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def login(client: httpx.AsyncClient) -> Dict[str, str]:
+    """以基准测试管理员登录，返回认证请求头"""
+    response = await client.post("/api/auth/login", json={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class SyntheticFiles:
+    """生成指定大小的测试文件内容
+
+    每种大小只生成一次随机数据，每个文件在开头写入不同的序号，内容互不相同，不会被去重。
+    """
+
+    def __init__(self, sizes: Sequence[int]):
+        self._bases = {size: os.urandom(size) for size in set(sizes)}
+        self._counter = 0
+
+    def make(self, size: int) -> bytes:
+        self._counter += 1
+        header = self._counter.to_bytes(16, "big")
+        base = self._bases[size]
+        if size <= len(header):
+            return header[-size:] if size else b""
+        return header + base[len(header):]
+
+
+async def timed(coro_factory, repeat: int) -> List[float]:
+    """顺序执行 repeat 次请求，返回每次的耗时（秒）"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = await coro_factory()
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return samples
@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.harness import (
+    BENCH_SETTINGS, SyntheticFiles, git_revision, inprocess_client, latency_summary, login, server_client, timed
+)
+from benchmarks.compare import DEFAULT_THRESHOLD, compare, report
+
+_SIZE_UNITS = {"k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+
+# 修改设置后等待所有 worker 重新加载配置的时间（秒，略长于 ConfigService 的检查间隔）
+CONFIG_RELOAD_DELAY = 1.2
+
+# 并发配额检查中连接被服务器关闭的请求（记为被拒绝）
+REJECTED_CONNECTION = 0
+
+
+def parse_size(text: str) -> int:
+    """解析 4k、256k、1m 这样的大小"""
+    text = text.strip().lower()
+    if text and text[-1] in _SIZE_UNITS:
+        return int(float(text[:-1]) * _SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+class Recorder:
+    """收集指标和正确性检查，写成可以跨提交比较的 JSON"""
+
+    def __init__(self, params: Dict):
+        self.params = params
+        self.metrics: Dict[str, Dict] = {}
+        self.details: Dict[str, object] = {}
+        self.checks: Dict[str, Dict] = {}
+
+    def metric(self, name: str, value: float, unit: str, better: str):
+        self.metrics[name] = {"value": round(value, 3), "unit": unit, "better": better}
+
+    def latency(self, name: str, samples: List[float]):
+        """记录一组延迟：p50/p95 作为可比较的指标，完整统计放在 details"""
+        summary = latency_summary(samples)
+        self.details[name] = summary
+        self.metric(f"{name}.p50_ms", summary["p50_ms"], "ms", "lower")
+        self.metric(f"{name}.p95_ms", summary["p95_ms"], "ms", "lower")
+
+    def to_dict(self) -> Dict:
+        return {
+            "meta": {
+                "revision": git_revision(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "params": self.params,
+            "metrics": self.metrics,
+            "details": self.details,
+            "checks": self.checks,
+        }
+
+
+async def configure(client: httpx.AsyncClient, headers: Dict[str, str], **settings):
+    response = await client.put("/api/settings", json=settings, headers=headers)
+    response.raise_for_status()
+    # 其他 worker 进程在配置文件签名的检查间隔之后才会看到新设置
+    await asyncio.sleep(CONFIG_RELOAD_DELAY)
+
+
+async def create_tasks(client: httpx.AsyncClient, headers: Dict[str, str], count: int, prefix: str) -> List[str]:
+    task_ids = []
+    for index in range(count):
+        response = await client.post("/api/tasks/", json={"name": f"{prefix}-{index}"}, headers=headers)
+        response.raise_for_status()
+        task_ids.append(response.json()["id"])
+    return task_ids
+
+
+def upload_jobs(task_ids: List[str], args) -> List[Tuple[str, str, List[int]]]:
+    """生成上传请求：任务 × 上传者 × 文件，每个请求包含 batch 个文件，大小按 sizes 轮换"""
+    jobs = []
+    index = 0
+    for task_id in task_ids:
+        for uploader in range(args.uploaders):
+            sizes = []
+            for _ in range(args.files):
+                sizes.append(args.sizes[index % len(args.sizes)])
+                index += 1
+                if len(sizes) == args.batch:
+                    jobs.append((task_id, f"uploader-{uploader:04d}", sizes))
+                    sizes = []
+            if sizes:
+                jobs.append((task_id, f"uploader-{uploader:04d}", sizes))
+    return jobs
+
+
+async def run_uploads(
+    client: httpx.AsyncClient, jobs: List[Tuple[str, str, List[int]]], files: SyntheticFiles, concurrency: int
+) -> Tuple[float, List[float], int, int]:
+    """以 concurrency 个并发客户端执行上传，返回 (耗时, 每个请求的延迟, 文件数, 字节数)"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    latencies: List[float] = []
+    totals = {"files": 0, "bytes": 0}
+
+    async def worker():
+        while True:
+            try:
+                task_id, uploader, sizes = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = [("files", (f"f{i}-{size}.bin", files.make(size))) for i, size in enumerate(sizes)]
+            started = time.perf_counter()
+            response = await client.post(f"/api/upload/{task_id}", data={"uploader_name": uploader}, files=payload)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+            totals["files"] += len(sizes)
+            totals["bytes"] += sum(sizes)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, totals["files"], totals["bytes"]
+
+
+async def probe_listings(client: httpx.AsyncClient, headers: Dict[str, str], task_ids: List[str], repeat: int):
+    """测量任务列表和文件列表的延迟"""
+    list_tasks = await timed(lambda: client.get("/api/tasks/", headers=headers), repeat)
+    list_files = await timed(
+        lambda: client.get(f"/api/upload/{task_ids[0]}/files", headers=headers), repeat
+    )
+    return list_tasks, list_files
+
+
+async def bench_uploads_and_listings(client, headers, recorder: Recorder, args):
+    """分阶段上传，每个阶段之后测量列表延迟，观察随着文件增多的变化"""
+    await configure(client, headers, **BENCH_SETTINGS)
+    task_ids = await create_tasks(client, headers, args.tasks, "bench")
+    jobs = upload_jobs(task_ids, args)
+    files = SyntheticFiles(args.sizes)
+
+    stage_size = max(1, -(-len(jobs) // args.stages))
+    elapsed = 0.0
+    latencies: List[float] = []
+    total_files = total_bytes = 0
+    growth = []
+    list_tasks: List[float] = []
+    list_files: List[float] = []
+    for start in range(0, len(jobs), stage_size):
+        stage_elapsed, stage_latencies, stage_files, stage_bytes = await run_uploads(
+            client, jobs[start:start + stage_size], files, args.concurrency
+        )
+        elapsed += stage_elapsed
+        latencies.extend(stage_latencies)
+        total_files += stage_files
+        total_bytes += stage_bytes
+        list_tasks, list_files = await probe_listings(client, headers, task_ids, args.repeat)
+        growth.append({
+            "files": total_files,
+            "get_all_tasks": latency_summary(list_tasks),
+            "list_uploaded_files": latency_summary(list_files),
+        })
+
+    recorder.metric("upload.files_per_sec", total_files / elapsed, "files/s", "higher")
+    recorder.metric("upload.mb_per_sec", total_bytes / elapsed / (1024 * 1024), "MB/s", "higher")
+    recorder.latency("upload.request", latencies)
+    # 可比较的列表延迟取最后一个阶段（文件最多时）
+    recorder.latency("get_all_tasks", list_tasks)
+    recorder.latency("list_uploaded_files", list_files)
+    recorder.details["growth"] = growth
+    recorder.details["upload"] = {"files": total_files, "bytes": total_bytes, "seconds": round(elapsed, 3)}
+    return task_ids
+
+
+async def bench_precheck(client, headers, recorder: Recorder, task_id: str, args):
+    samples = await timed(lambda: client.post(
+        f"/api/upload/{task_id}/precheck",
+        data={"uploader_name": "uploader-0000", "file_count": "1", "total_size": str(args.sizes[0])},
+    ), args.repeat)
+    recorder.latency("precheck_upload", samples)
+
+
+async def check_quota_concurrency(client, headers, recorder: Recorder, args):
+    """同一上传者并发上传，成功次数必须正好等于每人上传次数限制，文件清单中不能多出文件"""
+    limit = args.quota_limit
+    await configure(client, headers, max_uploads_per_user=limit)
+    try:
+        task_id = (await create_tasks(client, headers, 1, "quota"))[0]
+        files = SyntheticFiles([4096])
+
+        async def upload_one(index: int) -> int:
+            content = files.make(4096)
+            try:
+                # 普通上传和流式上传混合，两条路径共用同一个配额账本
+                if index % 2:
+                    response = await client.post(
+                        f"/api/upload/{task_id}/stream", params={"uploader_name": "racer"},
+                        files=[("files", (f"race-{index}.bin", content))],
+                    )
+                else:
+                    response = await client.post(
+                        f"/api/upload/{task_id}", data={"uploader_name": "racer"},
+                        files=[("files", (f"race-{index}.bin", content))],
+                    )
+            except httpx.TransportError:
+                # 接收前检查拒绝请求后会关闭连接，客户端可能来不及读到 403 响应
+                return REJECTED_CONNECTION
+            return response.status_code
+
+        statuses = await asyncio.gather(*(upload_one(index) for index in range(args.quota_clients)))
+        listing = await client.get(f"/api/upload/{task_id}/files", params={"summary_only": "true"}, headers=headers)
+        listing.raise_for_status()
+        stored = listing.json()["total_count"]
+        accepted = statuses.count(200)
+        unexpected = sorted(set(status for status in statuses if status not in (200, 400, 403, REJECTED_CONNECTION)))
+    finally:
+        await configure(client, headers, max_uploads_per_user=BENCH_SETTINGS["max_uploads_per_user"])
+
+    recorder.checks["quota_concurrency"] = {
+        "passed": accepted == limit and stored == limit and not unexpected,
+        "limit": limit,
+        "clients": args.quota_clients,
+        "accepted": accepted,
+        "stored": stored,
+        "unexpected_statuses": unexpected,
+    }
+
+
+async def run(args) -> Dict:
+    recorder = Recorder({
+        "mode": args.mode,
+        "workers": args.workers,
+        "tasks": args.tasks,
+        "uploaders": args.uploaders,
+        "files": args.files,
+        "batch": args.batch,
+        "sizes": args.sizes,
+        "concurrency": args.concurrency,
+        "stages": args.stages,
+        "repeat": args.repeat,
+    })
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fastup-bench-")
+    if args.mode == "server":
+        client_context = server_client(workdir, args.workers)
+    else:
+        client_context = inprocess_client(workdir)
+
+    async with client_context as client:
+        headers = await login(client)
+        task_ids = await bench_uploads_and_listings(client, headers, recorder, args)
+        await bench_precheck(client, headers, recorder, task_ids[0], args)
+        if args.quota_clients:
+            await check_quota_concurrency(client, headers, recorder, args)
+    return recorder.to_dict()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="上传和管理接口的基准测试")
+    parser.add_argument("--mode", choices=("inprocess", "server"), default="inprocess",
+                        help="inprocess: 在当前进程中通过 ASGI 调用；server: 启动本地 uvicorn 通过 HTTP 调用")
+    parser.add_argument("--workers", type=int, default=1, help="server 模式下的 uvicorn worker 数")
+    parser.add_argument("--tasks", type=int, default=2, help="任务数")
+    parser.add_argument("--uploaders", type=int, default=10, help="每个任务的上传者数")
+    parser.add_argument("--files", type=int, default=5, help="每个上传者上传的文件数")
+    parser.add_argument("--batch", type=int, default=1, help="每个上传请求包含的文件数")
+    parser.add_argument("--sizes", default="4k,256k,1m", help="文件大小，逗号分隔，按顺序轮换")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发上传的客户端数")
+    parser.add_argument("--stages", type=int, default=4, help="分几个阶段上传（每个阶段后测量列表延迟）")
+    parser.add_argument("--repeat", type=int, default=20, help="每个延迟测量的请求次数")
+    parser.add_argument("--quota-limit", type=int, default=3, help="并发配额检查中的每人上传次数限制")
+    parser.add_argument("--quota-clients", type=int, default=16, help="并发配额检查的并发请求数（0 表示跳过）")
+    parser.add_argument("--workdir", help="数据目录（默认新建临时目录）")
+    parser.add_argument("--output", "-o", help="结果 JSON 的保存路径（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="与之比较的基线结果 JSON，出现回归时返回非零退出码")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="允许变差的比例（默认 0.2）")
+    args = parser.parse_args(argv)
+    args.sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    # 工作目录会被切换，输出和基线路径先转换为绝对路径
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    ok = all(check["passed"] for check in result["checks"].values())
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            ok = report(compare(json.load(f), result, args.threshold), result, args.threshold)
+    elif not ok:
+        print("correctness check FAILED", file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
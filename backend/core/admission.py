@@ -0,0 +1,389 @@
+import re
+import json
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from core.aio import run_io
+from core.metrics import registry, reject_upload
+from core.config import config_service, UploadSettings
+from core.space import space_ledger, low_water_bytes, InsufficientSpace
+from core.storage import task_storage
+from core.whitelist import whitelist_store
+
+# 需要做接收前检查的上传路由：POST /api/upload/{task_id} 和 POST /api/upload/{task_id}/stream
+UPLOAD_PATH_PATTERN = re.compile(r"^/api/upload/(?P<task_id>[^/]+)(?:/stream)?/?$")
+
+# 创建断点续传会话：POST /api/upload/{task_id}/resumable（只做频率限制）
+RESUMABLE_CREATE_PATTERN = re.compile(r"^/api/upload/(?P<task_id>[^/]+)/resumable/?$")
+
+# 断点续传的分块：PATCH /api/upload/resumable/{session_id}（只占用并发名额，不做频率限制）
+RESUMABLE_CHUNK_PATTERN = re.compile(r"^/api/upload/resumable/(?P<session_id>[^/]+)/?$")
+
+# 设置了并发或在途字节数上限但没有设置队列参数时使用的默认值
+DEFAULT_UPLOAD_QUEUE_SIZE = 100
+DEFAULT_UPLOAD_QUEUE_TIMEOUT = 30  # 秒
+
+# 队列已满时建议客户端等待的时间（秒）
+BUSY_RETRY_AFTER = 5
+
+# 令牌桶最多保留的键数（IP 和上传者各自计算），超过时丢弃已经回满的桶
+MAX_RATE_BUCKETS = 10000
+
+# 每个文件部分的 multipart 头和边界所占的额外字节数上限
+MULTIPART_OVERHEAD_PER_FILE = 64 * 1024
+
+
+class AdmissionRejected(Exception):
+    """请求体接收前或接收过程中被拒绝"""
+
+    def __init__(self, status_code: int, detail: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        # 指标中的拒绝原因（见 core.metrics.reject_upload）
+        self.reason = reason
+        # 429 时建议客户端等待的秒数（Retry-After）
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """按键（客户端 IP 或上传者）的令牌桶：每分钟补充 rate 个令牌，最多积累 burst 个"""
+
+    def __init__(self, max_keys: int = MAX_RATE_BUCKETS):
+        self.max_keys = max_keys
+        # 键 -> (令牌数, 上次更新时间)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str, rate: float, burst: Optional[float] = None) -> float:
+        """取一个令牌；成功返回 0，否则返回需要等待的秒数（不消耗令牌）"""
+        burst = max(burst or rate, 1)
+        per_second = rate / 60
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * per_second)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / per_second
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now, per_second, burst)
+        return 0.0
+
+    def _prune(self, now: float, per_second: float, burst: float):
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * per_second >= burst:
+                del self._buckets[key]
+
+
+def queue_timeout() -> float:
+    """排队等待上传名额或磁盘空间的最长时间（秒）"""
+    return config_service.get().settings.upload_queue_timeout or DEFAULT_UPLOAD_QUEUE_TIMEOUT
+
+
+class UploadGate:
+    """进程内同时接收的上传请求数和在途字节数的上限
+
+    超过上限的请求在有界队列中按到达顺序等待；队列已满或等待超时时返回 429。
+    单个请求的字节数超过在途上限时，在没有其他上传时单独放行，不会永远等待。
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.bytes_in_flight = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, size: int, settings: UploadSettings) -> bool:
+        if settings.max_concurrent_uploads and settings.max_concurrent_uploads > 0:
+            if self.active >= settings.max_concurrent_uploads:
+                return False
+        if settings.max_upload_bytes_in_flight and settings.max_upload_bytes_in_flight > 0:
+            if self.active and self.bytes_in_flight + size > settings.max_upload_bytes_in_flight * 1024 * 1024:
+                return False
+        return True
+
+    def _admit(self, size: int):
+        self.active += 1
+        self.bytes_in_flight += size
+
+    def _wake(self):
+        """按顺序放行队首能容纳的请求"""
+        settings = config_service.get().settings
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size, settings):
+                break
+            self._waiters.popleft()
+            self._admit(size)
+            future.set_result(None)
+
+    async def acquire(self, size: int):
+        """取得一个上传名额，需要时排队；不能排队时抛出 AdmissionRejected(429)"""
+        settings = config_service.get().settings
+        if not self._waiters and self._fits(size, settings):
+            self._admit(size)
+            return
+
+        queue_size = settings.upload_queue_size
+        if queue_size is None:
+            queue_size = DEFAULT_UPLOAD_QUEUE_SIZE
+        if len(self._waiters) >= queue_size:
+            raise AdmissionRejected(429, "上传人数较多，请稍后重试", "busy", BUSY_RETRY_AFTER)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, future))
+        timeout = queue_timeout()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                # 超时的同时刚好被放行
+                return
+            future.cancel()
+            raise AdmissionRejected(429, "上传人数较多，请稍后重试", "queue_timeout", BUSY_RETRY_AFTER)
+        except asyncio.CancelledError:
+            # 客户端在排队时断开
+            if future.done() and not future.cancelled():
+                self.release(size)
+            else:
+                future.cancel()
+            raise
+
+    def release(self, size: int):
+        self.active -= 1
+        self.bytes_in_flight -= size
+        self._wake()
+
+
+# 进程内的全局实例：多个 worker 进程时每个进程各自限制
+ip_limiter = RateLimiter()
+uploader_limiter = RateLimiter()
+upload_gate = UploadGate()
+
+registry.gauge_function("fastup_upload_admitted", "当前进程中已放行、正在处理的上传请求数", lambda: upload_gate.active)
+registry.gauge_function("fastup_upload_queued", "当前进程中排队等待的上传请求数", lambda: upload_gate.queued)
+registry.gauge_function(
+    "fastup_upload_bytes_in_flight", "当前进程中已放行的上传请求声明的总字节数", lambda: upload_gate.bytes_in_flight
+)
+
+
+def check_rate_limits(client_ip: Optional[str], uploader_name: Optional[str]):
+    """按客户端 IP 和上传者的令牌桶限制新上传的频率，超过时抛出 AdmissionRejected(429)"""
+    settings = config_service.get().settings
+    checks = (
+        (ip_limiter, client_ip, settings.ip_upload_rate, settings.ip_upload_burst, "上传过于频繁，请稍后重试"),
+        (uploader_limiter, uploader_name, settings.uploader_upload_rate, settings.uploader_upload_burst,
+         "您上传得过于频繁，请稍后重试"),
+    )
+    for limiter, key, rate, burst, detail in checks:
+        if key and rate and rate > 0:
+            wait = limiter.take(key, rate, burst)
+            if wait > 0:
+                raise AdmissionRejected(429, detail, "rate_limit", wait)
+
+
+def max_request_body(task_id: str, uploader_name: Optional[str]) -> Optional[int]:
+    """一次上传请求体允许的最大字节数；无法确定上限时返回 None
+
+    上限 = 单文件大小限制 × 本次最多可上传的文件数（单次数量限制与剩余次数中较小者）。
+    """
+    settings = config_service.get().settings
+    if not settings.max_file_size or settings.max_file_size <= 0:
+        return None
+
+    limits = []
+    if settings.max_files_per_upload and settings.max_files_per_upload > 0:
+        limits.append(settings.max_files_per_upload)
+    if uploader_name and settings.max_uploads_per_user and settings.max_uploads_per_user > 0:
+        limits.append(settings.max_uploads_per_user - task_storage.get_quota_usage(task_id, uploader_name))
+    if not limits:
+        return None
+
+    file_count = max(min(limits), 1)
+    return file_count * (settings.max_file_size * 1024 * 1024 + MULTIPART_OVERHEAD_PER_FILE)
+
+
+def check_upload_admission(task_id: str, uploader_name: Optional[str], content_length: Optional[int]) -> Optional[int]:
+    """只根据请求头和查询参数检查上传请求，不读取请求体
+
+    不通过时抛出 AdmissionRejected，状态码与上传接口自己检查时相同；通过时返回请求体的字节数上限（None 表示不限）。
+    白名单和上传次数只有在查询参数中提供了 uploader_name 时才能在这里检查，否则由接口在解析表单后检查。
+    分块传输（没有 Content-Length）时按上限预留磁盘空间；没有上限又设置了低水位时无法预留，返回 411。
+    """
+    task = task_storage.get_task(task_id)
+    if not task:
+        raise AdmissionRejected(404, "任务不存在", "task_not_found")
+    if task.status.value != "active":
+        raise AdmissionRejected(400, "任务已关闭，无法上传文件", "task_inactive")
+
+    settings = config_service.get().settings
+    if uploader_name:
+        if not whitelist_store.contains(uploader_name):
+            raise AdmissionRejected(403, "您不在允许上传的名单中", "whitelist")
+        max_uploads_per_user = settings.max_uploads_per_user
+        if max_uploads_per_user and max_uploads_per_user > 0:
+            if task_storage.get_quota_usage(task_id, uploader_name) >= max_uploads_per_user:
+                raise AdmissionRejected(400, f"您已达到上传次数限制 ({max_uploads_per_user}次)", "quota")
+
+    limit = max_request_body(task_id, uploader_name)
+    if limit is not None and content_length is not None and content_length > limit:
+        raise AdmissionRejected(413, f"上传内容超过大小限制 ({settings.max_file_size}MB/文件)", "size")
+    if limit is None and content_length is None and low_water_bytes() > 0:
+        raise AdmissionRejected(411, "上传请求缺少 Content-Length，无法预留磁盘空间", "length_required")
+    return limit
+
+
+def _parse_request(scope) -> Tuple[Optional[str], Optional[int]]:
+    """从查询参数取 uploader_name，从请求头取 Content-Length"""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    uploader_name = (query.get("uploader_name") or [""])[0].strip() or None
+
+    content_length = None
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                content_length = int(value)
+            except ValueError:
+                pass
+            break
+    return uploader_name, content_length
+
+
+class UploadAdmissionMiddleware:
+    """上传请求的接收前检查（纯 ASGI 中间件）
+
+    在读取请求体之前：
+    - 按客户端 IP 和上传者的令牌桶限制新上传的频率（429）
+    - 检查 Content-Length、任务状态、白名单和上传次数，不通过时立即返回 400/403/413，客户端不会先把整个文件传完
+      （白名单和上传次数需要查询参数 ?uploader_name=，只在表单中提供姓名时由接口在收到请求体后检查）
+    - 限制同时接收的上传数和在途字节数，超过时排队，队列满或等待超时返回 429
+    - 按请求体大小（分块传输时按请求体上限）预留磁盘空间，会低于低水位时等待其他上传结束，仍然不足返回 507；
+      分块传输且无法确定上限时返回 411
+    请求体超过上限时在接收过程中中断。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        uploader_name, content_length = _parse_request(scope)
+        client_ip = scope["client"][0] if scope.get("client") else None
+
+        if scope["method"] == "PATCH":
+            match = RESUMABLE_CHUNK_PATTERN.match(path)
+            if not match:
+                await self.app(scope, receive, send)
+                return
+            # 分块写入的文件在创建会话时已经预分配了空间，不再预留
+            await self._gated(scope, receive, send, content_length or 0, None, reserve_space=False)
+            return
+
+        match = RESUMABLE_CREATE_PATTERN.match(path)
+        if match:
+            try:
+                check_rate_limits(client_ip, uploader_name)
+            except AdmissionRejected as e:
+                await self._reject(send, e)
+                return
+            await self.app(scope, receive, send)
+            return
+
+        match = UPLOAD_PATH_PATTERN.match(path)
+        if not match or match.group("task_id") == "resumable":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            check_rate_limits(client_ip, uploader_name)
+            limit = await run_io(check_upload_admission, match.group("task_id"), uploader_name, content_length)
+        except AdmissionRejected as e:
+            await self._reject(send, e)
+            return
+        # 分块传输（没有 Content-Length）时按请求体上限计入在途字节数并预留磁盘空间
+        size = content_length if content_length is not None else (limit or 0)
+        await self._gated(scope, receive, send, size, limit)
+
+    async def _gated(self, scope, receive, send, size: int, limit: Optional[int], reserve_space: bool = True):
+        """取得上传名额和磁盘空间预留后处理请求，请求结束（包括客户端断开）时归还"""
+        try:
+            await upload_gate.acquire(size)
+        except AdmissionRejected as e:
+            await self._reject(send, e)
+            return
+        try:
+            try:
+                reservation = await space_ledger.reserve(size if reserve_space else 0, queue_timeout())
+            except InsufficientSpace:
+                await self._reject(send, AdmissionRejected(
+                    507, "服务器磁盘空间不足，请稍后重试或联系管理员", "disk_space", BUSY_RETRY_AFTER
+                ))
+                return
+            try:
+                await self._limited(scope, receive, send, limit)
+            finally:
+                await asyncio.shield(reservation.release())
+        finally:
+            upload_gate.release(size)
+
+    async def _limited(self, scope, receive, send, limit: Optional[int]):
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"received": 0, "response_started": False, "rejected": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > limit:
+                    # 超过上限：先返回 413，再让应用看到连接断开，停止读取剩余数据
+                    if not state["response_started"]:
+                        settings = config_service.get().settings
+                        await self._reject(send, AdmissionRejected(
+                            413, f"上传内容超过大小限制 ({settings.max_file_size}MB/文件)", "size"
+                        ))
+                    state["rejected"] = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if state["rejected"]:
+                return
+            if message["type"] == "http.response.start":
+                state["response_started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not state["rejected"]:
+                raise
+
+    @staticmethod
+    async def _reject(send, error: AdmissionRejected):
+        reject_upload(error.reason)
+        body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close"),
+        ]
+        if error.retry_after is not None:
+            headers.append((b"retry-after", str(max(1, math.ceil(error.retry_after))).encode()))
+        await send({"type": "http.response.start", "status": error.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,168 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from core.storage import task_storage, TaskStorage
+from core.metrics import registry
+
+T = TypeVar("T")
+
+# 文件系统和 SQLite 调用使用的线程数（可用环境变量 FASTUP_IO_THREADS 调整）
+IO_THREADS = int(os.environ.get("FASTUP_IO_THREADS", "0")) or min(32, (os.cpu_count() or 1) * 4)
+
+# 事件循环延迟的采样间隔（秒）
+LOOP_LAG_INTERVAL = 0.5
+
+# 超过该延迟（秒）的采样计为一次卡顿
+LOOP_LAG_STALL = 0.1
+
+
+class IOExecutor:
+    """专用于阻塞 I/O 的线程池，记录排队和执行中的调用数量"""
+
+    def __init__(self, max_workers: int = IO_THREADS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fastup-io")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.running = 0
+        self.completed = 0
+
+    def _call(self, func: Callable[..., T], args, kwargs) -> T:
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            self.submitted += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._call, func, args, kwargs))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "threads": self.max_workers,
+                "running": self.running,
+                "queued": self.submitted - self.completed - self.running,
+                "completed": self.completed,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class LoopLagMonitor:
+    """周期性地测量事件循环的调度延迟：sleep 实际醒来的时间比预期晚多少"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, stall_threshold: float = LOOP_LAG_STALL):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self._task: Optional[asyncio.Task] = None
+        self.last = 0.0
+        self.max = 0.0
+        self.total = 0.0
+        self.samples = 0
+        self.stalls = 0
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, time.monotonic() - expected))
+
+    def record(self, lag: float):
+        self.last = lag
+        self.max = max(self.max, lag)
+        self.total += lag
+        self.samples += 1
+        if lag >= self.stall_threshold:
+            self.stalls += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_ms": round(self.last * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "mean_ms": round(self.total / self.samples * 1000, 3) if self.samples else 0.0,
+            "samples": self.samples,
+            "stalls": self.stalls,
+        }
+
+
+io_executor = IOExecutor()
+loop_lag_monitor = LoopLagMonitor()
+
+registry.gauge_function("fastup_io_pool_running", "I/O 线程池中正在执行的调用数", lambda: io_executor.stats()["running"])
+registry.gauge_function("fastup_io_pool_queued", "I/O 线程池中排队等待的调用数", lambda: io_executor.stats()["queued"])
+registry.gauge_function("fastup_event_loop_lag_seconds", "最近一次采样的事件循环延迟", lambda: loop_lag_monitor.last)
+registry.gauge_function("fastup_event_loop_lag_max_seconds", "进程启动以来的最大事件循环延迟", lambda: loop_lag_monitor.max)
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """在 I/O 线程池中执行阻塞调用"""
+    return await io_executor.run(func, *args, **kwargs)
+
+
+def stat_paths(paths: Iterable[str]) -> List[Optional[os.stat_result]]:
+    """依次 stat 多个路径（不存在的为 None），供一次性放到线程池执行"""
+    result = []
+    for path in paths:
+        try:
+            result.append(os.stat(path))
+        except FileNotFoundError:
+            result.append(None)
+    return result
+
+
+async def stat_many(paths: Iterable[str]) -> List[Optional[os.stat_result]]:
+    """把一组 stat 合并成一次线程池调用"""
+    return await run_io(stat_paths, list(paths))
+
+
+class AsyncStorage:
+    """TaskStorage 的异步外观：每个方法调用都在 I/O 线程池中执行"""
+
+    def __init__(self, storage: TaskStorage):
+        self._storage = storage
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._storage, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await run_io(attr, *args, **kwargs)
+
+        return call
+
+
+def io_stats() -> Dict[str, Any]:
+    """I/O 线程池和事件循环延迟的当前状态"""
+    return {"io_pool": io_executor.stats(), "loop_lag": loop_lag_monitor.stats()}
+
+
+# 全局异步存储实例
+async_storage = AsyncStorage(task_storage)
@@ -0,0 +1,370 @@
+import os
+import json
+import uuid
+import zlib
+import shutil
+import asyncio
+import contextlib
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from core.aio import run_io
+from core.dedup import content_store
+from core.events import event_bus
+from core.locks import file_lock, lock_path_for, try_file_lock
+from core.storage import task_storage
+from core.zipstream import METHOD_DEFLATED, READ_CHUNK_SIZE, ZipMember, should_compress, write_zip
+from models.schemas import TaskResponse, TaskStatus
+
+# 归档目录（与 uploads/ 同级），每个任务一个 ZIP 和一个索引文件
+ARCHIVE_ROOT = "archives"
+
+# 后台归档的检查间隔（秒，可用环境变量 FASTUP_ARCHIVE_INTERVAL 调整，0 表示不自动归档）
+ARCHIVE_INTERVAL = float(os.environ.get("FASTUP_ARCHIVE_INTERVAL", "300"))
+
+# 归档时是否压缩：默认全部使用 STORED，单个文件在归档中是连续的原始字节，可以直接定位和按范围读取
+ARCHIVE_COMPRESS = False
+
+INDEX_VERSION = 1
+
+
+class ArchiveBusy(Exception):
+    """任务正在归档，或者有下载正在读取任务的文件"""
+
+
+def archive_paths(task_id: str) -> Tuple[str, str]:
+    """任务的归档文件和索引文件路径"""
+    base = os.path.join(ARCHIVE_ROOT, task_id)
+    return f"{base}.zip", f"{base}.idx.json"
+
+
+def _readers_lock_path(task_id: str) -> str:
+    # 读取任务文件的请求持有共享锁，归档（删除散落文件）需要排他锁
+    return os.path.join(ARCHIVE_ROOT, task_id)
+
+
+def acquire_reader(task_id: str) -> int:
+    """登记一个正在读取任务文件的请求，返回的文件描述符关闭时结束；正在归档时抛出 ArchiveBusy
+
+    会创建任务的锁文件，调用方需先确认任务存在；任务最终删除时由 remove_task_locks 清理。
+    """
+    os.makedirs(ARCHIVE_ROOT, exist_ok=True)
+    fd = try_file_lock(_readers_lock_path(task_id), shared=True)
+    if fd is None:
+        raise ArchiveBusy(task_id)
+    return fd
+
+
+def remove_task_locks(task_id: str):
+    """删除任务的读取锁和归档锁文件（任务的目录和归档都已删除之后调用）"""
+    for path in (_readers_lock_path(task_id), archive_paths(task_id)[0]):
+        try:
+            os.remove(lock_path_for(path))
+        except FileNotFoundError:
+            pass
+
+
+def _write_json(path: str, data: Dict):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+_index_cache: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+
+
+def load_index(task_id: str) -> Optional[Dict]:
+    """读取任务的归档索引（按文件签名缓存），没有归档时返回 None"""
+    _, index_path = archive_paths(task_id)
+    try:
+        stat = os.stat(index_path)
+    except FileNotFoundError:
+        _index_cache.pop(task_id, None)
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _index_cache.get(task_id)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(index_path, encoding="utf-8") as f:
+        index = json.load(f)
+    _index_cache[task_id] = (signature, index)
+    return index
+
+
+class ArchiveMember:
+    """归档中的单个文件（来自索引，data_offset 指向文件数据的第一个字节）"""
+
+    def __init__(self, archive_path: str, name: str, entry: Dict):
+        self.archive_path = archive_path
+        self.name = name
+        self.data_offset = entry["data_offset"]
+        self.size = entry["size"]
+        self.compressed_size = entry["compressed_size"]
+        self.method = entry["method"]
+        self.crc = entry["crc"]
+        self.mtime = entry["mtime"]
+
+    @property
+    def stored(self) -> bool:
+        """未压缩：归档中 [data_offset, data_offset + size) 就是文件内容"""
+        return self.method != METHOD_DEFLATED
+
+
+def find_member(task_id: str, uploader: str, filename: str) -> Optional[ArchiveMember]:
+    """在归档索引中查找文件"""
+    index = load_index(task_id)
+    if index is None:
+        return None
+    name = f"{uploader}/{filename}"
+    entry = index["members"].get(name)
+    if entry is None:
+        return None
+    return ArchiveMember(archive_paths(task_id)[0], name, entry)
+
+
+def _read_member_chunks(fd: int, member: ArchiveMember, chunk_size: int):
+    """从已打开的归档中按块读取文件内容（DEFLATE 的成员边读边解压）"""
+    inflater = None if member.stored else zlib.decompressobj(-15)
+    position = member.data_offset
+    remaining = member.compressed_size
+    while remaining > 0:
+        chunk = os.pread(fd, min(chunk_size, remaining), position)
+        if not chunk:
+            raise IOError(f"归档文件不完整: {member.name}")
+        position += len(chunk)
+        remaining -= len(chunk)
+        yield inflater.decompress(chunk) if inflater else chunk
+    if inflater:
+        yield inflater.flush()
+
+
+async def iter_member(member: ArchiveMember, chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """异步读取归档中的一个文件，直接定位到成员数据，不解析整个压缩包"""
+    fd = await run_io(os.open, member.archive_path, os.O_RDONLY)
+    try:
+        chunks = _read_member_chunks(fd, member, chunk_size)
+        while True:
+            chunk = await run_io(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+    finally:
+        os.close(fd)
+
+
+def _extract(task_id: str, folder_path: str):
+    """把归档中的文件解压回任务目录，保留原来的修改时间"""
+    archive_path, _ = archive_paths(task_id)
+    index = load_index(task_id)
+    if index is None:
+        return
+    fd = os.open(archive_path, os.O_RDONLY)
+    try:
+        for name, entry in index["members"].items():
+            member = ArchiveMember(archive_path, name, entry)
+            uploader, filename = name.split("/", 1)
+            path = os.path.join(folder_path, uploader, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as out:
+                for chunk in _read_member_chunks(fd, member, READ_CHUNK_SIZE):
+                    out.write(chunk)
+            os.utime(path, (member.mtime, member.mtime))
+    finally:
+        os.close(fd)
+
+
+def _remove_archive(task_id: str):
+    for path in archive_paths(task_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    _index_cache.pop(task_id, None)
+
+
+def archive_task(task_id: str) -> Optional[Dict]:
+    """把已完成的任务打包为一个 ZIP 并写出索引，然后删除散落的文件
+
+    任务不需要归档（不存在、未完成、已归档）或有下载正在读取时返回 None，下次再试。
+    """
+    archive_path, index_path = archive_paths(task_id)
+    os.makedirs(ARCHIVE_ROOT, exist_ok=True)
+    with file_lock(archive_path):
+        task = task_storage.get_task(task_id)
+        if not task or task.status != TaskStatus.COMPLETED or task.archived_at:
+            return None
+        readers = try_file_lock(_readers_lock_path(task_id))
+        if readers is None:
+            return None
+        try:
+            task_storage.reconcile_task(task_id)
+            entries = task_storage.list_files(task_id)
+            members = [
+                ZipMember(
+                    arcname=f"{entry['uploader']}/{entry['filename']}",
+                    path=os.path.join(task.folder_path, entry["uploader"], entry["filename"]),
+                    size=entry["size"],
+                    mtime=entry["mtime"],
+                    compress=ARCHIVE_COMPRESS and should_compress(entry["filename"])
+                )
+                for entry in entries
+            ]
+
+            tmp_path = f"{archive_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "wb") as out:
+                    index_entries = write_zip(members, out)
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, archive_path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+
+            archive_size = os.path.getsize(archive_path)
+            _write_json(index_path, {
+                "version": INDEX_VERSION,
+                "task_id": task_id,
+                "archive_size": archive_size,
+                "members": {entry.pop("name"): entry for entry in index_entries},
+            })
+            task_storage.set_task_archived(task_id, datetime.now().isoformat())
+            event_bus.publish(task_id)
+
+            # 归档和索引都已落盘，散落的文件可以删除了
+            shutil.rmtree(task.folder_path, ignore_errors=True)
+            os.makedirs(task.folder_path, exist_ok=True)
+        finally:
+            os.close(readers)
+
+    # 去重仓库中只被这些文件引用的内容对象
+    content_store.release({entry["sha256"] for entry in entries})
+    return {"files": len(members), "archive_size": archive_size}
+
+
+def restore_task(task_id: str) -> bool:
+    """把归档的任务解压回任务目录并删除归档，调用方需持有归档锁；任务未归档时返回 False"""
+    task = task_storage.get_task(task_id)
+    if not task or not task.archived_at:
+        return False
+    _extract(task_id, task.folder_path)
+    task_storage.set_task_archived(task_id, None)
+    _remove_archive(task_id)
+    task_storage.reconcile_task(task_id)
+    event_bus.publish(task_id)
+    return True
+
+
+def set_task_status(task_id: str, status: TaskStatus) -> Optional[TaskResponse]:
+    """更新任务状态；已归档的任务离开“已完成”状态时先解压回任务目录，才能继续上传"""
+    archive_path, _ = archive_paths(task_id)
+    os.makedirs(ARCHIVE_ROOT, exist_ok=True)
+    # 与归档互斥：归档过程中改状态会等归档结束，归档也不会在解压和改状态之间插进来
+    with file_lock(archive_path):
+        if status != TaskStatus.COMPLETED:
+            restore_task(task_id)
+        return task_storage.update_task_status(task_id, status)
+
+
+def set_tasks_status(task_ids: List[str], status: TaskStatus) -> List[TaskResponse]:
+    """批量更新任务状态，所有状态变化在一个事务中提交
+
+    当前为“已完成”的任务可能正在归档，先按顺序取得它们的归档锁；其中已归档且要离开“已完成”状态的任务先解压。
+    """
+    completed = sorted(
+        task.id for task in map(task_storage.get_task, dict.fromkeys(task_ids))
+        if task and task.status == TaskStatus.COMPLETED
+    )
+    os.makedirs(ARCHIVE_ROOT, exist_ok=True)
+    with contextlib.ExitStack() as stack:
+        for task_id in completed:
+            stack.enter_context(file_lock(archive_paths(task_id)[0]))
+        if status != TaskStatus.COMPLETED:
+            for task_id in completed:
+                restore_task(task_id)
+        return task_storage.update_tasks_status(list(dict.fromkeys(task_ids)), status)
+
+
+def discard_archive(task_id: str):
+    """删除任务的归档（清空任务文件时使用），任务不再标记为已归档"""
+    archive_path, _ = archive_paths(task_id)
+    os.makedirs(ARCHIVE_ROOT, exist_ok=True)
+    with file_lock(archive_path):
+        task_storage.set_task_archived(task_id, None)
+        _remove_archive(task_id)
+
+
+def archive_pending() -> Dict[str, Optional[Dict]]:
+    """归档所有已完成但尚未归档的任务，单个任务失败不影响其他任务"""
+    results = {}
+    for task_id in task_storage.get_tasks_to_archive():
+        try:
+            results[task_id] = archive_task(task_id)
+        except OSError as e:
+            # 文件在打包过程中被修改或磁盘空间不足等，下次再试
+            results[task_id] = {"error": str(e)}
+    return results
+
+
+class Archiver:
+    """后台归档：每隔 interval 秒检查一次，任务标记为已完成时可以用 trigger() 立即开始
+
+    多个 worker 进程各自运行，同一个任务由归档锁保证只被打包一次。
+    """
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_io(archive_pending)
+            except Exception:
+                # 数据库暂时不可用等，等下一轮
+                pass
+
+    def trigger(self):
+        """尽快检查一次（例如任务刚被标记为已完成）"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+
+
+# 全局后台归档实例
+archiver = Archiver()
+
+if __name__ == "__main__":
+    # 用法: python -m core.archive [task_id ...]
+    import sys
+
+    for task_id in sys.argv[1:] or task_storage.get_tasks_to_archive():
+        print(f"{task_id}: {archive_task(task_id)}")
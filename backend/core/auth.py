@@ -1,60 +1,205 @@
-from fastapi import HTTPException, Depends, status
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi import HTTPException, Depends, Query, status
+from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
-import secrets
+from typing import Optional
+import base64
+import hashlib
+import hmac
 import json
-import os
+import secrets
+import threading
+import time
+from core.config import config_service, AdminConfig
 
-# 创建基本HTTP认证实例
-security = HTTPBasic()
+# 创建基本HTTP认证实例（保留用于兼容脚本调用），以及 Bearer 令牌认证
+security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
 
 # 密码加密上下文
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# 获取配置文件路径
-config_path = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+# 令牌有效期（秒）
+TOKEN_TTL = 12 * 3600
 
-# 从配置文件加载管理员凭据
-def load_admin_credentials():
-    """从配置文件加载管理员凭据"""
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            return config.get('admin', {})
-    except FileNotFoundError:
-        # 如果配置文件不存在，抛出异常
-        raise FileNotFoundError("配置文件未找到")
-
-def verify_password(plain_password, expected_password):
-    """验证密码"""
-    return secrets.compare_digest(plain_password, expected_password)
-
-def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
-    """
-    验证凭据
+# 实时推送令牌的有效期（秒）：只在建立连接时检查，出现在查询参数（访问日志、浏览器历史）中也很快失效
+EVENTS_TOKEN_TTL = 60
+EVENTS_TOKEN_SCOPE = "events"
+
+# Basic 认证验证结果的缓存时间（秒），避免每个请求都做一次 bcrypt
+VERIFY_CACHE_TTL = 300
+VERIFY_CACHE_SIZE = 128
+
+_verify_cache = {}
+_verify_cache_lock = threading.Lock()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def ensure_admin_credentials() -> AdminConfig:
+    """确保配置中保存的是密码哈希和签名密钥
+
+    旧版本的配置文件保存明文密码，首次使用时转换为 bcrypt 哈希。
     """
-    # 加载最新的管理员凭据
-    admin_config = load_admin_credentials()
-    admin_username = admin_config.get("username")
-    admin_password = admin_config.get("password")
+    admin_config = config_service.get().admin
+    if not admin_config.password and admin_config.secret_key:
+        return admin_config
+
+    def apply(config: dict):
+        admin = config.setdefault("admin", {})
+        if admin.get("password"):
+            admin["password_hash"] = pwd_context.hash(admin.pop("password"))
+        if not admin.get("secret_key"):
+            admin["secret_key"] = secrets.token_urlsafe(32)
+
+    return config_service.update(apply).admin
+
+
+# 从配置服务获取管理员凭据
+def load_admin_credentials() -> AdminConfig:
+    """获取管理员凭据（来自缓存的配置快照）"""
+    admin_config = ensure_admin_credentials()
     
     # 确保配置文件中有用户名和密码
-    if not admin_username or not admin_password:
+    if not admin_config.username or not admin_config.password_hash:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="管理员凭据未在配置文件中正确配置",
         )
-    
-    # 验证用户名
-    correct_username = secrets.compare_digest(credentials.username, admin_username)
-    
-    # 验证密码
-    correct_password = verify_password(credentials.password, admin_password)
-    
-    if not (correct_username and correct_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="用户名或密码错误",
-            headers={"WWW-Authenticate": "Basic"},
-        )
-    return credentials.username
\ No newline at end of file
+    return admin_config
+
+
+def verify_password(plain_password: str, password_hash: str) -> bool:
+    """验证密码（bcrypt，较慢，只在登录时使用）"""
+    try:
+        return pwd_context.verify(plain_password, password_hash)
+    except ValueError:
+        return False
+
+
+def authenticate(username: str, password: str) -> bool:
+    """验证用户名和密码"""
+    admin_config = load_admin_credentials()
+    correct_username = secrets.compare_digest(username.encode(), admin_config.username.encode())
+    correct_password = verify_password(password, admin_config.password_hash)
+    return correct_username and correct_password
+
+
+def sign_token(data: dict, ttl: int) -> str:
+    """签发带过期时间的令牌：base64(payload).base64(HMAC-SHA256)，签名密钥与管理员令牌相同"""
+    admin_config = load_admin_credentials()
+    payload = _b64encode(json.dumps(
+        {**data, "exp": int(time.time()) + ttl},
+        separators=(",", ":"),
+    ).encode())
+    signature = hmac.new(admin_config.secret_key.encode(), payload.encode(), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(signature)}"
+
+
+def read_token(token: str) -> Optional[dict]:
+    """验证令牌的签名和过期时间，返回其中的数据；只做一次 HMAC 计算，不读文件"""
+    admin_config = load_admin_credentials()
+    try:
+        payload, signature = token.split(".", 1)
+        expected = hmac.new(admin_config.secret_key.encode(), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        data = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or data.get("exp", 0) < time.time():
+        return None
+    return data
+
+
+def create_access_token(username: str, ttl: int = TOKEN_TTL) -> str:
+    """签发管理员令牌"""
+    return sign_token({"sub": username}, ttl)
+
+
+def verify_access_token(token: str) -> Optional[str]:
+    """验证管理员令牌，成功时返回用户名；其他用途的令牌（带 scope）不能当作管理员令牌使用"""
+    data = read_token(token)
+    if data is None or "scope" in data or data.get("sub") != load_admin_credentials().username:
+        return None
+    return data["sub"]
+
+
+def _verify_basic_cached(credentials: HTTPBasicCredentials) -> bool:
+    """带缓存的 Basic 认证：缓存键为以签名密钥计算的 HMAC，不保存明文密码"""
+    admin_config = load_admin_credentials()
+    key = hmac.new(
+        admin_config.secret_key.encode(),
+        f"{credentials.username}:{credentials.password}".encode(),
+        hashlib.sha256,
+    ).digest()
+    now = time.monotonic()
+    with _verify_cache_lock:
+        expires = _verify_cache.get(key)
+        if expires and expires > now:
+            return True
+
+    if not authenticate(credentials.username, credentials.password):
+        return False
+
+    with _verify_cache_lock:
+        if len(_verify_cache) >= VERIFY_CACHE_SIZE:
+            _verify_cache.clear()
+        _verify_cache[key] = now + VERIFY_CACHE_TTL
+    return True
+
+
+def verify_admin(
+    bearer: Optional[HTTPAuthorizationCredentials] = Depends(bearer_security),
+    credentials: Optional[HTTPBasicCredentials] = Depends(security),
+):
+    """
+    验证凭据：优先使用 Bearer 令牌，兼容 Basic 认证
+    """
+    if bearer is not None:
+        username = verify_access_token(bearer.credentials)
+        if username:
+            return username
+    elif credentials is not None and _verify_basic_cached(credentials):
+        return credentials.username
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="用户名或密码错误",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def create_events_token(username: str) -> str:
+    """签发只能用于实时推送接口的短期令牌"""
+    return sign_token({"sub": username, "scope": EVENTS_TOKEN_SCOPE}, EVENTS_TOKEN_TTL)
+
+
+def verify_events_token(token: str) -> Optional[str]:
+    """验证实时推送令牌，成功时返回用户名"""
+    data = read_token(token)
+    if data is None or data.get("scope") != EVENTS_TOKEN_SCOPE or data.get("sub") != load_admin_credentials().username:
+        return None
+    return data["sub"]
+
+
+def verify_admin_query_token(
+    token: Optional[str] = Query(None, description="实时推送令牌（POST /api/events/token 获取，EventSource 无法设置请求头）"),
+    bearer: Optional[HTTPAuthorizationCredentials] = Depends(bearer_security),
+    credentials: Optional[HTTPBasicCredentials] = Depends(security),
+):
+    """
+    验证凭据：除请求头外，也接受查询参数 token 中的实时推送令牌
+
+    查询参数会出现在访问日志和浏览器历史中，所以只接受短期、只能用于实时推送的令牌，不接受管理员令牌。
+    """
+    if token:
+        username = verify_events_token(token)
+        if username:
+            return username
+    return verify_admin(bearer, credentials)
@@ -0,0 +1,166 @@
+import os
+import json
+import copy
+import time
+import tempfile
+import threading
+from typing import Callable, Optional, TextIO
+
+from pydantic import BaseModel, ConfigDict
+
+from core.locks import file_lock
+
+# 获取配置文件路径（可用环境变量 FASTUP_CONFIG 指定其他位置）
+config_path = os.environ.get("FASTUP_CONFIG") or os.path.join(os.path.dirname(__file__), '..', 'config.json')
+
+
+class AdminConfig(BaseModel):
+    """管理员凭据"""
+    model_config = ConfigDict(frozen=True, extra="allow")
+
+    username: Optional[str] = None
+    password: Optional[str] = None  # 旧版本的明文密码，首次使用时会被转换为 password_hash
+    password_hash: Optional[str] = None  # bcrypt 哈希
+    secret_key: Optional[str] = None  # 签发令牌用的密钥，修改密码时更换
+
+
+class UploadSettings(BaseModel):
+    """上传相关设置"""
+    model_config = ConfigDict(frozen=True, extra="allow")
+
+    max_file_size: Optional[int] = None  # MB
+    max_files_per_upload: Optional[int] = None
+    max_upload_errors: Optional[int] = None
+    max_uploads_per_user: Optional[int] = None  # 每人上传次数限制
+    upload_concurrency: Optional[int] = None  # 同一批次中同时写入的文件数
+    write_chunk_size: Optional[int] = None  # KB，攒够多少数据写一次磁盘
+    fsync_policy: Optional[str] = None  # none / file / batch，见 core/fileio.py
+    max_concurrent_uploads: Optional[int] = None  # 同时接收的上传请求数上限（每个 worker 进程）
+    max_upload_bytes_in_flight: Optional[int] = None  # MB，同时接收的上传请求总字节数上限（每个 worker 进程）
+    upload_queue_size: Optional[int] = None  # 超过上限时最多排队的请求数，0 表示不排队
+    upload_queue_timeout: Optional[int] = None  # 秒，排队等待的最长时间
+    ip_upload_rate: Optional[int] = None  # 每个 IP 每分钟最多开始的上传数
+    ip_upload_burst: Optional[int] = None  # 每个 IP 允许的突发上传数
+    uploader_upload_rate: Optional[int] = None  # 每个上传者每分钟最多开始的上传数
+    uploader_upload_burst: Optional[int] = None  # 每个上传者允许的突发上传数
+    disk_low_water_mark: Optional[int] = None  # MB，uploads/ 所在磁盘至少保留的可用空间
+
+
+class ConfigSnapshot(BaseModel):
+    """某一时刻解析好的配置，不可修改；version 在每次重新加载后递增"""
+    model_config = ConfigDict(frozen=True)
+
+    version: int
+    admin: AdminConfig
+    settings: UploadSettings
+
+
+def write_file_atomic(path: str, write: Callable[[TextIO], None]):
+    """先写同目录下的临时文件再重命名，读取方永远不会看到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def file_signature(path: str):
+    """用于判断文件是否被修改的签名（inode、大小、修改时间）"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class ConfigService:
+    """进程内的配置服务：缓存解析后的配置，文件变化时才重新解析
+
+    多个 worker 进程各自缓存一份配置；某个进程写入后文件签名改变，
+    其他进程最迟在 check_interval 之后重新加载，不需要额外的通知机制。
+    """
+
+    def __init__(self, path: str = config_path, check_interval: float = 1.0):
+        self.path = path
+        # 两次检查文件签名之间的最短间隔（秒），避免每个请求都 stat 一次
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._raw: dict = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._version = 0
+
+    def _read_raw(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _build(self, raw: dict) -> ConfigSnapshot:
+        self._version += 1
+        settings = dict(raw.get("settings") or {})
+        # 白名单单独存放（见 core/whitelist.py），不进入设置快照
+        settings.pop("upload_whitelist", None)
+        return ConfigSnapshot(
+            version=self._version,
+            admin=AdminConfig(**(raw.get("admin") or {})),
+            settings=UploadSettings(**settings),
+        )
+
+    def _reload_if_changed(self):
+        signature = file_signature(self.path)
+        if self._snapshot is not None and signature == self._signature:
+            return
+        raw = self._read_raw()
+        self._raw = raw
+        self._snapshot = self._build(raw)
+        self._signature = signature
+
+    def get(self) -> ConfigSnapshot:
+        """获取当前配置快照"""
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            self._reload_if_changed()
+            self._checked_at = now
+            return self._snapshot
+
+    def get_raw(self) -> dict:
+        """获取原始配置字典的副本"""
+        with self._lock:
+            self._reload_if_changed()
+            return copy.deepcopy(self._raw)
+
+    def update(self, mutate: Callable[[dict], None]) -> ConfigSnapshot:
+        """修改配置：mutate 接收原始配置字典的副本并就地修改，然后原子写回文件"""
+        # 文件锁保证其他 worker 进程的修改不会被覆盖：加锁后重新读取文件，再在最新内容上修改
+        with self._lock, file_lock(self.path):
+            self._reload_if_changed()
+            raw = copy.deepcopy(self._raw)
+            mutate(raw)
+            write_file_atomic(self.path, lambda f: json.dump(raw, f, ensure_ascii=False, indent=2))
+            self._raw = raw
+            self._snapshot = self._build(raw)
+            self._signature = file_signature(self.path)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+
+# 全局配置服务实例
+config_service = ConfigService()
@@ -0,0 +1,232 @@
+import os
+import time
+import uuid
+import hashlib
+from typing import Dict, Iterable, Optional, Tuple
+
+from core.storage import task_storage, content_object_path, CONTENT_STORE_ROOT
+
+# 内容仓库目录（与 uploads/ 同级，必须在同一文件系统上才能建立硬链接）
+STORE_ROOT = CONTENT_STORE_ROOT
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def new_hasher():
+    """上传内容使用的哈希算法（SHA-256，与前端秒传计算的摘要一致）"""
+    return hashlib.sha256()
+
+
+def hash_fd(fd: int) -> str:
+    """从头计算文件描述符内容的摘要（使用 pread，不改变文件位置）"""
+    hasher = new_hasher()
+    offset = 0
+    while True:
+        chunk = os.pread(fd, HASH_CHUNK_SIZE, offset)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        offset += len(chunk)
+    return hasher.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return hash_fd(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace_with_link(source: str, path: str):
+    """用指向 source 的硬链接原子地替换 path"""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.link")
+    os.link(source, tmp_path)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ContentStore:
+    """按内容摘要存放文件的仓库
+
+    每个不同的内容在 store/ 中保存一份，上传者文件夹中的文件都是它的硬链接，
+    uploads/ 实际占用的空间只随不重复的内容增长。链接数为 1 的对象已经没有任何文件引用：
+    删除文件后由 release 检查这些文件的摘要对应的对象，collect_garbage 遍历整个仓库（命令行使用）。
+    """
+
+    def __init__(self, root: str = STORE_ROOT):
+        self.root = root
+
+    def object_path(self, digest: str) -> str:
+        return content_object_path(digest, self.root)
+
+    def stat(self, digest: str) -> Optional[os.stat_result]:
+        try:
+            return os.stat(self.object_path(digest))
+        except FileNotFoundError:
+            return None
+
+    def has(self, digest: str, size: Optional[int] = None) -> bool:
+        """仓库中是否已有该内容"""
+        stat = self.stat(digest)
+        return stat is not None and (size is None or stat.st_size == size)
+
+    def range_digest(self, digest: str, size: int, prefix: bytes, offset: int, length: int) -> Optional[str]:
+        """prefix 加上对象中 [offset, offset + length) 的摘要（秒传的持有证明），仓库中没有该内容时返回 None"""
+        if not self.has(digest, size) or offset < 0 or length < 0 or offset + length > size:
+            return None
+        try:
+            fd = os.open(self.object_path(digest), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            hasher = new_hasher()
+            hasher.update(prefix)
+            while length > 0:
+                chunk = os.pread(fd, min(HASH_CHUNK_SIZE, length), offset)
+                if not chunk:
+                    return None
+                hasher.update(chunk)
+                offset += len(chunk)
+                length -= len(chunk)
+            return hasher.hexdigest()
+        finally:
+            os.close(fd)
+
+    def link_to(self, digest: str, size: int, path: str) -> bool:
+        """如果仓库中已有该内容，把 path 替换为它的硬链接并返回 True"""
+        if not self.has(digest, size):
+            return False
+        try:
+            _replace_with_link(self.object_path(digest), path)
+        except FileNotFoundError:
+            # 对象刚好被垃圾回收
+            return False
+        except OSError:
+            # 文件系统不支持硬链接，保留独立副本
+            return False
+        return True
+
+    def adopt(self, path: str, digest: str) -> bool:
+        """把刚写好的文件纳入仓库
+
+        已有相同内容时把 path 换成已有对象的硬链接并返回 True（重复文件）；
+        否则 path 本身成为该内容的对象，返回 False。
+        """
+        size = os.stat(path).st_size
+        object_path = self.object_path(digest)
+        for _ in range(3):
+            stat = self.stat(digest)
+            if stat is not None:
+                if os.path.samestat(stat, os.stat(path)):
+                    return False
+                if stat.st_size == size and self.link_to(digest, size, path):
+                    return True
+                if stat.st_size != size:
+                    return False
+            try:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(path, object_path)
+                return False
+            except FileExistsError:
+                # 另一个请求同时写入了相同内容，重试时链接到它
+                continue
+            except OSError:
+                return False
+        return False
+
+    @staticmethod
+    def _remove_unreferenced(paths: Iterable[str]) -> Tuple[int, int]:
+        removed = freed = 0
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                if stat.st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+                    freed += stat.st_size
+            except FileNotFoundError:
+                continue
+        return removed, freed
+
+    def release(self, digests: Iterable[Optional[str]]) -> Tuple[int, int]:
+        """文件被删除后调用：只检查这些摘要对应的对象，删除其中不再被引用的，返回 (删除数量, 释放字节数)
+
+        没有摘要（None）的文件从未进入仓库，直接跳过。
+        """
+        return self._remove_unreferenced(self.object_path(digest) for digest in digests if digest)
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        """遍历整个仓库，删除不再被任何文件引用的对象，返回 (删除数量, 释放字节数)
+
+        需要 stat 每一个对象，只在命令行中使用；删除文件的代码路径使用 release。
+        """
+        if not os.path.isdir(self.root):
+            return 0, 0
+        return self._remove_unreferenced(
+            os.path.join(directory, filename)
+            for directory, _, filenames in os.walk(self.root)
+            for filename in filenames
+        )
+
+
+def dedup_task(task_id: str, store: Optional["ContentStore"] = None) -> Optional[Dict]:
+    """对任务中已有的文件做一次去重：补算缺失的摘要，并把重复文件换成硬链接
+
+    返回处理结果，任务不存在时返回 None。
+    """
+    store = store or content_store
+    task = task_storage.get_task(task_id)
+    if not task:
+        return None
+
+    hashed = linked = 0
+    for entry in task_storage.list_files(task_id):
+        path = os.path.join(task.folder_path, entry["uploader"], entry["filename"])
+        try:
+            digest = entry["sha256"]
+            if digest is None:
+                digest = hash_file(path)
+                task_storage.set_file_hash(task_id, entry["uploader"], entry["filename"], digest)
+                hashed += 1
+            if store.adopt(path, digest):
+                linked += 1
+        except FileNotFoundError:
+            # 文件已被删除，等待下次 reconcile
+            continue
+    return {"hashed": hashed, "linked": linked}
+
+
+def dedup_all(store: Optional["ContentStore"] = None) -> Dict:
+    """对所有任务做一次去重，然后回收无人引用的对象"""
+    store = store or content_store
+    started = time.monotonic()
+    results = {task.id: dedup_task(task.id, store) for task in task_storage.get_all_tasks()}
+    removed, freed = store.collect_garbage()
+    return {
+        "tasks": results,
+        "garbage_removed": removed,
+        "garbage_freed": freed,
+        "elapsed": round(time.monotonic() - started, 3),
+    }
+
+
+# 全局内容仓库实例
+content_store = ContentStore()
+
+if __name__ == "__main__":
+    # 用法: python -m core.dedup [task_id ...]
+    import sys
+
+    task_ids = sys.argv[1:]
+    if task_ids:
+        for task_id in task_ids:
+            print(f"{task_id}: {dedup_task(task_id)}")
+        print("garbage:", content_store.collect_garbage())
+    else:
+        print(dedup_all())
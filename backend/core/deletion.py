@@ -0,0 +1,180 @@
+import os
+import time
+import shutil
+import asyncio
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.aio import run_io
+from core.archive import archive_paths, remove_task_locks
+from core.dedup import content_store
+from core.locks import file_lock
+from core.storage import task_storage, TaskStorage
+
+# 每批删除的文件数：一批在线程池中执行一次，批与批之间让出磁盘给正在进行的上传
+DELETE_BATCH_FILES = 200
+
+# 两批之间的间隔（秒）
+DELETE_BATCH_PAUSE = 0.05
+
+# 没有待删除的目录时，检查新任务的间隔（秒）
+DELETE_POLL_INTERVAL = 30
+
+# 认领的有效期（秒）：worker 进程退出后，其他进程在这段时间后接手未完成的删除
+DELETE_CLAIM_LEASE = 60
+
+# 已完成的删除记录保留时间（秒），用于查询进度
+DELETE_HISTORY_TTL = 24 * 3600
+
+
+def delete_batches(folder_path: str, limit: int = DELETE_BATCH_FILES) -> Iterator[Tuple[int, int]]:
+    """逐批删除目录中的文件，每删除 limit 个文件产出一次 (删除的文件数, 字节数)
+
+    整个目录只遍历一次（自底向上），批与批之间从上次停下的位置继续；子目录清空后立即删除，不再被遍历。
+    """
+    removed = removed_bytes = 0
+    for directory, _, filenames in os.walk(folder_path, topdown=False):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                size = os.lstat(path).st_size
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            removed_bytes += size
+            if removed >= limit:
+                yield removed, removed_bytes
+                removed = removed_bytes = 0
+        if directory != folder_path:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+    if removed:
+        yield removed, removed_bytes
+
+
+def finish_deletion(task_id: str, folder_path: str):
+    """删除剩下的空目录、任务的归档和锁文件"""
+    shutil.rmtree(folder_path, ignore_errors=True)
+    archive_path, index_path = archive_paths(task_id)
+    if os.path.exists(archive_path) or os.path.exists(index_path):
+        # 等待可能正在进行的归档结束，避免归档在删除之后才写出
+        with file_lock(archive_path):
+            for path in (archive_path, index_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    remove_task_locks(task_id)
+
+
+class FolderDeleter:
+    """后台删除已删除任务的目录
+
+    删除任务时只在数据库中登记待删除的目录（与删除任务在同一个事务中），由这里分批删除：
+    每批最多 batch_files 个文件，批与批之间暂停，不与正在进行的上传争抢磁盘。
+    进度记录在数据库中，多个 worker 进程通过带有效期的认领分工，进程重启后会继续未完成的删除。
+    """
+
+    def __init__(
+        self,
+        storage: TaskStorage = task_storage,
+        batch_files: int = DELETE_BATCH_FILES,
+        batch_pause: float = DELETE_BATCH_PAUSE,
+        poll_interval: float = DELETE_POLL_INTERVAL,
+    ):
+        self.storage = storage
+        self.batch_files = batch_files
+        self.batch_pause = batch_pause
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def delete_folder(self, job: Dict):
+        """分批删除一个目录，每批之后更新进度；最后回收只被这些文件引用的内容对象"""
+        batches = delete_batches(job["folder_path"], self.batch_files)
+        while True:
+            # 每批在线程池中执行一次
+            batch = await run_io(next, batches, None)
+            if batch is None:
+                break
+            removed, removed_bytes = batch
+            await run_io(self.storage.update_folder_deletion, job["id"], removed, removed_bytes)
+            await asyncio.sleep(self.batch_pause)
+        await run_io(finish_deletion, job["task_id"], job["folder_path"])
+        await self.release_objects(job["id"])
+        await run_io(self.storage.update_folder_deletion, job["id"], 0, 0, True)
+
+    async def release_objects(self, deletion_id: int):
+        """按删除任务时记录的摘要分批检查去重仓库中的对象，不遍历整个仓库"""
+        after = ""
+        while True:
+            digests = await run_io(self.storage.list_folder_deletion_digests, deletion_id, after, self.batch_files)
+            if not digests:
+                break
+            await run_io(content_store.release, digests)
+            after = digests[-1]
+
+    async def drain(self) -> int:
+        """处理所有待删除的目录，返回处理的数量"""
+        count = 0
+        while True:
+            job = await run_io(self.storage.claim_folder_deletion, DELETE_CLAIM_LEASE)
+            if job is None:
+                break
+            await self.delete_folder(job)
+            count += 1
+        await run_io(self.storage.purge_folder_deletions, time.time() - DELETE_HISTORY_TTL)
+        return count
+
+    async def _run(self):
+        while True:
+            try:
+                await self.drain()
+            except Exception:
+                # 数据库暂时不可用等，等下一轮
+                pass
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def trigger(self):
+        """有新的待删除目录时尽快开始"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+
+
+def deletion_progress(storage: TaskStorage = task_storage) -> List[Dict]:
+    """未完成和最近完成的目录删除及其进度"""
+    jobs = storage.list_folder_deletions(time.time() - DELETE_HISTORY_TTL)
+    for job in jobs:
+        job["finished"] = job["finished_at"] is not None
+        if job["finished"]:
+            job["progress"] = 1.0
+        elif job["total_files"]:
+            job["progress"] = round(min(1.0, job["removed_files"] / job["total_files"]), 4)
+        else:
+            job["progress"] = 0.0
+    return jobs
+
+
+# 全局后台删除实例
+folder_deleter = FolderDeleter()
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Dict, List, Optional, Set
+
+from core.aio import run_io
+from core.metrics import registry
+from core.storage import task_storage, TaskStorage
+from models.schemas import TaskResponse, UploadTaskInfo
+
+# 同一个任务在这段时间内的多次变化合并为一次推送（秒）
+EVENT_FLUSH_INTERVAL = 0.5
+
+# 跨进程分发时轮询事件表的间隔（秒）
+EVENT_POLL_INTERVAL = 0.5
+
+# 事件表中的记录保留时间（秒），只需要覆盖各 worker 的轮询间隔
+EVENT_RETENTION = 60
+
+# 每个订阅者最多积压的消息数，超过时断开该连接（客户端重连后重新获取快照）
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# 分发方式：local 只在当前进程内分发；sqlite 通过 tasks.db 中的事件表分发给所有 worker 进程和节点
+# （main.py 以多个 worker 启动时默认使用 sqlite）
+EVENT_FANOUT = os.environ.get("FASTUP_EVENT_FANOUT", "local")
+
+# 订阅全部任务（任务列表）使用的主题
+ALL_TASKS = "*"
+
+
+def format_sse(event: str, data) -> str:
+    """一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class TaskUpdate:
+    """一个任务的最新状态，推送给所有订阅者时共用，消息文本只生成一次
+
+    task 为 None 表示任务已被删除。
+    """
+
+    def __init__(self, task_id: str, task: Optional[TaskResponse], users_count: int = 0):
+        self.task_id = task_id
+        self.task = task
+        self.users_count = users_count
+        self._admin_message: Optional[str] = None
+        self._public_message: Optional[str] = None
+
+    @property
+    def deleted(self) -> bool:
+        return self.task is None
+
+    def admin_data(self) -> Dict:
+        """任务列表中的一项（与 GET /api/tasks/ 相同，另外带上传人数）"""
+        data = self.task.model_dump(mode="json")
+        data["uploaded_users_count"] = self.users_count
+        return data
+
+    def public_data(self) -> Dict:
+        """上传页面使用的任务信息（与 GET /api/tasks/{task_id}/info 相同）"""
+        return UploadTaskInfo(
+            task_id=self.task.id,
+            task_name=self.task.name,
+            description=self.task.description,
+            status=self.task.status,
+            uploaded_files_count=self.task.uploaded_files_count,
+            uploaded_users_count=self.users_count,
+        ).model_dump(mode="json")
+
+    @property
+    def admin_message(self) -> str:
+        if self._admin_message is None:
+            self._admin_message = (
+                format_sse("deleted", {"id": self.task_id}) if self.deleted else format_sse("task", self.admin_data())
+            )
+        return self._admin_message
+
+    @property
+    def public_message(self) -> str:
+        if self._public_message is None:
+            self._public_message = (
+                format_sse("deleted", {"task_id": self.task_id}) if self.deleted
+                else format_sse("task", self.public_data())
+            )
+        return self._public_message
+
+
+def load_updates(task_ids: List[str], storage: TaskStorage = task_storage) -> List[TaskUpdate]:
+    """读取一组任务的最新状态（一次线程池调用）"""
+    updates = []
+    for task_id in task_ids:
+        task = storage.get_task(task_id)
+        users_count = storage.get_actual_counts(task_id)[1] if task else 0
+        updates.append(TaskUpdate(task_id, task, users_count))
+    return updates
+
+
+def load_all_updates(storage: TaskStorage = task_storage) -> List[TaskUpdate]:
+    """读取全部任务的当前状态（任务列表的快照）"""
+    users_counts = storage.count_users_by_task()
+    return [TaskUpdate(task.id, task, users_counts.get(task.id, 0)) for task in storage.get_all_tasks()]
+
+
+class EventBus:
+    """进程内的任务变化通知
+
+    publish() 只记录“哪个任务变了”（可以在任何线程调用），后台循环每隔 flush_interval 秒
+    把积累的变化合并，每个任务只读取一次最新状态，再分发给订阅了该任务或任务列表的连接。
+    fanout="sqlite" 时各进程把自己的变化写入事件表，并轮询其他进程写入的变化。
+    """
+
+    def __init__(
+        self,
+        storage: TaskStorage = task_storage,
+        fanout: str = EVENT_FANOUT,
+        flush_interval: float = EVENT_FLUSH_INTERVAL,
+        poll_interval: float = EVENT_POLL_INTERVAL,
+    ):
+        self.storage = storage
+        self.fanout = fanout
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_event_id = 0
+        self._last_purge = 0.0
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, task_id: str):
+        """记录任务发生了变化（线程安全）"""
+        with self._lock:
+            self._pending.add(task_id)
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        """订阅一个任务（task_id）或全部任务（ALL_TASKS），队列中收到 TaskUpdate，None 表示连接应当结束"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(topic)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[topic]
+
+    def _deliver(self, topic: str, update: TaskUpdate):
+        for queue in list(self._subscribers.get(topic, ())):
+            try:
+                queue.put_nowait(update)
+            except asyncio.QueueFull:
+                # 客户端读得太慢：清空积压并让连接结束
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.unsubscribe(topic, queue)
+
+    def _exchange(self, local: List[str]) -> List[str]:
+        """写入本进程的变化并读出所有进程的变化（一次线程池调用）"""
+        if local:
+            self.storage.append_task_events(local)
+        task_ids, self._last_event_id = self.storage.read_task_events(self._last_event_id)
+        now = time.time()
+        if now - self._last_purge > EVENT_RETENTION:
+            self._last_purge = now
+            self.storage.purge_task_events(now - EVENT_RETENTION)
+        return task_ids
+
+    async def flush(self):
+        """处理积累的变化"""
+        with self._lock:
+            local, self._pending = list(self._pending), set()
+        if self.fanout == "sqlite":
+            try:
+                changed = await run_io(self._exchange, local)
+            except BaseException:
+                # 没有写入事件表的变化留到下一轮
+                with self._lock:
+                    self._pending.update(local)
+                raise
+        else:
+            changed = local
+        if not changed or not self._subscribers:
+            return
+        task_ids = list(dict.fromkeys(changed))
+        for update in await run_io(load_updates, task_ids, self.storage):
+            self._deliver(update.task_id, update)
+            self._deliver(ALL_TASKS, update)
+
+    async def _run(self):
+        timeout = self.poll_interval if self.fanout == "sqlite" else None
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # 数据库暂时不可用等，下一轮再试
+                pass
+            # 限制推送频率，这段时间内的变化在下一轮合并
+            await asyncio.sleep(self.flush_interval)
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            if self.fanout == "sqlite":
+                self._last_event_id = await run_io(self.storage.last_task_event_id)
+            self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop = None
+        # 让所有连接结束，服务器关闭时不必等待
+        for topic, queues in list(self._subscribers.items()):
+            for queue in list(queues):
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+        self._subscribers.clear()
+
+
+# 全局事件总线实例
+event_bus = EventBus()
+
+registry.gauge_function("fastup_event_subscribers", "当前进程中打开的事件流连接数", lambda: event_bus.subscriber_count)
@@ -0,0 +1,359 @@
+import os
+import time
+import errno
+import asyncio
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.aio import run_io
+
+# 攒够这么多数据才写一次磁盘，减少线程切换次数（可通过 write_chunk_size 设置）
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# 上传中的文件先写入上传者文件夹中的隐藏临时文件，写完后才改名为最终文件名；
+# 以 "." 开头的文件不会出现在文件清单中，也不计入上传次数
+TEMP_PREFIX = ".upload-"
+TEMP_SUFFIX = ".part"
+
+# 超过这个时间仍未完成的临时文件视为进程崩溃遗留（秒，长于断点续传会话的有效期）
+TEMP_FILE_TTL = 2 * 24 * 3600
+
+# fsync 策略（可通过 fsync_policy 设置）
+# none：不主动 fsync，由操作系统回写。进程崩溃或请求中断不会留下写了一半的文件，但断电可能丢失最近的文件
+# file：每个文件改名前 fsync 文件数据，改名后 fsync 所在目录
+# batch：与 file 相同，但同一时间段内所有请求的 fsync 合并到一次线程池调用中执行，同一目录只同步一次
+FSYNC_NONE = "none"
+FSYNC_FILE = "file"
+FSYNC_BATCH = "batch"
+
+# batch 策略下收集 fsync 请求的时间（秒）
+FSYNC_BATCH_DELAY = 0.01
+
+
+def write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def copy_fd(src_fd: int, dst_fd: int, count: Optional[int] = None) -> int:
+    """在内核中把 src_fd 的内容（从头开始）复制到 dst_fd，返回复制的字节数
+
+    优先使用 copy_file_range（同一文件系统上可以直接共享数据块），
+    不支持时退回 sendfile，最后才在用户态复制。
+    """
+    if count is None:
+        count = os.fstat(src_fd).st_size
+    copied = 0
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < count:
+                n = os.copy_file_range(src_fd, dst_fd, count - copied, copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError:
+            if copied:
+                raise
+
+    if hasattr(os, "sendfile"):
+        try:
+            while copied < count:
+                n = os.sendfile(dst_fd, src_fd, copied, count - copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError:
+            if copied:
+                raise
+
+    while copied < count:
+        chunk = os.pread(src_fd, min(WRITE_BUFFER_SIZE, count - copied), copied)
+        if not chunk:
+            break
+        write_all(dst_fd, chunk)
+        copied += len(chunk)
+    return copied
+
+
+def candidate_names(filename: str) -> Iterator[str]:
+    """依次给出可用的文件名：原文件名，之后是带时间戳后缀和序号的文件名"""
+    name, ext = os.path.splitext(filename)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    yield filename
+    yield f"{name}_{timestamp}{ext}"
+    attempt = 1
+    while True:
+        yield f"{name}_{timestamp}_{attempt}{ext}"
+        attempt += 1
+
+
+def preallocate(fd: int, size: Optional[int]):
+    """按已知大小预先分配磁盘空间：空间不足时在写入数据之前就失败，大文件也更少产生碎片
+
+    文件大小会变为 size，写完后由 finish_temp_file 截掉没有用到的部分。
+    """
+    if not size or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        # 文件系统不支持预分配，直接写入
+
+
+def create_temp_file(directory: str, size: Optional[int] = None) -> Tuple[int, str]:
+    """在 directory 中创建临时文件，返回 (文件描述符, 路径)；目录不存在时先创建"""
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX, dir=directory)
+    try:
+        os.fchmod(fd, 0o644)
+        preallocate(fd, size)
+    except BaseException:
+        os.close(fd)
+        os.remove(path)
+        raise
+    return fd, path
+
+
+def discard_temp_file(path: str):
+    """删除未发布的临时文件（写入失败或被取消时），文件已不存在时忽略"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def link_new_name(source: str, directory: str, filename: str) -> str:
+    """在 directory 中为 source 建立一个新的硬链接，不覆盖已有文件，返回链接的路径
+
+    目标已存在时 link 与 O_EXCL 一样失败，依次尝试 candidate_names，同名文件并发完成时各自得到不同的名字。
+    """
+    for candidate in candidate_names(filename):
+        path = os.path.join(directory, candidate)
+        try:
+            os.link(source, path)
+            return path
+        except FileExistsError:
+            continue
+
+
+def publish_file(tmp_path: str, directory: str, filename: str) -> str:
+    """把写好的临时文件改名为 directory 中不与已有文件冲突的文件名，返回最终路径
+
+    最终文件名出现时内容已经完整。文件系统不支持硬链接时，先以 O_EXCL 创建占位文件再用 rename 原子替换。
+    """
+    try:
+        path = link_new_name(tmp_path, directory, filename)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        for candidate in candidate_names(filename):
+            path = os.path.join(directory, candidate)
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            except FileExistsError:
+                continue
+            os.replace(tmp_path, path)
+            return path
+    os.remove(tmp_path)
+    return path
+
+
+def fsync_directory(directory: str):
+    """同步目录项，使刚创建或改名的文件在断电后仍然存在"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def remove_stale_temp_files(folder_path: str, ttl: float = TEMP_FILE_TTL) -> int:
+    """删除任务目录中进程崩溃遗留的临时文件，返回删除的数量"""
+    removed = 0
+    cutoff = time.time() - ttl
+    for directory, _, filenames in os.walk(folder_path):
+        for filename in filenames:
+            if not (filename.startswith(TEMP_PREFIX) and filename.endswith(TEMP_SUFFIX)):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                if os.lstat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+class SyncBatcher:
+    """合并 fsync：收集 delay 秒内的请求，在一次线程池调用中依次执行，同一目录只同步一次
+
+    文件描述符在登记时复制一份，调用方被取消后关闭自己的描述符也不影响批次中的 fsync。
+    """
+
+    def __init__(self, delay: float = FSYNC_BATCH_DELAY):
+        self.delay = delay
+        self._files: List[Tuple[int, asyncio.Future]] = []
+        self._directories: Dict[str, List[asyncio.Future]] = {}
+        self._scheduled = False
+
+    async def fsync(self, fd: Optional[int] = None, directory: Optional[str] = None):
+        """等待文件（fd）或目录（directory）在下一批中同步完成"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if fd is not None:
+            self._files.append((os.dup(fd), future))
+        else:
+            self._directories.setdefault(directory, []).append(future)
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_later(self.delay, lambda: asyncio.ensure_future(self._flush()))
+        await future
+
+    @staticmethod
+    def _sync_all(fds: List[int], directories: List[str]) -> List[Optional[OSError]]:
+        errors = []
+        for fd in fds:
+            try:
+                os.fsync(fd)
+                errors.append(None)
+            except OSError as e:
+                errors.append(e)
+            finally:
+                os.close(fd)
+        for directory in directories:
+            try:
+                fsync_directory(directory)
+                errors.append(None)
+            except OSError as e:
+                errors.append(e)
+        return errors
+
+    async def _flush(self):
+        files, self._files = self._files, []
+        directories, self._directories = self._directories, {}
+        self._scheduled = False
+        waiters = [[future] for _, future in files] + list(directories.values())
+        try:
+            errors = await run_io(self._sync_all, [fd for fd, _ in files], list(directories))
+        except BaseException as e:
+            errors = [e] * len(waiters)
+        for futures, error in zip(waiters, errors):
+            for future in futures:
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+
+# 全局 fsync 合并实例
+sync_batcher = SyncBatcher()
+
+
+def _truncate(fd: int, size: int):
+    if os.fstat(fd).st_size != size:
+        os.ftruncate(fd, size)
+
+
+async def finish_temp_file(
+    fd: int, tmp_path: str, directory: str, filename: str, fsync_policy: Optional[str] = None, size: Optional[int] = None
+) -> str:
+    """结束临时文件的写入并以不冲突的文件名发布，返回最终路径（fd 仍由调用方关闭）
+
+    size 为实际写入的字节数，用于截掉预分配但没有用到的空间；按 fsync_policy 在改名前同步数据、改名后同步目录。
+    """
+    if size is not None:
+        await run_io(_truncate, fd, size)
+    if fsync_policy == FSYNC_FILE:
+        await run_io(os.fsync, fd)
+    elif fsync_policy == FSYNC_BATCH:
+        await sync_batcher.fsync(fd=fd)
+    path = await run_io(publish_file, tmp_path, directory, filename)
+    if fsync_policy == FSYNC_FILE:
+        await run_io(fsync_directory, directory)
+    elif fsync_policy == FSYNC_BATCH:
+        await sync_batcher.fsync(directory=directory)
+    return path
+
+
+def spooled_fileno(file) -> Optional[int]:
+    """如果上传文件已经被框架落盘（SpooledTemporaryFile 已 rollover），返回其文件描述符"""
+    if getattr(file, "_rolled", True) is False:
+        return None
+    try:
+        return file.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class BufferedFileWriter:
+    """把流式数据写入 directory 中的临时文件：数据先在内存中攒成大块，再在线程池中一次写入
+
+    commit() 之后文件才以最终文件名出现；中途放弃时 abort() 删除临时文件。
+    """
+
+    def __init__(self, directory: str, buffer_size: int = WRITE_BUFFER_SIZE, hasher=None, expected_size: Optional[int] = None):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        # 可选的 hashlib 对象，与写入在同一个线程中更新，顺便得到内容摘要
+        self.hasher = hasher
+        # 已知的文件大小，用于预分配空间
+        self.expected_size = expected_size
+        self.size = 0
+        self.temp_path: Optional[str] = None
+        self.path: Optional[str] = None  # 最终路径，commit() 之后才有
+        self._buffer = bytearray()
+        self._fd: Optional[int] = None
+
+    async def open(self):
+        self._fd, self.temp_path = await run_io(create_temp_file, self.directory, self.expected_size)
+        return self
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= self.buffer_size:
+            await self._flush()
+
+    async def _flush(self):
+        if self._buffer:
+            data, self._buffer = self._buffer, bytearray()
+            await run_io(self._write_block, data)
+
+    def _write_block(self, data: bytearray):
+        if self.hasher is not None:
+            self.hasher.update(data)
+        write_all(self._fd, data)
+
+    async def commit(self, filename: str, fsync_policy: Optional[str] = None) -> str:
+        """写完剩余数据并以 filename（重名时加后缀）发布，返回最终路径"""
+        try:
+            await self._flush()
+            self.path = await finish_temp_file(
+                self._fd, self.temp_path, self.directory, filename, fsync_policy, self.size
+            )
+        finally:
+            self._close_fd()
+        return self.path
+
+    async def abort(self):
+        """放弃写入并删除临时文件"""
+        self._buffer = bytearray()
+        self._close_fd()
+        if self.temp_path is not None and self.path is None:
+            await asyncio.shield(run_io(discard_temp_file, self.temp_path))
+
+    def _close_fd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,60 @@
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，只能以单进程方式运行
+    fcntl = None
+
+
+def lock_path_for(path: str) -> str:
+    """path 对应的锁文件（同目录下的隐藏文件）"""
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.lock")
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """跨进程的排他锁，用于保护 path 的“读取-修改-写回”
+
+    锁加在单独的锁文件上而不是 path 本身：path 会被原子替换成新的 inode，锁不能跟着旧文件走。
+    同一进程内的线程仍由调用方自己的 threading.Lock 串行，这里只负责 worker 进程之间。
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(lock_path_for(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # 关闭文件描述符即释放锁
+        os.close(fd)
+
+
+def try_file_lock(path: str, shared: bool = False) -> Optional[int]:
+    """尝试在 path 的锁文件上加锁（不等待），成功时返回文件描述符，由调用方 os.close 释放；已被占用时返回 None
+
+    shared=True 为共享锁：多个持有者可以同时持有，但与排他锁互斥。
+    """
+    fd = os.open(lock_path_for(path), os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def try_lock_fd(fd: int) -> bool:
+    """尝试对已打开的文件加排他锁（不等待），文件关闭时自动释放"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
@@ -0,0 +1,291 @@
+import os
+import re
+import time
+import shutil
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# 时间类直方图的默认桶（秒）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# 文件大小直方图的桶（字节）：64KB ~ 4GB
+SIZE_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(9))
+
+# 单个文件上传速度的桶（字节/秒）：64KB/s ~ 1GB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 2 ** i for i in range(15))
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+class _Shards:
+    """每个线程一份数据，写入方只改自己线程的分片，不需要加锁
+
+    锁只在线程第一次写入、登记新分片时使用一次；抓取时合并所有分片。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[dict] = []
+
+    def get(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            shards = list(self._shards)
+        # dict() 复制在 GIL 下是原子的，不会读到写了一半的分片
+        return [dict(shard) for shard in shards]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """只增不减的计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards = _Shards()
+
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        shard = self._shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[Labels, float]:
+        merged: Dict[Labels, float] = {}
+        for shard in self._shards.all():
+            for labels, value in shard.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def render(self) -> Iterator[str]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """可增可减的当前值（各线程的增减量相加）"""
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, labels: Labels = ()):
+        self.inc(-amount, labels)
+
+    @contextmanager
+    def track(self, labels: Labels = ()):
+        """进入时加一、退出时减一"""
+        self.inc(1, labels)
+        try:
+            yield
+        finally:
+            self.dec(1, labels)
+
+
+class FunctionGauge:
+    """抓取时才计算的值（磁盘空间、线程池状态等）"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, function: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def render(self) -> Iterator[str]:
+        try:
+            value = self.function()
+        except OSError:
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram:
+    """固定分桶的直方图，每个标签组合在每个线程分片中保存 [各桶计数..., 总和]"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _Shards()
+
+    def observe(self, value: float, labels: Labels = ()):
+        shard = self._shards.get()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 2)
+            shard[labels] = counts
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self) -> Iterator[str]:
+        merged: Dict[Labels, list] = {}
+        for shard in self._shards.all():
+            for labels, counts in shard.items():
+                total = merged.setdefault(labels, [0] * len(counts))
+                for index, value in enumerate(list(counts)):
+                    total[index] += value
+        for labels, counts in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels + ("le",), labels + (_format_value(float(bound)),))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            label_text = _format_labels(self.labels, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(float(counts[-1]))}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class MetricsRegistry:
+    """所有指标的登记表，render() 生成 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def gauge_function(self, name: str, help: str, function: Callable[[], float]) -> FunctionGauge:
+        return self._add(FunctionGauge(name, help, function))
+
+    def histogram(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def route_template(scope) -> str:
+    """请求对应的路由模板，例如 /api/upload/{task_id}/files
+
+    把实际路径中的路径参数值换回参数名；未匹配任何路由的请求归为一组，避免任意路径产生无限多的标签。
+    """
+    if scope.get("route") is None:
+        return "unmatched"
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        value = str(value)
+        if value:
+            path = re.sub(r"(?<=/)" + re.escape(value) + r"(?=/|$)", lambda _: "{" + name + "}", path, count=1)
+    return path
+
+
+class MetricsMiddleware:
+    """记录每个请求的处理时间（纯 ASGI 中间件），按路由模板而不是实际路径分组"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_duration.observe(
+                time.perf_counter() - started, (scope["method"], route_template(scope), str(status["code"]))
+            )
+
+
+def _disk_usage(path: str):
+    return shutil.disk_usage(path if os.path.isdir(path) else ".")
+
+
+# 全局指标登记表和各项指标
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "fastup_http_request_duration_seconds", "HTTP 请求处理时间", ("method", "route", "status")
+)
+upload_bytes = registry.counter(
+    "fastup_upload_bytes_total", "接收并写入磁盘的上传文件字节数（rate() 即上传速度）"
+)
+upload_file_size = registry.histogram(
+    "fastup_upload_file_size_bytes", "上传完成的文件大小", buckets=SIZE_BUCKETS
+)
+upload_throughput = registry.histogram(
+    "fastup_upload_file_throughput_bytes_per_second", "单个文件从开始接收到写完的速度", buckets=THROUGHPUT_BUCKETS
+)
+instant_uploads = registry.counter(
+    "fastup_instant_upload_files_total", "按内容摘要秒传（未传输内容）的文件数"
+)
+uploads_in_progress = registry.gauge(
+    "fastup_uploads_in_progress", "正在接收数据的上传请求数"
+)
+upload_rejections = registry.counter(
+    "fastup_upload_rejections_total", "被拒绝的上传", ("reason",)
+)
+storage_duration = registry.histogram(
+    "fastup_storage_operation_duration_seconds", "TaskStorage 操作耗时", ("operation",)
+)
+registry.gauge_function(
+    "fastup_uploads_disk_free_bytes", "uploads/ 所在文件系统的可用空间", lambda: _disk_usage("uploads").free
+)
+registry.gauge_function(
+    "fastup_uploads_disk_total_bytes", "uploads/ 所在文件系统的总空间", lambda: _disk_usage("uploads").total
+)
+
+
+def record_upload(size: int, seconds: float):
+    """记录一个写完的上传文件"""
+    upload_file_size.observe(size)
+    if seconds > 0:
+        upload_throughput.observe(size / seconds)
+
+
+def reject_upload(reason: str):
+    """记录一次被拒绝的上传（reason: task_not_found / task_inactive / whitelist / quota / size / file_count / rate_limit / busy / queue_timeout / disk_space / length_required）"""
+    upload_rejections.inc(labels=(reason,))
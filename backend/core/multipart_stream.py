@@ -0,0 +1,108 @@
+from typing import AsyncIterator, List, Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# 普通表单字段的最大长度
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+class MultipartStreamError(ValueError):
+    """multipart 请求体格式错误"""
+
+
+def get_boundary(content_type: Optional[str]) -> bytes:
+    """从 Content-Type 中取出 multipart 边界"""
+    if not content_type:
+        raise MultipartStreamError("缺少 Content-Type")
+    media_type, params = parse_options_header(content_type)
+    if media_type != b"multipart/form-data" or b"boundary" not in params:
+        raise MultipartStreamError("请求必须是 multipart/form-data")
+    return params[b"boundary"]
+
+
+async def iter_multipart(content_type: Optional[str], stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple]:
+    """边接收边解析 multipart 请求体，按顺序产生事件，不把文件内容落到临时文件
+
+    事件：
+    - ("field", name, value)：普通表单字段
+    - ("file_start", name, filename)：文件部分开始
+    - ("file_data", data)：文件数据
+    - ("file_end",)：文件部分结束
+    """
+    boundary = get_boundary(content_type)
+    events: List[Tuple] = []
+    state = {
+        "header_field": b"",
+        "header_value": b"",
+        "disposition": b"",
+        "name": "",
+        "filename": None,
+        "data": bytearray(),
+    }
+
+    def on_part_begin():
+        state["disposition"] = b""
+        state["filename"] = None
+        state["data"] = bytearray()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        if state["header_field"].lower() == b"content-disposition":
+            state["disposition"] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["disposition"])
+        if b"name" not in options:
+            raise MultipartStreamError('Content-Disposition 缺少 "name"')
+        state["name"] = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options:
+            state["filename"] = options[b"filename"].decode("utf-8", "replace")
+            events.append(("file_start", state["name"], state["filename"]))
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if state["filename"] is not None:
+            events.append(("file_data", bytes(data[start:end])))
+        else:
+            if len(state["data"]) + end - start > MAX_FIELD_SIZE:
+                raise MultipartStreamError(f"表单字段 {state['name']} 过长")
+            state["data"] += data[start:end]
+
+    def on_part_end():
+        if state["filename"] is not None:
+            events.append(("file_end",))
+        else:
+            events.append(("field", state["name"], state["data"].decode("utf-8", "replace")))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    async for chunk in stream:
+        if not chunk:
+            continue
+        try:
+            parser.write(chunk)
+        except MultipartStreamError:
+            raise
+        except Exception as e:
+            raise MultipartStreamError(f"multipart 解析失败: {e}")
+        # 一个网络数据块可能包含多个事件，按顺序交给调用方处理
+        if events:
+            pending = events[:]
+            events.clear()
+            for event in pending:
+                yield event
+    parser.finalize()
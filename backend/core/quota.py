@@ -0,0 +1,97 @@
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from core.aio import run_io
+from core.storage import task_storage, TaskStorage
+
+# 预留的默认有效期（秒）：进程崩溃时未释放的预留会自动过期
+RESERVATION_TTL = 3600
+
+
+class QuotaExceeded(Exception):
+    """预留会超过每人上传次数限制"""
+
+    def __init__(self, used: int, limit: int):
+        super().__init__(f"quota exceeded: {used}/{limit}")
+        self.used = used
+        self.limit = limit
+
+
+class Reservation:
+    """一次预留；limit 为空表示不限次数，此时不占用账本"""
+
+    def __init__(self, ledger: "QuotaLedger", reservation_id: Optional[str], used: int):
+        self.ledger = ledger
+        self.id = reservation_id
+        # 预留前已使用的次数
+        self.used = used
+
+    async def release(self):
+        """释放未使用的部分（已经写入文件清单的文件不受影响）"""
+        if self.id is not None:
+            reservation_id, self.id = self.id, None
+            await run_io(self.ledger.storage.release_quota, reservation_id)
+
+
+class QuotaLedger:
+    """每个 (任务, 上传者) 的上传次数账本：预留 → 提交（写入文件清单）→ 释放
+
+    预留保存在 SQLite 中，检查和预留在同一个 BEGIN IMMEDIATE 事务里完成，多个 worker 进程之间也是原子的；
+    进程内同一个键的请求先经过 asyncio 锁排队，不会同时占用线程池去争数据库写锁。
+    文件写入清单时（record_file 传入预留 ID）在同一事务里消耗一个预留名额，所以不会重复计数。
+    """
+
+    def __init__(self, storage: TaskStorage = task_storage, ttl: float = RESERVATION_TTL):
+        self.storage = storage
+        self.ttl = ttl
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _lock(self, task_id: str, uploader: str) -> asyncio.Lock:
+        key = (task_id, uploader)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def usage(self, task_id: str, uploader: str) -> int:
+        """已上传的文件数加上尚未用完的预留"""
+        return self.storage.get_quota_usage(task_id, uploader)
+
+    async def reserve(
+        self,
+        task_id: str,
+        uploader: str,
+        count: int,
+        limit: Optional[int],
+        ttl: Optional[float] = None,
+        reservation_id: Optional[str] = None,
+    ) -> Reservation:
+        """预留 count 个上传名额，超过限制时抛出 QuotaExceeded"""
+        if not limit or limit <= 0:
+            return Reservation(self, None, 0)
+        async with self._lock(task_id, uploader):
+            reservation_id, used = await run_io(
+                self.storage.reserve_quota, task_id, uploader, count, limit,
+                ttl if ttl is not None else self.ttl, reservation_id
+            )
+        if reservation_id is None:
+            raise QuotaExceeded(used, limit)
+        return Reservation(self, reservation_id, used)
+
+    @asynccontextmanager
+    async def reservation(
+        self, task_id: str, uploader: str, count: int, limit: Optional[int]
+    ) -> AsyncIterator[Reservation]:
+        """在请求处理期间持有预留，结束时释放未用完的名额"""
+        reservation = await self.reserve(task_id, uploader, count, limit)
+        try:
+            yield reservation
+        finally:
+            await reservation.release()
+
+
+# 全局上传次数账本实例
+quota_ledger = QuotaLedger()
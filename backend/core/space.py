@@ -0,0 +1,109 @@
+import os
+import uuid
+import asyncio
+from typing import Optional
+
+from core.aio import run_io
+from core.config import config_service
+from core.metrics import registry
+from core.storage import task_storage, TaskStorage
+
+# 上传文件所在的目录，检查它所在文件系统的可用空间
+UPLOADS_ROOT = "uploads"
+
+# 默认的低水位（MB）：可用空间扣除所有预留后必须保留的空间，可通过 disk_low_water_mark 设置，0 表示不保留
+DEFAULT_LOW_WATER_MARK = 512
+
+# 预留的有效期（秒）：进程崩溃时未释放的预留会自动过期
+SPACE_RESERVATION_TTL = 3600
+
+# 空间不足的请求等待其他上传结束时，重新检查的间隔（秒）
+SPACE_POLL_INTERVAL = 1.0
+
+
+class InsufficientSpace(Exception):
+    """预留会使可用空间低于低水位"""
+
+    def __init__(self, requested: int, headroom: int):
+        super().__init__(f"insufficient disk space: requested {requested}, headroom {headroom}")
+        self.requested = requested
+        self.headroom = headroom
+
+
+def free_bytes(path: str = UPLOADS_ROOT) -> int:
+    """path 所在文件系统中普通用户可用的字节数"""
+    stat = os.statvfs(path if os.path.isdir(path) else ".")
+    return stat.f_bavail * stat.f_frsize
+
+
+def low_water_bytes() -> int:
+    value = config_service.get().settings.disk_low_water_mark
+    return (DEFAULT_LOW_WATER_MARK if value is None else value) * 1024 * 1024
+
+
+class SpaceReservation:
+    """一次空间预留；size 为 0 时不占用账本"""
+
+    def __init__(self, ledger: "SpaceLedger", reservation_id: Optional[str], size: int):
+        self.ledger = ledger
+        self.id = reservation_id
+        self.size = size
+
+    async def release(self):
+        """上传结束（完成或中止）时释放，写入的文件此后直接体现在可用空间中"""
+        if self.id is not None:
+            reservation_id, self.id = self.id, None
+            self.ledger.reserved -= self.size
+            await run_io(self.ledger.storage.release_space, reservation_id)
+
+
+class SpaceLedger:
+    """uploads/ 所在文件系统的空间预留
+
+    可用空间（statvfs）减去低水位，再减去所有进程正在进行的上传预留的字节数，就是还能接收的空间（headroom）。
+    预留保存在 SQLite 中，检查和预留在同一个事务里完成，多个 worker 进程之间也是原子的；
+    reserved 是本进程持有的预留，用于指标。已经写入磁盘的部分同时体现在可用空间和预留中，估计偏保守。
+    """
+
+    def __init__(self, storage: TaskStorage = task_storage, root: str = UPLOADS_ROOT, ttl: float = SPACE_RESERVATION_TTL):
+        self.storage = storage
+        self.root = root
+        self.ttl = ttl
+        self.reserved = 0
+
+    def available(self) -> int:
+        """扣除低水位后的可用空间（未扣除预留）"""
+        return free_bytes(self.root) - low_water_bytes()
+
+    def headroom(self) -> int:
+        """还能为新的上传预留的字节数"""
+        return self.available() - self.storage.get_reserved_space()
+
+    def _try_reserve(self, size: int):
+        available = self.available()
+        reservation_id, reserved = self.storage.reserve_space(size, available, self.ttl, uuid.uuid4().hex)
+        return reservation_id, available, available - reserved
+
+    async def reserve(self, size: int, wait: float = 0) -> SpaceReservation:
+        """预留 size 字节；空间不足时最多等待 wait 秒（等其他上传结束或空间被释放），仍然不足时抛出 InsufficientSpace"""
+        if size <= 0:
+            return SpaceReservation(self, None, 0)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            reservation_id, available, headroom = await run_io(self._try_reserve, size)
+            if reservation_id is not None:
+                self.reserved += size
+                return SpaceReservation(self, reservation_id, size)
+            # 即使其他上传都结束也放不下时不必等待
+            if size > available or loop.time() >= deadline:
+                raise InsufficientSpace(size, max(headroom, 0))
+            await asyncio.sleep(min(SPACE_POLL_INTERVAL, max(deadline - loop.time(), 0)))
+
+
+# 全局空间账本实例
+space_ledger = SpaceLedger()
+
+registry.gauge_function(
+    "fastup_upload_space_reserved_bytes", "当前进程中正在进行的上传预留的磁盘空间", lambda: space_ledger.reserved
+)
@@ -1,128 +1,895 @@
 import os
 import json
+import time
 import uuid
+import sqlite3
+import functools
+import threading
+from contextlib import contextmanager
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from models.schemas import TaskResponse, TaskStatus, FileUploadResponse
+from core.metrics import storage_duration
 
+# Journal mode of tasks.db. WAL needs shared memory between the processes using the database,
+# which network filesystems do not provide; set FASTUP_SQLITE_JOURNAL=DELETE when tasks.db
+# lives on storage shared by several nodes.
+SQLITE_JOURNAL_MODE = os.environ.get("FASTUP_SQLITE_JOURNAL", "WAL").upper()
+if SQLITE_JOURNAL_MODE not in ("WAL", "DELETE", "TRUNCATE", "PERSIST"):
+    raise ValueError(f"unsupported FASTUP_SQLITE_JOURNAL: {SQLITE_JOURNAL_MODE}")
+
+# Schema migrations, applied in order according to PRAGMA user_version
+_MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        status TEXT NOT NULL,
+        folder_path TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        uploaded_files_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        task_id TEXT NOT NULL,
+        uploader TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        PRIMARY KEY (task_id, uploader, filename)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        task_id TEXT NOT NULL,
+        uploader TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        offset INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_upload_sessions_uploader ON upload_sessions (task_id, uploader);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_files_name ON files (task_id, filename, uploader);
+    CREATE INDEX IF NOT EXISTS idx_files_size ON files (task_id, size, uploader, filename);
+    CREATE INDEX IF NOT EXISTS idx_files_mtime ON files (task_id, mtime, uploader, filename);
+    """,
+    """
+    ALTER TABLE files ADD COLUMN sha256 TEXT;
+    CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quota_reservations (
+        id TEXT PRIMARY KEY,
+        task_id TEXT NOT NULL,
+        uploader TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_quota_reservations_uploader ON quota_reservations (task_id, uploader);
+    CREATE INDEX IF NOT EXISTS idx_quota_reservations_expires ON quota_reservations (expires_at);
+    """,
+    """
+    ALTER TABLE tasks ADD COLUMN archived_at TEXT;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS task_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_task_events_created ON task_events (created_at);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS folder_deletions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id TEXT NOT NULL,
+        folder_path TEXT NOT NULL,
+        total_files INTEGER NOT NULL DEFAULT 0,
+        total_bytes INTEGER NOT NULL DEFAULT 0,
+        removed_files INTEGER NOT NULL DEFAULT 0,
+        removed_bytes INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        claimed_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_folder_deletions_finished ON folder_deletions (finished_at);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS space_reservations (
+        id TEXT PRIMARY KEY,
+        bytes INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_space_reservations_expires ON space_reservations (expires_at);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS folder_deletion_digests (
+        deletion_id INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        PRIMARY KEY (deletion_id, sha256)
+    ) WITHOUT ROWID;
+    """,
+]
+
+# Sort keys for file listings; every key ends with columns that make it unique within a task,
+# so the last row of a page can be used as a keyset cursor
+FILE_SORT_KEYS = {
+    "name": ("filename", "uploader"),
+    "size": ("size", "uploader", "filename"),
+    "time": ("mtime", "uploader", "filename"),
+    "uploader": ("uploader", "filename"),
+}
+
+_TASK_COLUMNS = "id, name, description, status, folder_path, created_at, uploaded_files_count"
+
+# Task columns with the file count taken from the manifest instead of the stored counter
+_TASK_SELECT = (
+    "SELECT id, name, description, status, folder_path, created_at, archived_at, "
+    "(SELECT COUNT(*) FROM files WHERE files.task_id = tasks.id) AS uploaded_files_count "
+    "FROM tasks"
+)
+
+
+# Content store of core.dedup: one hard-linked object per distinct sha256
+CONTENT_STORE_ROOT = "store"
+
+
+def content_object_path(digest: str, root: str = CONTENT_STORE_ROOT) -> str:
+    """Path of the content store object for a sha256 digest"""
+    return os.path.join(root, digest[:2], digest[2:4], digest)
+
+
+def _same_file(path: str, size: int, mtime: float, known: Tuple[int, float, Optional[str]]) -> bool:
+    """Whether a file on disk is still the one recorded in the manifest
+
+    Deduplicated files are hard links that carry the mtime of the store object rather than
+    the recorded upload time, so a file that is the store object of its recorded hash counts as unchanged too.
+    """
+    known_size, known_mtime, sha256 = known
+    if known_size != size:
+        return False
+    if abs(known_mtime - mtime) < 1e-6:
+        return True
+    if not sha256:
+        return False
+    try:
+        return os.path.samestat(os.stat(path), os.stat(content_object_path(sha256)))
+    except OSError:
+        return False
+
+
+def _is_manifest_name(name: str) -> bool:
+    """Hidden/temporary entries are never part of the manifest"""
+    return not name.startswith('.')
+
+
+def _timed(name: str, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            storage_duration.observe(time.perf_counter() - started, (name,))
+    return wrapper
+
+
+def _timed_operations(cls):
+    """Record the duration of every public storage operation (see core.metrics)"""
+    for name, value in list(vars(cls).items()):
+        if callable(value) and not name.startswith("_") and name != "transaction":
+            setattr(cls, name, _timed(name, value))
+    return cls
+
+
+@_timed_operations
 class TaskStorage:
-    """Simple file-based storage for tasks"""
-    
-    def __init__(self, data_file: str = "tasks_data.json"):
-        self.data_file = data_file
-        self.ensure_data_file()
-    
-    def ensure_data_file(self):
-        """Ensure the data file exists"""
-        if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False, indent=2)
-    
-    def load_tasks(self) -> Dict:
-        """Load tasks from file"""
+    """SQLite-backed storage for tasks (WAL mode by default, one row per task)
+
+    Every worker process opens the same database file; all read-modify-write
+    sequences run inside BEGIN IMMEDIATE transactions, so tasks, the file
+    manifest, quota reservations and upload sessions stay consistent across
+    processes without any extra coordination.
+    """
+
+    def __init__(self, db_file: str = "tasks.db", legacy_data_file: str = "tasks_data.json"):
+        self.db_file = db_file
+        self.legacy_data_file = legacy_data_file
+        self._local = threading.local()
+        self.ensure_schema()
+        self.migrate_from_json()
+        self.build_manifest()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get the connection of the current thread (sqlite3 connections are not shared between threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in a write transaction; the write lock is taken up front to avoid lost updates"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-    
-    def save_tasks(self, tasks: Dict):
-        """Save tasks to file"""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(tasks, f, ensure_ascii=False, indent=2, default=str)
-    
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def ensure_schema(self):
+        """Create or upgrade the database schema"""
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for index, script in enumerate(_MIGRATIONS[version:], start=version):
+                for statement in script.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {index + 1}")
+
+    def migrate_from_json(self):
+        """One-time import of the legacy tasks_data.json file"""
+        if not os.path.exists(self.legacy_data_file):
+            return
+
+        with self.transaction() as conn:
+            done = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if done:
+                return
+
+            try:
+                with open(self.legacy_data_file, 'r', encoding='utf-8') as f:
+                    tasks: Dict = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                tasks = {}
+
+            for task_data in tasks.values():
+                conn.execute(
+                    f"INSERT OR IGNORE INTO tasks ({_TASK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        task_data["id"],
+                        task_data["name"],
+                        task_data.get("description"),
+                        task_data.get("status", TaskStatus.ACTIVE.value),
+                        task_data.get("folder_path", f"uploads/{task_data['id']}"),
+                        str(task_data.get("created_at") or datetime.now().isoformat()),
+                        task_data.get("uploaded_files_count", 0),
+                    ),
+                )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now().isoformat(),),
+            )
+
+        # Keep the old file around as a backup, but out of the way
+        os.replace(self.legacy_data_file, self.legacy_data_file + ".migrated")
+
     def create_task(self, name: str, description: Optional[str] = None) -> TaskResponse:
         """Create a new upload task"""
-        task_id = str(uuid.uuid4())
-        folder_path = f"uploads/{task_id}"
-        os.makedirs(folder_path, exist_ok=True)
-        
-        task_data = {
-            "id": task_id,
-            "name": name,
-            "description": description,
-            "status": TaskStatus.ACTIVE.value,
-            "folder_path": folder_path,
-            "created_at": datetime.now().isoformat(),
-            "uploaded_files_count": 0
+        return self.create_tasks([(name, description)])[0]
+
+    def create_tasks(self, items: List[Tuple[str, Optional[str]]]) -> List[TaskResponse]:
+        """Create several upload tasks from (name, description) pairs in a single commit"""
+        created_at = datetime.now().isoformat()
+        tasks = []
+        for name, description in items:
+            task_id = str(uuid.uuid4())
+            folder_path = f"uploads/{task_id}"
+            os.makedirs(folder_path, exist_ok=True)
+            tasks.append({
+                "id": task_id,
+                "name": name,
+                "description": description,
+                "status": TaskStatus.ACTIVE.value,
+                "folder_path": folder_path,
+                "created_at": created_at,
+                "uploaded_files_count": 0
+            })
+
+        with self.transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO tasks ({_TASK_COLUMNS}) VALUES "
+                "(:id, :name, :description, :status, :folder_path, :created_at, :uploaded_files_count)",
+                tasks,
+            )
+
+        return [TaskResponse(**task_data) for task_data in tasks]
+
+    def build_manifest(self):
+        """Build the file manifest from disk once, for tasks created before it existed"""
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'manifest_built'").fetchone()
+        if row:
+            return
+        self.reconcile_all()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('manifest_built', ?)",
+                (datetime.now().isoformat(),),
+            )
+
+    def scan_task_folder(self, folder_path: str) -> List[Tuple[str, str, int, float]]:
+        """Scan a task folder on disk, returning (uploader, filename, size, mtime) for every file"""
+        entries = []
+        if not os.path.isdir(folder_path):
+            return entries
+        with os.scandir(folder_path) as uploaders:
+            for uploader in uploaders:
+                if not uploader.is_dir(follow_symlinks=False) or not _is_manifest_name(uploader.name):
+                    continue
+                with os.scandir(uploader.path) as files:
+                    for entry in files:
+                        if not entry.is_file(follow_symlinks=False) or not _is_manifest_name(entry.name):
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                        entries.append((uploader.name, entry.name, stat.st_size, stat.st_mtime))
+        return entries
+
+    def reconcile_task(self, task_id: str) -> Optional[int]:
+        """Rebuild the manifest of a task from disk; returns the number of files found
+
+        Archived tasks have no loose files on disk; their manifest was checked against
+        the folder right before archiving and is left as it is.
+        """
+        row = self._connect().execute(
+            "SELECT folder_path, archived_at FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        if not row:
+            return None
+        if row["archived_at"]:
+            return self.get_actual_counts(task_id)[0]
+
+        entries = self.scan_task_folder(row["folder_path"])
+        with self.transaction() as conn:
+            # Keep the known content hash and recorded upload time of files that have not changed on disk
+            known = {
+                (r["uploader"], r["filename"]): (r["size"], r["mtime"], r["sha256"])
+                for r in conn.execute(
+                    "SELECT uploader, filename, size, mtime, sha256 FROM files WHERE task_id = ?", (task_id,)
+                )
+            }
+            rows = []
+            for uploader, filename, size, mtime in entries:
+                old = known.get((uploader, filename))
+                path = os.path.join(row["folder_path"], uploader, filename)
+                if old and _same_file(path, size, mtime, old):
+                    rows.append((task_id, uploader, filename, size, old[1], old[2]))
+                else:
+                    rows.append((task_id, uploader, filename, size, mtime, None))
+            conn.execute("DELETE FROM files WHERE task_id = ?", (task_id,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO files (task_id, uploader, filename, size, mtime, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "UPDATE tasks SET uploaded_files_count = ? WHERE id = ?", (len(entries), task_id)
+            )
+        return len(entries)
+
+    def reconcile_all(self) -> Dict[str, int]:
+        """Rebuild the manifest of every task from disk"""
+        task_ids = [row["id"] for row in self._connect().execute("SELECT id FROM tasks").fetchall()]
+        result = {}
+        for task_id in task_ids:
+            count = self.reconcile_task(task_id)
+            if count is not None:
+                result[task_id] = count
+        return result
+
+    def record_file(
+        self,
+        task_id: str,
+        uploader: str,
+        filename: str,
+        size: int,
+        mtime: float,
+        sha256: Optional[str] = None,
+        reservation_id: Optional[str] = None,
+    ):
+        """Add a saved file to the manifest, consuming one slot of a quota reservation if given"""
+        with self.transaction() as conn:
+            if reservation_id is not None:
+                conn.execute(
+                    "UPDATE quota_reservations SET count = count - 1 WHERE id = ? AND count > 0", (reservation_id,)
+                )
+            exists = conn.execute(
+                "SELECT 1 FROM files WHERE task_id = ? AND uploader = ? AND filename = ?",
+                (task_id, uploader, filename),
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO files (task_id, uploader, filename, size, mtime, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                (task_id, uploader, filename, size, mtime, sha256),
+            )
+            if not exists:
+                conn.execute(
+                    "UPDATE tasks SET uploaded_files_count = uploaded_files_count + 1 WHERE id = ?",
+                    (task_id,),
+                )
+
+    def get_actual_counts(self, task_id: str) -> Tuple[int, int]:
+        """Get file count and user count for a task from the manifest"""
+        row = self._connect().execute(
+            "SELECT COUNT(*), COUNT(DISTINCT uploader) FROM files WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return row[0], row[1]
+
+    def count_users_by_task(self) -> Dict[str, int]:
+        """Number of distinct uploaders of every task that has files"""
+        rows = self._connect().execute(
+            "SELECT task_id, COUNT(DISTINCT uploader) FROM files GROUP BY task_id"
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def count_uploader_files(self, task_id: str, uploader: str) -> int:
+        """Get the number of files an uploader has in a task"""
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM files WHERE task_id = ? AND uploader = ?", (task_id, uploader)
+        ).fetchone()
+        return row[0]
+
+    @staticmethod
+    def _quota_usage(conn: sqlite3.Connection, task_id: str, uploader: str, now: float) -> int:
+        row = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM files WHERE task_id = :task_id AND uploader = :uploader) + "
+            "(SELECT COALESCE(SUM(count), 0) FROM quota_reservations "
+            " WHERE task_id = :task_id AND uploader = :uploader AND expires_at >= :now)",
+            {"task_id": task_id, "uploader": uploader, "now": now},
+        ).fetchone()
+        return row[0]
+
+    def get_quota_usage(self, task_id: str, uploader: str) -> int:
+        """Files already recorded for an uploader plus slots held by unexpired reservations"""
+        return self._quota_usage(self._connect(), task_id, uploader, time.time())
+
+    def reserve_quota(
+        self,
+        task_id: str,
+        uploader: str,
+        count: int,
+        limit: int,
+        ttl: float,
+        reservation_id: Optional[str] = None,
+    ) -> Tuple[Optional[str], int]:
+        """Atomically reserve `count` upload slots against `limit`
+
+        Returns (reservation id, usage before the reservation); the id is None when the
+        reservation would exceed the limit. BEGIN IMMEDIATE serializes this across processes.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM quota_reservations WHERE expires_at < ?", (now,))
+            used = self._quota_usage(conn, task_id, uploader, now)
+            if used + count > limit:
+                return None, used
+            reservation_id = reservation_id or uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO quota_reservations (id, task_id, uploader, count, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (reservation_id, task_id, uploader, count, now + ttl),
+            )
+        return reservation_id, used
+
+    def release_quota(self, reservation_id: str):
+        """Drop a reservation, returning its unused slots"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM quota_reservations WHERE id = ?", (reservation_id,))
+
+    @staticmethod
+    def _reserved_space(conn: sqlite3.Connection, now: float) -> int:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM space_reservations WHERE expires_at >= ?", (now,)
+        ).fetchone()
+        return row[0]
+
+    def get_reserved_space(self) -> int:
+        """Bytes held by unexpired disk space reservations of all processes"""
+        return self._reserved_space(self._connect(), time.time())
+
+    def reserve_space(
+        self, size: int, available: int, ttl: float, reservation_id: Optional[str] = None
+    ) -> Tuple[Optional[str], int]:
+        """Atomically reserve `size` bytes of disk space out of `available`
+
+        Returns (reservation id, bytes reserved before this call); the id is None when all
+        reservations together would exceed `available`.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM space_reservations WHERE expires_at < ?", (now,))
+            reserved = self._reserved_space(conn, now)
+            if reserved + size > available:
+                return None, reserved
+            reservation_id = reservation_id or uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO space_reservations (id, bytes, expires_at) VALUES (?, ?, ?)",
+                (reservation_id, size, now + ttl),
+            )
+        return reservation_id, reserved
+
+    def release_space(self, reservation_id: str):
+        """Drop a disk space reservation"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM space_reservations WHERE id = ?", (reservation_id,))
+
+    def get_uploader_stats(self, task_id: str) -> List[Dict]:
+        """Get per-uploader file counts and total sizes for a task"""
+        rows = self._connect().execute(
+            "SELECT uploader, COUNT(*) AS file_count, SUM(size) AS total_size, MAX(mtime) AS last_upload "
+            "FROM files WHERE task_id = ? GROUP BY uploader ORDER BY uploader",
+            (task_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_files(self, task_id: str) -> List[Dict]:
+        """List the files of a task from the manifest"""
+        rows = self._connect().execute(
+            "SELECT uploader, filename, size, mtime, sha256 FROM files WHERE task_id = ? ORDER BY uploader, filename",
+            (task_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_file(self, task_id: str, uploader: str, filename: str) -> Optional[Dict]:
+        """Get a single file of a task from the manifest"""
+        row = self._connect().execute(
+            "SELECT uploader, filename, size, mtime, sha256 FROM files WHERE task_id = ? AND uploader = ? AND filename = ?",
+            (task_id, uploader, filename),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def set_file_hash(self, task_id: str, uploader: str, filename: str, sha256: str):
+        """Store the content hash of a file already in the manifest"""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE files SET sha256 = ? WHERE task_id = ? AND uploader = ? AND filename = ?",
+                (sha256, task_id, uploader, filename),
+            )
+
+    def get_dedup_stats(self, task_id: str) -> Dict:
+        """Logical vs. unique byte counts of a task, based on the content hashes in the manifest"""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT COUNT(*) AS file_count, COALESCE(SUM(size), 0) AS logical_size, "
+            "COUNT(sha256) AS hashed_count, COUNT(DISTINCT sha256) AS unique_count, "
+            "COALESCE(SUM(CASE WHEN sha256 IS NULL THEN size END), 0) AS unhashed_size "
+            "FROM files WHERE task_id = ?",
+            (task_id,),
+        ).fetchone()
+        unique_hashed_size = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM "
+            "(SELECT MAX(size) AS size FROM files WHERE task_id = ? AND sha256 IS NOT NULL GROUP BY sha256)",
+            (task_id,),
+        ).fetchone()[0]
+        stats = dict(row)
+        stats["unique_size"] = unique_hashed_size + stats.pop("unhashed_size")
+        stats["duplicate_count"] = stats["hashed_count"] - stats["unique_count"]
+        stats["saved_size"] = stats["logical_size"] - stats["unique_size"]
+        return stats
+
+    @staticmethod
+    def _file_filters(task_id: str, uploader: Optional[str], prefix: Optional[str]) -> Tuple[str, list]:
+        clauses = ["task_id = ?"]
+        params: list = [task_id]
+        if uploader is not None:
+            clauses.append("uploader = ?")
+            params.append(uploader)
+        if prefix:
+            clauses.append("substr(filename, 1, ?) = ?")
+            params.extend([len(prefix), prefix])
+        return " AND ".join(clauses), params
+
+    def query_files(
+        self,
+        task_id: str,
+        sort: str = "name",
+        descending: bool = False,
+        uploader: Optional[str] = None,
+        prefix: Optional[str] = None,
+        after: Optional[list] = None,
+        limit: int = 100,
+    ) -> List[Dict]:
+        """List one page of a task's files from the manifest
+
+        `after` holds the sort key values of the last row of the previous page (keyset pagination),
+        so every page costs the same regardless of how deep into the listing it is.
+        """
+        columns = FILE_SORT_KEYS[sort]
+        where, params = self._file_filters(task_id, uploader, prefix)
+        if after is not None:
+            if len(after) != len(columns):
+                raise ValueError("cursor does not match sort key")
+            op = "<" if descending else ">"
+            where += f" AND ({', '.join(columns)}) {op} ({', '.join('?' * len(columns))})"
+            params.extend(after)
+        direction = "DESC" if descending else "ASC"
+        order_by = ", ".join(f"{column} {direction}" for column in columns)
+        rows = self._connect().execute(
+            f"SELECT uploader, filename, size, mtime FROM files WHERE {where} ORDER BY {order_by} LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summarize_files(self, task_id: str, uploader: Optional[str] = None, prefix: Optional[str] = None) -> Dict:
+        """Count, total size and uploader count of the files matching a filter"""
+        where, params = self._file_filters(task_id, uploader, prefix)
+        row = self._connect().execute(
+            f"SELECT COUNT(*) AS file_count, COALESCE(SUM(size), 0) AS total_size, "
+            f"COUNT(DISTINCT uploader) AS users_count FROM files WHERE {where}",
+            params,
+        ).fetchone()
+        return dict(row)
+
+    def create_upload_session(
+        self, task_id: str, uploader: str, filename: str, file_path: str, size: int, session_id: Optional[str] = None
+    ) -> Dict:
+        """Create a resumable upload session"""
+        now = datetime.now().timestamp()
+        session = {
+            "id": session_id or uuid.uuid4().hex,
+            "task_id": task_id,
+            "uploader": uploader,
+            "filename": filename,
+            "file_path": file_path,
+            "size": size,
+            "offset": 0,
+            "created_at": now,
+            "updated_at": now,
         }
-        
-        tasks = self.load_tasks()
-        tasks[task_id] = task_data
-        self.save_tasks(tasks)
-        
-        return TaskResponse(**task_data)
-    
-    def get_actual_counts(self, folder_path: str) -> Tuple[int, int]:
-        """Calculate actual file count and user count for a task folder"""
-        actual_file_count = 0
-        actual_users_count = 0
-        
-        if os.path.exists(folder_path):
-            try:
-                # Calculate number of users (subdirectories)
-                actual_users_count = len(next(os.walk(folder_path))[1])
-                
-                # Calculate total number of files
-                for root, dirs, files in os.walk(folder_path):
-                    actual_file_count += len(files)
-            except Exception:
-                # If any error occurs during calculation, return zeros
-                pass
-                
-        return actual_file_count, actual_users_count
-    
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO upload_sessions (id, task_id, uploader, filename, file_path, size, offset, created_at, updated_at) "
+                "VALUES (:id, :task_id, :uploader, :filename, :file_path, :size, :offset, :created_at, :updated_at)",
+                session,
+            )
+        return session
+
+    def get_upload_session(self, session_id: str) -> Optional[Dict]:
+        """Get a resumable upload session by ID"""
+        row = self._connect().execute(
+            "SELECT * FROM upload_sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def update_upload_offset(
+        self, session_id: str, expected_offset: int, new_offset: int, reservation_ttl: Optional[float] = None
+    ) -> bool:
+        """Move the offset of a session forward, only if nobody else moved it in the meantime
+
+        With reservation_ttl, the session's quota reservation (same id) is kept alive for that long
+        from now, in the same transaction, so it expires together with the session.
+        """
+        now = datetime.now().timestamp()
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE upload_sessions SET offset = ?, updated_at = ? WHERE id = ? AND offset = ?",
+                (new_offset, now, session_id, expected_offset),
+            )
+            if cursor.rowcount > 0 and reservation_ttl is not None:
+                conn.execute(
+                    "UPDATE quota_reservations SET expires_at = ? WHERE id = ?", (now + reservation_ttl, session_id)
+                )
+        return cursor.rowcount > 0
+
+    def delete_upload_session(self, session_id: str) -> bool:
+        """Delete a resumable upload session"""
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def purge_upload_sessions(self, idle_before: float) -> List[Dict]:
+        """Remove sessions not touched since the given timestamp and return them"""
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM upload_sessions WHERE updated_at < ?", (idle_before,)
+            ).fetchall()
+            conn.execute("DELETE FROM upload_sessions WHERE updated_at < ?", (idle_before,))
+        return [dict(row) for row in rows]
+
     def get_all_tasks(self) -> List[TaskResponse]:
-        """Get all tasks with updated counts"""
-        tasks = self.load_tasks()
-        result = []
-        for task_data in tasks.values():
-            task = TaskResponse(**task_data)
-            # Update task with actual file count
-            actual_file_count, _ = self.get_actual_counts(task.folder_path)
-            task.uploaded_files_count = actual_file_count
-            result.append(task)
-        return result
-    
+        """Get all tasks with manifest counts"""
+        rows = self._connect().execute(f"{_TASK_SELECT} ORDER BY rowid").fetchall()
+        return [TaskResponse(**dict(row)) for row in rows]
+
     def get_task(self, task_id: str) -> Optional[TaskResponse]:
-        """Get a task by ID with updated counts"""
-        tasks = self.load_tasks()
-        task_data = tasks.get(task_id)
-        if task_data:
-            task = TaskResponse(**task_data)
-            # Update task with actual file count
-            actual_file_count, _ = self.get_actual_counts(task.folder_path)
-            task.uploaded_files_count = actual_file_count
-            return task
+        """Get a task by ID with manifest counts"""
+        row = self._connect().execute(f"{_TASK_SELECT} WHERE id = ?", (task_id,)).fetchone()
+        if row:
+            return TaskResponse(**dict(row))
         return None
-    
+
     def update_task_status(self, task_id: str, status: TaskStatus) -> Optional[TaskResponse]:
         """Update task status"""
-        tasks = self.load_tasks()
-        if task_id in tasks:
-            tasks[task_id]["status"] = status.value
-            self.save_tasks(tasks)
-            return TaskResponse(**tasks[task_id])
-        return None
-    
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ? WHERE id = ?", (status.value, task_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = conn.execute(f"{_TASK_SELECT} WHERE id = ?", (task_id,)).fetchone()
+        return TaskResponse(**dict(row))
+
+    def update_tasks_status(self, task_ids: List[str], status: TaskStatus) -> List[TaskResponse]:
+        """Update the status of several tasks in a single commit; returns the tasks that exist"""
+        updated = []
+        with self.transaction() as conn:
+            for task_id in task_ids:
+                cursor = conn.execute("UPDATE tasks SET status = ? WHERE id = ?", (status.value, task_id))
+                if cursor.rowcount:
+                    row = conn.execute(f"{_TASK_SELECT} WHERE id = ?", (task_id,)).fetchone()
+                    updated.append(TaskResponse(**dict(row)))
+        return updated
+
+    def set_task_archived(self, task_id: str, archived_at: Optional[str]):
+        """Mark a task as archived (or no longer archived when archived_at is None)"""
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET archived_at = ? WHERE id = ?", (archived_at, task_id))
+
+    def get_tasks_to_archive(self) -> List[str]:
+        """IDs of completed tasks with files that are not archived yet and have no resumable upload in progress"""
+        rows = self._connect().execute(
+            "SELECT id FROM tasks WHERE status = ? AND archived_at IS NULL "
+            "AND EXISTS (SELECT 1 FROM files WHERE files.task_id = tasks.id) "
+            "AND NOT EXISTS (SELECT 1 FROM upload_sessions WHERE upload_sessions.task_id = tasks.id) "
+            "ORDER BY rowid",
+            (TaskStatus.COMPLETED.value,),
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    def append_task_events(self, task_ids: List[str]):
+        """Record that these tasks changed, for other worker processes to pick up"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO task_events (task_id, created_at) VALUES (?, ?)",
+                [(task_id, now) for task_id in task_ids],
+            )
+
+    def read_task_events(self, after_id: int) -> Tuple[List[str], int]:
+        """IDs of tasks changed after the given event, and the last event ID seen"""
+        rows = self._connect().execute(
+            "SELECT id, task_id FROM task_events WHERE id > ? ORDER BY id", (after_id,)
+        ).fetchall()
+        if not rows:
+            return [], after_id
+        return [row["task_id"] for row in rows], rows[-1]["id"]
+
+    def last_task_event_id(self) -> int:
+        row = self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM task_events").fetchone()
+        return row[0]
+
+    def purge_task_events(self, before: float) -> int:
+        """Remove change events older than the given timestamp"""
+        with self.transaction() as conn:
+            cursor = conn.execute("DELETE FROM task_events WHERE created_at < ?", (before,))
+        return cursor.rowcount
+
     def increment_file_count(self, task_id: str):
         """Increment uploaded files count for a task"""
-        tasks = self.load_tasks()
-        if task_id in tasks:
-            tasks[task_id]["uploaded_files_count"] = tasks[task_id].get("uploaded_files_count", 0) + 1
-            self.save_tasks(tasks)
-    
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET uploaded_files_count = uploaded_files_count + 1 WHERE id = ?",
+                (task_id,),
+            )
+
     def delete_task(self, task_id: str) -> bool:
-        """Delete a task"""
-        tasks = self.load_tasks()
-        if task_id in tasks:
-            del tasks[task_id]
-            self.save_tasks(tasks)
-            # Optionally remove the folder (be careful in production)
-            # import shutil
-            # shutil.rmtree(os.path.join("uploads", task_id), ignore_errors=True)
-            return True
-        return False
+        """Delete a task; its folder is queued for background deletion"""
+        return bool(self.delete_tasks([task_id]))
+
+    def delete_tasks(self, task_ids: List[str]) -> List[str]:
+        """Delete several tasks in a single commit and queue their folders for background deletion
+
+        The content hashes of the deleted files are kept with the folder deletion, so that only
+        their content store objects need to be checked once the folder is gone.
+        Returns the IDs of the tasks that existed.
+        """
+        deleted = []
+        now = time.time()
+        with self.transaction() as conn:
+            for task_id in task_ids:
+                row = conn.execute("SELECT folder_path FROM tasks WHERE id = ?", (task_id,)).fetchone()
+                if not row:
+                    continue
+                total_files, total_bytes = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE task_id = ?", (task_id,)
+                ).fetchone()
+                cursor = conn.execute(
+                    "INSERT INTO folder_deletions (task_id, folder_path, total_files, total_bytes, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (task_id, row["folder_path"], total_files, total_bytes, now),
+                )
+                conn.execute(
+                    "INSERT INTO folder_deletion_digests (deletion_id, sha256) "
+                    "SELECT DISTINCT ?, sha256 FROM files WHERE task_id = ? AND sha256 IS NOT NULL",
+                    (cursor.lastrowid, task_id),
+                )
+                conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+                conn.execute("DELETE FROM files WHERE task_id = ?", (task_id,))
+                conn.execute("DELETE FROM upload_sessions WHERE task_id = ?", (task_id,))
+                conn.execute("DELETE FROM quota_reservations WHERE task_id = ?", (task_id,))
+                deleted.append(task_id)
+        return deleted
+
+    def claim_folder_deletion(self, lease: float) -> Optional[Dict]:
+        """Take the oldest unfinished folder deletion that no live worker is working on"""
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM folder_deletions WHERE finished_at IS NULL "
+                "AND (claimed_at IS NULL OR claimed_at < ?) ORDER BY id LIMIT 1",
+                (now - lease,),
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute("UPDATE folder_deletions SET claimed_at = ? WHERE id = ?", (now, row["id"]))
+        return dict(row)
+
+    def update_folder_deletion(self, deletion_id: int, removed_files: int, removed_bytes: int, finished: bool = False):
+        """Add to the progress of a folder deletion and renew its claim"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE folder_deletions SET removed_files = removed_files + ?, removed_bytes = removed_bytes + ?, "
+                "claimed_at = ?, finished_at = ? WHERE id = ?",
+                (removed_files, removed_bytes, now, now if finished else None, deletion_id),
+            )
+            if finished:
+                conn.execute("DELETE FROM folder_deletion_digests WHERE deletion_id = ?", (deletion_id,))
+
+    def list_folder_deletion_digests(self, deletion_id: int, after: str = "", limit: int = 1000) -> List[str]:
+        """Content hashes of the files of a folder deletion, in pages ordered by hash"""
+        rows = self._connect().execute(
+            "SELECT sha256 FROM folder_deletion_digests WHERE deletion_id = ? AND sha256 > ? ORDER BY sha256 LIMIT ?",
+            (deletion_id, after, limit),
+        ).fetchall()
+        return [row["sha256"] for row in rows]
+
+    def list_folder_deletions(self, finished_after: float) -> List[Dict]:
+        """Unfinished folder deletions, and those finished after the given timestamp"""
+        rows = self._connect().execute(
+            "SELECT * FROM folder_deletions WHERE finished_at IS NULL OR finished_at > ? ORDER BY id",
+            (finished_after,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge_folder_deletions(self, finished_before: float) -> int:
+        """Forget folder deletions finished before the given timestamp"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM folder_deletions WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,)
+            )
+        return cursor.rowcount
 
 # Global storage instance
-task_storage = TaskStorage()
\ No newline at end of file
+task_storage = TaskStorage()
+
+if __name__ == "__main__":
+    # Usage: python -m core.storage reconcile [task_id ...]
+    import sys
+
+    args = sys.argv[1:]
+    if not args or args[0] != "reconcile":
+        print("usage: python -m core.storage reconcile [task_id ...]")
+        sys.exit(2)
+    if len(args) > 1:
+        for task_id in args[1:]:
+            print(f"{task_id}: {task_storage.reconcile_task(task_id)}")
+    else:
+        for task_id, count in task_storage.reconcile_all().items():
+            print(f"{task_id}: {count}")
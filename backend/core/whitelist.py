@@ -0,0 +1,228 @@
+import os
+import time
+import codecs
+import tempfile
+import threading
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from core.config import config_service, file_signature, write_file_atomic
+from core.locks import file_lock
+
+# 白名单文件路径（与 config.json 分开存放，每行一个名字；可用环境变量 FASTUP_WHITELIST 指定其他位置）
+whitelist_path = os.environ.get("FASTUP_WHITELIST") or os.path.join(os.path.dirname(__file__), '..', 'whitelist.txt')
+
+# 流式读取上传文件时的块大小
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def normalize_name(name: str) -> str:
+    """名单比较使用的规范化形式（去除首尾空白并忽略大小写）"""
+    return name.strip().casefold()
+
+
+async def iter_upload_lines(file) -> AsyncIterator[str]:
+    """逐行读取上传的文本文件，不把整个文件读入内存"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            lines = (pending + text).splitlines(keepends=True)
+            pending = ""
+            if lines and not lines[-1].endswith(("\n", "\r")):
+                pending = lines.pop()
+            for line in lines:
+                yield line
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+class WhitelistStore:
+    """上传者白名单：内存中保存规范化后的哈希表，成员判断为 O(1)
+
+    名单为空表示未启用白名单（允许所有人上传）。
+    """
+
+    def __init__(self, path: str = whitelist_path, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # 规范化名字 -> 原始名字
+        self._names: Optional[Dict[str, str]] = None
+        self._signature = None
+        self._checked_at = 0.0
+
+    def _read_file(self) -> Dict[str, str]:
+        names = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8-sig') as f:
+                for line in f:
+                    name = line.strip()
+                    if name:
+                        names.setdefault(normalize_name(name), name)
+        except FileNotFoundError:
+            pass
+        return names
+
+    def _migrate_from_config(self):
+        """旧版本把白名单保存在 config.json 中，首次加载时迁移出来"""
+        if os.path.exists(self.path):
+            return
+        with file_lock(self.path):
+            # 多个 worker 同时启动时只有一个进程执行迁移
+            if os.path.exists(self.path):
+                return
+            legacy = config_service.get_raw().get("settings", {}).get("upload_whitelist")
+            if legacy is None:
+                return
+            self._write_atomic(name.strip() for name in legacy if name.strip())
+        config_service.update(lambda config: config.get("settings", {}).pop("upload_whitelist", None))
+
+    def _refresh(self):
+        """文件签名变化（包括其他 worker 进程写入）时重新读取，调用方持有 self._lock"""
+        signature = file_signature(self.path)
+        if self._names is None or signature != self._signature:
+            self._names = self._read_file()
+            self._signature = signature
+        self._checked_at = time.monotonic()
+
+    def _load(self) -> Dict[str, str]:
+        now = time.monotonic()
+        names = self._names
+        if names is not None and now - self._checked_at < self.check_interval:
+            return names
+        with self._lock:
+            if self._names is None:
+                self._migrate_from_config()
+            self._refresh()
+            return self._names
+
+    def _write_atomic(self, names: Iterable[str]):
+        write_file_atomic(self.path, lambda f: f.writelines(name + "\n" for name in names))
+
+    @property
+    def enabled(self) -> bool:
+        return len(self._load()) > 0
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def contains(self, name: str) -> bool:
+        """检查名字是否在名单中；名单为空时允许所有人"""
+        names = self._load()
+        return not names or normalize_name(name) in names
+
+    def list_names(self, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """获取名单（原始写法），按写入顺序"""
+        names = list(self._load().values())
+        end = None if limit is None else offset + limit
+        return names[offset:end]
+
+    def replace(self, names: Iterable[str]) -> int:
+        """整体替换名单"""
+        new_names: Dict[str, str] = {}
+        for name in names:
+            name = name.strip()
+            if name:
+                new_names.setdefault(normalize_name(name), name)
+        with self._lock, file_lock(self.path):
+            self._write_atomic(new_names.values())
+            self._install(new_names)
+        return len(new_names)
+
+    def staging(self) -> "WhitelistStaging":
+        """逐批写入新名单，提交时整体替换（用于上传的名单文件）"""
+        return WhitelistStaging(self)
+
+    def _install(self, names: Dict[str, str]):
+        """名单文件已经写好，更新内存中的名单，调用方持有 self._lock 和文件锁"""
+        self._names = names
+        self._signature = file_signature(self.path)
+        self._checked_at = time.monotonic()
+
+    def apply_changes(self, add: Iterable[str] = (), remove: Iterable[str] = ()) -> Tuple[int, int]:
+        """增量添加/删除名字，返回 (新增数量, 删除数量)
+
+        只有新增时直接追加到文件末尾；有删除时才重写整个文件。
+        """
+        self._load()
+        with self._lock, file_lock(self.path):
+            # 在最新的文件内容上修改，不会覆盖其他 worker 进程刚写入的名字
+            self._refresh()
+            # 复制后再修改，读取方始终看到完整的一份名单
+            names = dict(self._names)
+            added = []
+            for name in add:
+                name = name.strip()
+                key = normalize_name(name)
+                if name and key not in names:
+                    names[key] = name
+                    added.append(name)
+            removed = 0
+            for name in remove:
+                if names.pop(normalize_name(name), None) is not None:
+                    removed += 1
+
+            if removed:
+                self._write_atomic(names.values())
+            elif added:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.writelines(name + "\n" for name in added)
+            self._install(names)
+        return len(added), removed
+
+    def clear(self):
+        """清空名单（即禁用白名单）"""
+        self.replace(())
+
+
+class WhitelistStaging:
+    """整体替换名单：名字逐批写入名单文件同目录下的临时文件，提交时原子地改名为名单文件
+
+    上传的文件不会整个读入内存，内存中只有去重后的名单（替换完成后本来就要保存）。
+    """
+
+    def __init__(self, store: WhitelistStore):
+        self.store = store
+        directory, name = os.path.split(os.path.abspath(store.path))
+        fd, self.tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+        self._names: Dict[str, str] = {}
+
+    def write(self, lines: Iterable[str]):
+        """写入一批名字（每项一行，去除首尾空白，忽略空行和重复的名字）"""
+        added = []
+        for name in lines:
+            name = name.strip()
+            key = normalize_name(name)
+            if name and key not in self._names:
+                self._names[key] = name
+                added.append(name + "\n")
+        self._file.writelines(added)
+
+    def commit(self) -> int:
+        """落盘并替换名单，返回名单中的名字数"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        with self.store._lock, file_lock(self.store.path):
+            if os.path.exists(self.store.path):
+                os.chmod(self.tmp_path, os.stat(self.store.path).st_mode & 0o777)
+            os.replace(self.tmp_path, self.store.path)
+            self.store._install(self._names)
+        return len(self._names)
+
+    def abort(self):
+        """放弃替换，删除临时文件"""
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+# 全局白名单实例
+whitelist_store = WhitelistStore()
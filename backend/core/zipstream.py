@@ -0,0 +1,255 @@
+import os
+import time
+import zlib
+import struct
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, List, Optional
+
+import aiofiles
+
+# 已经是压缩格式的文件，再用 DEFLATE 压缩只会浪费 CPU
+COMPRESSED_EXTENSIONS = {
+    ".zip", ".rar", ".7z", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".lz4",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".aac", ".ogg", ".flac", ".m4a",
+    ".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk",
+    ".pdf",
+}
+
+# 读取文件的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+# 压缩后的数据可能比原始数据略大，给 ZIP64 判断留出余量
+_DEFLATE_MARGIN = 0x10000
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+# bit 3: 使用数据描述符（CRC 和大小写在数据之后）；bit 11: 文件名为 UTF-8
+_FLAGS = 0x0808
+
+
+class ZipMember:
+    """待打包的单个文件"""
+
+    def __init__(self, arcname: str, path: str, size: int, mtime: float, compress: bool = False):
+        self.arcname = arcname
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.compress = compress
+        self.name_bytes = arcname.encode("utf-8")
+
+    @property
+    def method(self) -> int:
+        return METHOD_DEFLATED if self.compress else METHOD_STORED
+
+    @property
+    def zip64(self) -> bool:
+        """文件大小是否需要 ZIP64 字段"""
+        limit = _ZIP32_LIMIT - _DEFLATE_MARGIN if self.compress else _ZIP32_LIMIT
+        return self.size >= limit
+
+
+def should_compress(filename: str) -> bool:
+    """判断文件是否值得压缩（已压缩的格式使用 STORED）"""
+    return os.path.splitext(filename)[1].lower() not in COMPRESSED_EXTENSIONS
+
+
+def _dos_datetime(mtime: float):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _local_header(member: ZipMember) -> bytes:
+    dos_time, dos_date = _dos_datetime(member.mtime)
+    if member.zip64:
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+        version, sizes = 45, _ZIP32_LIMIT
+    else:
+        extra = b""
+        version, sizes = 20, 0
+    return struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034B50, version, _FLAGS, member.method, dos_time, dos_date,
+        0, sizes, sizes, len(member.name_bytes), len(extra),
+    ) + member.name_bytes + extra
+
+
+def _data_descriptor(member: ZipMember, crc: int, compressed_size: int) -> bytes:
+    if member.zip64:
+        return struct.pack("<IIQQ", 0x08074B50, crc, compressed_size, member.size)
+    return struct.pack("<IIII", 0x08074B50, crc, compressed_size, member.size)
+
+
+def _central_header(member: ZipMember, crc: int, compressed_size: int, offset: int) -> bytes:
+    dos_time, dos_date = _dos_datetime(member.mtime)
+    extra_fields = []
+    size_field = compressed_field = offset_field = None
+    if member.zip64:
+        extra_fields += [member.size, compressed_size]
+        size_field = compressed_field = _ZIP32_LIMIT
+    if offset >= _ZIP32_LIMIT:
+        extra_fields.append(offset)
+        offset_field = _ZIP32_LIMIT
+    extra = b""
+    if extra_fields:
+        extra = struct.pack("<HH", 0x0001, 8 * len(extra_fields)) + struct.pack(
+            "<" + "Q" * len(extra_fields), *extra_fields
+        )
+    version = 45 if extra else 20
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014B50, (3 << 8) | version, version, _FLAGS, member.method, dos_time, dos_date,
+        crc,
+        compressed_field if compressed_field is not None else compressed_size,
+        size_field if size_field is not None else member.size,
+        len(member.name_bytes), len(extra), 0, 0, 0,
+        0o100644 << 16,
+        offset_field if offset_field is not None else offset,
+    ) + member.name_bytes + extra
+
+
+def _end_records(entry_count: int, cd_offset: int, cd_size: int) -> bytes:
+    records = b""
+    if entry_count >= 0xFFFF or cd_offset >= _ZIP32_LIMIT or cd_size >= _ZIP32_LIMIT:
+        zip64_end_offset = cd_offset + cd_size
+        records += struct.pack(
+            "<IQHHIIQQQQ",
+            0x06064B50, 44, 45, 45, 0, 0,
+            entry_count, entry_count, cd_size, cd_offset,
+        )
+        records += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+    records += struct.pack(
+        "<IHHHHIIH",
+        0x06054B50, 0, 0,
+        min(entry_count, 0xFFFF), min(entry_count, 0xFFFF),
+        min(cd_size, _ZIP32_LIMIT), min(cd_offset, _ZIP32_LIMIT), 0,
+    )
+    return records
+
+
+def zip_content_length(members: Iterable[ZipMember]) -> Optional[int]:
+    """预先计算压缩包的总大小；包含需要压缩的文件时无法预知，返回 None"""
+    offset = 0
+    cd_size = 0
+    count = 0
+    for member in members:
+        if member.compress:
+            return None
+        local = len(_local_header(member))
+        descriptor = len(_data_descriptor(member, 0, member.size))
+        cd_size += len(_central_header(member, 0, member.size, offset))
+        offset += local + member.size + descriptor
+        count += 1
+    return offset + cd_size + len(_end_records(count, offset, cd_size))
+
+
+class _MemberEncoder:
+    """计算单个成员的 CRC 和压缩后大小，需要时做 DEFLATE 压缩"""
+
+    def __init__(self, member: ZipMember):
+        self.member = member
+        self.crc = 0
+        self.compressed_size = 0
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if member.compress else None
+
+    def feed(self, chunk: bytes) -> bytes:
+        self.crc = zlib.crc32(chunk, self.crc)
+        if self._compressor:
+            chunk = self._compressor.compress(chunk)
+        self.compressed_size += len(chunk)
+        return chunk
+
+    def finish(self) -> bytes:
+        """压缩器中剩余的数据加上数据描述符"""
+        tail = self._compressor.flush() if self._compressor else b""
+        self.compressed_size += len(tail)
+        return tail + _data_descriptor(self.member, self.crc, self.compressed_size)
+
+
+async def stream_zip(members: List[ZipMember], chunk_size: int = READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """逐个文件生成 ZIP 数据，内存占用与文件大小无关，不生成临时文件"""
+    offset = 0
+    central = []
+
+    for member in members:
+        header = _local_header(member)
+        member_offset = offset
+        yield header
+        offset += len(header)
+
+        encoder = _MemberEncoder(member)
+        remaining = member.size
+        async with aiofiles.open(member.path, "rb") as f:
+            while remaining > 0:
+                chunk = await f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"文件在打包过程中被修改: {member.arcname}")
+                remaining -= len(chunk)
+                chunk = encoder.feed(chunk)
+                if chunk:
+                    yield chunk
+
+        tail = encoder.finish()
+        yield tail
+        offset += encoder.compressed_size + len(_data_descriptor(member, 0, 0))
+        central.append(_central_header(member, encoder.crc, encoder.compressed_size, member_offset))
+
+    cd_offset = offset
+    cd_size = sum(len(entry) for entry in central)
+    for entry in central:
+        yield entry
+    yield _end_records(len(central), cd_offset, cd_size)
+
+
+def write_zip(members: List[ZipMember], out: BinaryIO, chunk_size: int = READ_CHUNK_SIZE) -> List[Dict]:
+    """把文件依次写入已打开的文件（同步，放在线程池中执行），格式与 stream_zip 相同
+
+    返回每个成员在压缩包中的位置（data_offset 指向文件数据的第一个字节），可以据此直接定位到单个文件。
+    """
+    offset = 0
+    central = []
+    index = []
+
+    for member in members:
+        header = _local_header(member)
+        member_offset = offset
+        out.write(header)
+        offset += len(header)
+
+        encoder = _MemberEncoder(member)
+        remaining = member.size
+        with open(member.path, "rb") as f:
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"文件在打包过程中被修改: {member.arcname}")
+                remaining -= len(chunk)
+                out.write(encoder.feed(chunk))
+
+        tail = encoder.finish()
+        out.write(tail)
+        offset += encoder.compressed_size + len(_data_descriptor(member, 0, 0))
+        central.append(_central_header(member, encoder.crc, encoder.compressed_size, member_offset))
+        index.append({
+            "name": member.arcname,
+            "offset": member_offset,
+            "data_offset": member_offset + len(header),
+            "size": member.size,
+            "compressed_size": encoder.compressed_size,
+            "method": member.method,
+            "crc": encoder.crc,
+            "mtime": member.mtime,
+        })
+
+    cd_offset = offset
+    cd_size = sum(len(entry) for entry in central)
+    for entry in central:
+        out.write(entry)
+    out.write(_end_records(len(central), cd_offset, cd_size))
+    return index
@@ -1,13 +1,38 @@
-from fastapi import FastAPI, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.security import HTTPBasicCredentials
 import os
 
-from api import tasks, upload, settings
-from core.auth import verify_admin
+from api import tasks, upload, settings, auth, events
+from core.auth import verify_admin, ensure_admin_credentials
+from core.admission import UploadAdmissionMiddleware
+from core.aio import io_executor, loop_lag_monitor, io_stats
+from core.archive import archiver
+from core.deletion import folder_deleter
+from core.events import event_bus
+from core.metrics import MetricsMiddleware, registry, CONTENT_TYPE
 
-app = FastAPI(title="文件收集系统 API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 采样事件循环延迟，用于发现阻塞事件循环的调用
+    loop_lag_monitor.start()
+    # 已完成任务的后台归档
+    archiver.start()
+    # 已删除任务目录的后台分批删除
+    folder_deleter.start()
+    # 任务统计的实时推送
+    await event_bus.start()
+    yield
+    await event_bus.stop()
+    await folder_deleter.stop()
+    await archiver.stop()
+    await loop_lag_monitor.stop()
+    io_executor.shutdown()
+
+app = FastAPI(title="文件收集系统 API", version="1.0.0", lifespan=lifespan)
+
+# 上传请求的接收前检查（放在 CORS 内层，拒绝响应也带 CORS 头）
+app.add_middleware(UploadAdmissionMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -16,13 +41,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 上传被限流时前端根据 Retry-After 自动重试
+    expose_headers=["Retry-After"],
 )
 
+# 请求耗时指标（最外层，包含其他中间件的时间）
+app.add_middleware(MetricsMiddleware)
+
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 
-# Mount static files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# 将配置中的明文密码转换为哈希
+ensure_admin_credentials()
 
 # Include routers - 受保护的路由需要添加依赖
 app.include_router(tasks.router, prefix="/api/tasks", tags=["tasks"], dependencies=[Depends(verify_admin)])
@@ -32,17 +62,54 @@ app.include_router(settings.router, prefix="/api", tags=["settings"], dependenci
 # Include public routers - 不需要认证的公开路由
 app.include_router(tasks.public_router, prefix="/api/tasks", tags=["public tasks"])
 app.include_router(settings.public_router, prefix="/api", tags=["public settings"])
+app.include_router(auth.router, prefix="/api", tags=["auth"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
 
 # 公开的不需要认证的路由
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "message": "文件收集系统 API 运行正常"}
 
+# I/O 线程池和事件循环延迟（需要认证）
+@app.get("/api/health/io", dependencies=[Depends(verify_admin)])
+async def health_io():
+    return io_stats()
+
+# Prometheus 指标（多 worker 时每次抓取由其中一个进程响应）
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
 # 添加认证检查端点
 @app.get("/api/auth/check")
 async def auth_check(username: str = Depends(verify_admin)):
     return {"authenticated": True, "username": username}
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="文件收集系统 API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("FASTUP_WORKERS", "1")),
+        help="worker 进程数（任务、配额和会话保存在 SQLite 中，配置和白名单写入使用文件锁，多个进程可以同时运行）"
+    )
+    args = parser.parse_args()
+    if args.workers > 1:
+        import socket
+        from uvicorn.supervisors import Multiprocess
+
+        # 任务变化通过 tasks.db 中的事件表通知所有 worker
+        os.environ.setdefault("FASTUP_EVENT_FANOUT", "sqlite")
+
+        # 多进程时 uvicorn 需要以导入路径的方式加载应用
+        config = uvicorn.Config("main:app", host=args.host, port=args.port, workers=args.workers)
+        sock = config.bind_socket()
+        # worker 从共享的监听套接字接受连接时，asyncio 不会给连接设置 TCP_NODELAY，
+        # 保持连接上的每个响应都会被 Nagle 算法和延迟确认拖慢约 40ms；在监听套接字上设置，由新连接继承
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        Multiprocess(config, sockets=[sock]).run()
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
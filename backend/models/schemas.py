@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
@@ -12,6 +12,16 @@ class TaskCreate(BaseModel):
     name: str
     description: Optional[str] = None
     
+class TaskBatchCreate(BaseModel):
+    tasks: List[TaskCreate] = Field(..., min_length=1, max_length=1000)
+
+class TaskBatchStatus(BaseModel):
+    task_ids: List[str] = Field(..., min_length=1, max_length=1000)
+    status: TaskStatus
+
+class TaskBatchDelete(BaseModel):
+    task_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
 class TaskResponse(BaseModel):
     id: str
     name: str
@@ -20,6 +30,7 @@ class TaskResponse(BaseModel):
     folder_path: str
     created_at: datetime
     uploaded_files_count: int = 0
+    archived_at: Optional[datetime] = None  # 已完成的任务被打包归档的时间
     
     class Config:
         from_attributes = True